@@ -0,0 +1,214 @@
+from typing import List, Dict, Optional, Tuple
+import json
+import sqlite3
+import threading
+import time
+import os
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 全部知识库的版本号，任一知识库有写入时递增；自动路由范围内的回答依赖它
+ALL_KBS = "*"
+
+class AnswerCache:
+    """语义回答缓存：按问题向量的余弦相似度查找历史问题，复用其回答和引用文档
+
+    条目超过 TTL 后失效；检索范围内（自动路由时为全部知识库）或回答引用的任一知识库有新的写入时，
+    相关条目自动失效。
+    """
+    def __init__(self, db_path: str = None, threshold: float = None, ttl: float = None, max_entries: int = None):
+        self.db_path = db_path or os.getenv("ANSWER_CACHE_PATH", "./cache/answers.sqlite")
+        self.threshold = threshold if threshold is not None else float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+        self.max_entries = max_entries or int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                docs TEXT NOT NULL,
+                kb_versions TEXT NOT NULL,
+                latency REAL NOT NULL,
+                created_at REAL NOT NULL,
+                scope TEXT NOT NULL DEFAULT ''
+            )"""
+        )
+        # 每个知识库的版本号，写入文档时递增；多个进程共享同一份记录
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS kb_versions (
+                index_name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+        # 向量常驻内存，查找时一次矩阵乘法完成
+        self._ids: List[int] = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._load()
+
+    def _load(self) -> None:
+        now = time.time()
+        self._conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+        self._conn.commit()
+        rows = self._conn.execute("SELECT id, vector FROM answers ORDER BY id").fetchall()
+        vectors = [np.frombuffer(row[1], dtype=np.float32) for row in rows]
+        # 更换 embedding 模型后新旧向量维度不同，只保留与最新条目维度相同的条目
+        if vectors:
+            dims = vectors[-1].shape[0]
+            mismatched = [row[0] for row, vector in zip(rows, vectors) if vector.shape[0] != dims]
+            if mismatched:
+                self._conn.executemany("DELETE FROM answers WHERE id = ?", [(entry_id,) for entry_id in mismatched])
+                self._conn.commit()
+                rows, vectors = zip(*[(row, vector) for row, vector in zip(rows, vectors) if vector.shape[0] == dims])
+        self._ids = [row[0] for row in rows]
+        if vectors:
+            self._matrix = np.vstack(vectors)
+        else:
+            self._matrix = np.zeros((0, 0), dtype=np.float32)
+
+    @staticmethod
+    def _scope(index_names: Optional[List[str]]) -> str:
+        """检索范围的键，空字符串表示由知识库路由选择"""
+        return ",".join(sorted(set(index_names))) if index_names else ""
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm > 0 else array
+
+    def _kb_versions(self, index_names: List[str]) -> Dict[str, int]:
+        if not index_names:
+            return {}
+        placeholders = ",".join("?" * len(index_names))
+        rows = self._conn.execute(
+            f"SELECT index_name, version FROM kb_versions WHERE index_name IN ({placeholders})",
+            list(index_names)
+        ).fetchall()
+        versions = {name: 0 for name in index_names}
+        versions.update(dict(rows))
+        return versions
+
+    def invalidate_index(self, index_name: str) -> None:
+        """知识库内容变化时调用，使检索范围包含该知识库的缓存回答失效"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO kb_versions (index_name, version) VALUES (?, 1) "
+                "ON CONFLICT(index_name) DO UPDATE SET version = version + 1",
+                [(index_name,), (ALL_KBS,)]
+            )
+            self._conn.commit()
+
+    def _delete(self, entry_ids: List[int]) -> None:
+        """删除条目（调用方需持有锁）"""
+        if not entry_ids:
+            return
+        self._conn.executemany("DELETE FROM answers WHERE id = ?", [(entry_id,) for entry_id in entry_ids])
+        self._conn.commit()
+        removed = set(entry_ids)
+        keep = [pos for pos, entry_id in enumerate(self._ids) if entry_id not in removed]
+        self._ids = [self._ids[pos] for pos in keep]
+        self._matrix = self._matrix[keep] if keep else np.zeros((0, 0), dtype=np.float32)
+
+    def _drop_other_dims(self, dims: int) -> None:
+        """删除与问题向量维度不同的条目（embedding 模型更换后的旧条目，调用方需持有锁）"""
+        if self._ids and self._matrix.shape[1] != dims:
+            print(f"回答缓存中的向量维度（{self._matrix.shape[1]}）与当前问题向量（{dims}）不同，清除旧条目")
+            self._delete(list(self._ids))
+
+    def lookup(self, query_vector: List[float], index_names: List[str] = None) -> Optional[Tuple[str, List[Dict], float]]:
+        """查找相似问题，命中时返回 (回答, 引用文档, 相似度)
+
+        只返回在相同检索范围（index_names，未指定时为自动路由）下生成的回答。
+        """
+        scope = self._scope(index_names)
+        started = time.time()
+        query = self._normalize(query_vector)
+        with self._lock:
+            self._drop_other_dims(query.shape[0])
+            if not self._ids:
+                self.misses += 1
+                return None
+            similarities = self._matrix @ query
+            now = time.time()
+            stale = []
+            # 从最相似的条目开始检查，跳过已过期或已失效的条目
+            for pos in np.argsort(-similarities):
+                similarity = float(similarities[pos])
+                if similarity < self.threshold:
+                    break
+                entry_id = self._ids[pos]
+                row = self._conn.execute(
+                    "SELECT answer, docs, kb_versions, latency, created_at, scope FROM answers WHERE id = ?",
+                    (entry_id,)
+                ).fetchone()
+                if row is None:
+                    stale.append(entry_id)
+                    continue
+                answer, docs, kb_versions, latency, created_at, entry_scope = row
+                if entry_scope != scope:
+                    continue
+                kb_versions = json.loads(kb_versions)
+                if now - created_at > self.ttl or self._kb_versions(list(kb_versions)) != kb_versions:
+                    stale.append(entry_id)
+                    continue
+                self._delete(stale)
+                self.hits += 1
+                self.saved_seconds += max(0.0, latency - (time.time() - started))
+                return answer, json.loads(docs), similarity
+            self._delete(stale)
+            self.misses += 1
+            return None
+
+    def put(self, question: str, query_vector: List[float], answer: str, docs: List[Dict], latency: float,
+            index_names: List[str] = None) -> None:
+        """保存回答；latency 为完整检索+生成耗时，用于统计命中后节省的时间，index_names 为检索范围"""
+        vector = self._normalize(query_vector)
+        scope = self._scope(index_names)
+        # 记录检索范围内和回答引用到的全部知识库的当前版本；自动路由时范围为全部知识库
+        scope_names = set(index_names) if index_names else {ALL_KBS}
+        scope_names.update(doc[key] for doc in docs for key in ('index', 'index_name') if doc.get(key))
+        with self._lock:
+            self._drop_other_dims(vector.shape[0])
+            kb_versions = self._kb_versions(sorted(scope_names))
+            cursor = self._conn.execute(
+                "INSERT INTO answers (question, vector, answer, docs, kb_versions, latency, created_at, scope) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (question, vector.tobytes(), answer, json.dumps(docs, ensure_ascii=False),
+                 json.dumps(kb_versions), latency, time.time(), scope)
+            )
+            self._conn.commit()
+            self._ids.append(cursor.lastrowid)
+            if self._matrix.size == 0:
+                self._matrix = vector.reshape(1, -1)
+            else:
+                self._matrix = np.vstack([self._matrix, vector])
+            # 超出条目上限时删除最早的条目
+            overflow = len(self._ids) - self.max_entries
+            if overflow > 0:
+                self._delete(self._ids[:overflow])
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._ids),
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
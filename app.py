@@ -1,19 +1,59 @@
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Iterator, Optional
 import os
+import time
 import argparse
-from document_processor import DocumentProcessor
 from vector_store import VectorStore
 from retriever import Retriever
 from reranker import Reranker
 from generator import Generator
+from ingest_manifest import IngestManifest, file_hash
+from ingest_pipeline import IngestPipeline
+from answer_cache import AnswerCache
+from metrics import QueryTrace, track, start_metrics_server
 
 class RAGSystem:
-    def __init__(self):
-        self.doc_processor = DocumentProcessor()
-        self.vector_store = VectorStore()
+    def __init__(self, query_only: bool = None):
+        """query_only=True 时为只读问答模式，不能处理文档，文档解析相关的依赖（langchain、Pillow 等）不会被导入；
+        默认模式下入库组件也在第一次使用时才创建，未设置时读取 RAG_QUERY_ONLY
+        """
+        if query_only is None:
+            query_only = os.getenv("RAG_QUERY_ONLY", "false").lower() in ("1", "true", "yes")
+        self.query_only = query_only
+        self._doc_processor = None
+        self._vector_store = None
+        self._ingest_pipeline = None
         self.retriever = Retriever()
         self.reranker = Reranker()
         self.generator = Generator()
+        use_answer_cache = os.getenv("ANSWER_CACHE", "true").lower() not in ("0", "false", "no")
+        self.answer_cache = AnswerCache() if use_answer_cache else None
+        # METRICS_PORT 非 0 时在后台提供 /metrics
+        start_metrics_server()
+    
+    @property
+    def doc_processor(self):
+        if self._doc_processor is None:
+            self._require_ingest()
+            from document_processor import DocumentProcessor
+            self._doc_processor = DocumentProcessor()
+        return self._doc_processor
+    
+    @property
+    def vector_store(self) -> VectorStore:
+        # 只读模式下也用于列出知识库中的文件
+        if self._vector_store is None:
+            self._vector_store = VectorStore()
+        return self._vector_store
+    
+    @property
+    def ingest_pipeline(self) -> IngestPipeline:
+        if self._ingest_pipeline is None:
+            self._ingest_pipeline = IngestPipeline(self.doc_processor, self.vector_store)
+        return self._ingest_pipeline
+    
+    def _require_ingest(self) -> None:
+        if self.query_only:
+            raise Exception("当前为只读问答模式（query_only），不能处理文档")
     
     def show_indexed_files(self) -> List[str]:
         """显示已索引的文件"""
@@ -39,27 +79,95 @@ class RAGSystem:
             print("-" * 50)
         return indices
     
-    def process_documents(self, documents_path: str, index_name: str) -> None:
-        """处理并索引文档到指定知识库"""
+    def process_documents(self, documents_path: str, index_name: str, incremental: bool = False) -> None:
+        """处理并索引文档到指定知识库
+
+        incremental=True 时根据文件清单跳过未变化的文件，替换已修改文件的片段，
+        并删除路径下已被移除的文件对应的片段。
+        """
+        self._require_ingest()
+        with track("ingest", incremental=str(incremental).lower()):
+            self._process_documents(documents_path, index_name, incremental)
+    
+    def _process_documents(self, documents_path: str, index_name: str, incremental: bool) -> None:
+        from document_processor import normalize_path
         print(f"开始处理文档: {documents_path}")
-        # 处理文档
-        processed_docs = self.doc_processor.process(documents_path)
-        print(f"文档处理完成，共处理 {len(processed_docs)} 个文档片段")
+        index_name = f"rag_{index_name}"
+        manifest = IngestManifest(index_name)
+        
+        # 计算每个文件的内容哈希，确定需要处理的文件
+        file_paths = self.doc_processor.list_files(documents_path)
+        file_hashes = {}
+        for file_path in file_paths:
+            try:
+                file_hashes[file_path] = file_hash(file_path)
+            except OSError as e:
+                print(f"警告：读取文件 {file_path} 时出错: {str(e)}")
         
-        # 存储到向量数据库
+        if incremental:
+            changed_files = [f for f, h in file_hashes.items() if not manifest.is_unchanged(f, h)]
+            removed_files = [f for f in manifest.files_under(normalize_path(documents_path)) if f not in file_hashes]
+            print(f"增量同步：{len(changed_files)} 个文件需要处理，"
+                  f"{len(file_hashes) - len(changed_files)} 个文件未变化，{len(removed_files)} 个文件已删除")
+        else:
+            changed_files = list(file_hashes.keys())
+            removed_files = []
+        
+        # 处理文档并存储到向量数据库
         print(f"正在将文档存入知识库（{index_name}）...")
-        self.vector_store.store(processed_docs, f"rag_{index_name}")
+        failed_files: List[str] = []
+        new_chunk_ids: Dict[str, List[str]] = {}
+        if os.path.isdir(documents_path) or incremental:
+            # 加载、分块、向量化和写入以流水线方式并行进行
+            result = self.ingest_pipeline.run(changed_files, index_name)
+            failed_files.extend(result['failed_files'])
+            new_chunk_ids = result['chunk_ids']
+        else:
+            processed_docs = self.doc_processor.process(documents_path)
+            result = self.vector_store.store(processed_docs, index_name)
+            for doc in processed_docs:
+                new_chunk_ids.setdefault(doc['metadata']['source'], []).append(doc['id'])
+        print(f"文档处理完成，共写入 {result['indexed']} 个文档片段")
+        
+        # 写入失败的片段所属文件不更新清单，下次同步时重试
+        failed_ids = {item.get('index', {}).get('_id') for item in result['errors']}
+        if failed_ids:
+            failed_files.extend(source for source, ids in new_chunk_ids.items() if failed_ids.intersection(ids))
+        
+        # 更新清单，删除已修改文件的旧片段和已删除文件的片段
+        stale_ids = []
+        for file_path in changed_files:
+            if file_path in failed_files:
+                # 加载或写入失败的文件保留旧记录，下次同步时重试
+                continue
+            ids = list(dict.fromkeys(new_chunk_ids.get(file_path, [])))
+            old_entry = manifest.get(file_path)
+            if old_entry:
+                keep = set(ids)
+                stale_ids.extend(cid for cid in old_entry.get('chunk_ids', []) if cid not in keep)
+            manifest.update(file_path, file_hashes[file_path], ids)
+        for file_path in removed_files:
+            stale_ids.extend(manifest.remove(file_path))
+        
+        if stale_ids:
+            print(f"正在删除 {len(stale_ids)} 个过期文档片段...")
+            self.vector_store.delete_chunks(index_name, stale_ids)
+        manifest.save()
+        
+        # 知识库内容变化后，引用该知识库的缓存回答失效
+        if self.answer_cache is not None and (result['indexed'] or stale_ids):
+            self.answer_cache.invalidate_index(index_name)
         print("文档存储完成！")
     
-    def query(self, query: str) -> Tuple[str, List[Dict]]:
-        """处理用户查询，返回生成的回答和引用的文档列表"""
+    def _retrieve_context(self, query: str, index_names: List[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """检索并重排序文档，返回 (参考文档, 无法回答时的提示信息)"""
         print("\n正在检索相关文档...")
         # 检索相关文档
-        retrieved_docs, index_name = self.retriever.retrieve(query)
+        retrieved_docs, index_name = self.retriever.retrieve(query, indices=index_names)
         
         if not retrieved_docs:
              print("警告：未能检索到相关文档。")
-             return "抱歉，我没有找到与您问题相关的文档。", []
+             return [], "抱歉，我没有找到与您问题相关的文档。"
 
         print("正在重排序文档...")
         # 重排序
@@ -69,12 +177,94 @@ class RAGSystem:
              print("警告：重排序后没有文档留下。")
              reranked_docs = retrieved_docs[:5]
              if not reranked_docs:
-                 return "抱歉，处理文档时遇到问题，无法生成回答。", []
+                 return [], "抱歉，处理文档时遇到问题，无法生成回答。"
+        
+        return reranked_docs, None
+    
+    def _lookup_answer(self, query: str, index_names: List[str] = None) -> Tuple[Optional[Tuple[str, List[Dict]]], Optional[List[float]]]:
+        """在语义回答缓存中查找相似问题，返回 (缓存的回答和文档, 问题向量)"""
+        if self.answer_cache is None:
+            return None, None
+        query_vector = self.retriever.get_embedding(query)
+        cached = self.answer_cache.lookup(query_vector, index_names)
+        if cached is None:
+            return None, query_vector
+        answer, docs, similarity = cached
+        print(f"命中回答缓存（相似度 {similarity:.3f}）")
+        return (answer, docs), query_vector
+    
+    def _store_answer(self, query: str, query_vector: Optional[List[float]], answer: str,
+                      docs: List[Dict], started: float, index_names: List[str] = None) -> None:
+        if self.answer_cache is not None and query_vector is not None and docs:
+            self.answer_cache.put(query, query_vector, answer, docs, time.time() - started, index_names)
+    
+    def query(self, query: str, index_names: List[str] = None) -> Tuple[str, List[Dict]]:
+        """处理用户查询，返回生成的回答和引用的文档列表
+
+        index_names 指定检索范围（例如界面中选中的知识库），未指定时由知识库路由选择。
+        """
+        started = time.time()
+        trace = QueryTrace(query, stream=False, scope=index_names or "routed")
+        with trace.activate(finish=True):
+            cached, query_vector = self._lookup_answer(query, index_names)
+            trace.fields['answer_cache_hit'] = cached is not None
+            if cached:
+                return cached
+            
+            reranked_docs, message = self._retrieve_context(query, index_names)
+            trace.fields['docs'] = len(reranked_docs)
+            if message:
+                return message, []
+
+            print("正在生成回答...\n")
+            # 生成回答
+            response = self.generator.generate(query, reranked_docs)
+            self._store_answer(query, query_vector, response, reranked_docs, started, index_names)
+            return response, reranked_docs
+    
+    def query_stream(self, query: str, index_names: List[str] = None) -> Tuple[Iterator[str], List[Dict]]:
+        """处理用户查询的流式版本：检索和重排序完成后返回逐段生成回答的迭代器和引用的文档列表"""
+        started = time.time()
+        trace = QueryTrace(query, stream=True, scope=index_names or "routed")
+        with trace.activate():
+            cached, query_vector = self._lookup_answer(query, index_names)
+            trace.fields['answer_cache_hit'] = cached is not None
+            if cached:
+                trace.finish()
+                return iter([cached[0]]), cached[1]
+            
+            reranked_docs, message = self._retrieve_context(query, index_names)
+            trace.fields['docs'] = len(reranked_docs)
+            if message:
+                trace.finish()
+                return iter([message]), []
 
         print("正在生成回答...\n")
-        # 生成回答
-        response = self.generator.generate(query, reranked_docs)
-        return response, reranked_docs
+        
+        def stream_and_store():
+            # 完整生成后再写入缓存，中途中断的回答不会被缓存
+            # 迭代器可能在其他线程中被消费，因此每取一段都重新激活本次查询的记录
+            tokens = []
+            stream = self.generator.generate_stream(query, reranked_docs)
+            status = "ok"
+            try:
+                while True:
+                    with trace.activate():
+                        token = next(stream, None)
+                    if token is None:
+                        break
+                    tokens.append(token)
+                    yield token
+                self._store_answer(query, query_vector, "".join(tokens), reranked_docs, started, index_names)
+            except GeneratorExit:
+                status = "cancelled"
+                with trace.activate():
+                    stream.close()
+                raise
+            finally:
+                trace.finish(status)
+        
+        return stream_and_store(), reranked_docs
 
 def main():
     # 初始化RAG系统
@@ -113,10 +303,12 @@ def main():
                         continue
                     
                     try:
-                        # 获取回答
-                        response, reranked_docs = rag_system.query(query)
+                        # 流式获取回答，边生成边输出
+                        response_stream, reranked_docs = rag_system.query_stream(query)
                         print("\n回答：")
-                        print(response)
+                        for token in response_stream:
+                            print(token, end="", flush=True)
+                        print()
                         print("\n引用的文档：")
                         print(reranked_docs)
                     except Exception as e:
@@ -175,7 +367,7 @@ def main():
                         continue
                     
                     selected_index = indices[idx][4:] if indices[idx].startswith('rag_') else indices[idx]
-                    rag_system.process_documents(docs_path, selected_index)
+                    rag_system.process_documents(docs_path, selected_index, incremental=True)
                     print("文档添加成功！")
                 except ValueError:
                     print("请输入有效的数字！")
@@ -0,0 +1,419 @@
+from typing import List, Dict, Tuple, Optional, AsyncIterator
+import asyncio
+import heapq
+import json
+import time
+import os
+import aiohttp
+from dotenv import load_dotenv
+from retriever import Retriever
+from reranker import Reranker
+from generator import Generator
+from http_client import get_client, RETRY_STATUS
+from metrics import QueryTrace, track, record_duration, get_metrics
+
+load_dotenv()
+
+class AsyncRAGSystem:
+    """基于 asyncio 的查询链路：aiohttp + AsyncElasticsearch
+
+    一个事件循环可以同时处理多个查询；查询向量化与 BM25 检索并发进行，
+    每个阶段都有独立的超时时间，超时或被取消时会一并取消同一查询中未完成的任务。
+    检索配置、查询体和结果解析复用同步版本的 Retriever / Reranker / Generator。
+    使用本地存储后端时不创建 Elasticsearch 客户端，检索在线程池中调用同步接口完成。
+    各阶段的耗时记录与同步版本相同，每次查询结束时写一行查询日志。
+    """
+    def __init__(self):
+        self.retriever = Retriever()
+        self.reranker = Reranker()
+        self.generator = Generator()
+        self.embedder = self.retriever.embedder
+        self.backend = self.retriever.backend
+        self.api_key = os.getenv("API_KEY")
+        self.api_base = os.getenv("BASE_URL")
+        self.es = None
+        if self.backend.name == "elasticsearch":
+            from elasticsearch import AsyncElasticsearch
+            self.es = AsyncElasticsearch(
+                "https://localhost:9200",
+                basic_auth=("elastic", os.getenv("PASSWORD")),
+                verify_certs=False
+            )
+        self._session: Optional[aiohttp.ClientSession] = None
+        # 超时、重试和限速配置与同步的 HttpClient 相同，令牌桶与其共用
+        self.client = get_client()
+        self.rate_limiter = self.client.rate_limiter
+        # 各阶段超时时间（秒）
+        self.embed_timeout = float(os.getenv("ASYNC_EMBED_TIMEOUT", "10"))
+        self.search_timeout = float(os.getenv("SEARCH_TIMEOUT", "10"))
+        self.rerank_timeout = float(os.getenv("ASYNC_RERANK_TIMEOUT", "15"))
+        self.generate_timeout = float(os.getenv("ASYNC_GENERATE_TIMEOUT", "120"))
+
+    async def __aenter__(self) -> "AsyncRAGSystem":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        if self.es is not None:
+            await self.es.close()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """所有查询共享一个连接池"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                },
+                connector=aiohttp.TCPConnector(limit=int(os.getenv("ASYNC_HTTP_POOL_SIZE", "100"))),
+                timeout=aiohttp.ClientTimeout(connect=self.client.connect_timeout, sock_read=self.client.read_timeout)
+            )
+        return self._session
+
+    async def _acquire_rate_limit(self) -> None:
+        """与同步调用共享全局令牌桶，避免异步查询挤占入库阶段的配额；等待时不占用线程"""
+        delay = self.rate_limiter.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _request(self, path: str, payload: Dict, category: str) -> aiohttp.ClientResponse:
+        """POST 到 {BASE_URL}{path}，与 HttpClient.post 相同地对 429、5xx 和连接错误做退避重试
+
+        返回最后一次的响应，由调用方检查状态码并释放。
+        """
+        client = self.client
+        url = f"{self.api_base}{path}"
+        for attempt in range(client.max_retries + 1):
+            await self._acquire_rate_limit()
+            try:
+                response = await self._get_session().post(url, json=payload)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= client.max_retries:
+                    raise
+                delay = client._backoff(attempt, None)
+                get_metrics().count("http_retry", category=category, reason=type(e).__name__)
+                print(f"{category} 请求失败（{type(e).__name__}），{delay:.1f}s 后重试（{attempt + 1}/{client.max_retries}）")
+                await asyncio.sleep(delay)
+                continue
+
+            if response.status not in RETRY_STATUS or attempt >= client.max_retries:
+                return response
+
+            delay = client._backoff(attempt, response)
+            get_metrics().count("http_retry", category=category, reason=str(response.status))
+            print(f"{category} 请求返回 {response.status}，{delay:.1f}s 后重试（{attempt + 1}/{client.max_retries}）")
+            response.release()
+            await asyncio.sleep(delay)
+        return response
+
+    async def _post(self, path: str, payload: Dict, error_prefix: str, category: str) -> Dict:
+        async with await self._request(path, payload, category) as response:
+            if response.status != 200:
+                raise Exception(f"{error_prefix}: {await response.text()}")
+            return await response.json()
+
+    # --- embedding ---
+    async def get_embedding(self, text: str) -> List[float]:
+        """获取查询向量，先查共享的 embedding 缓存"""
+        cache = self.embedder.cache
+        if cache is not None:
+            # SQLite 缓存是同步接口，放到线程池中执行避免阻塞事件循环
+            cached = await asyncio.to_thread(cache.get, self.embedder.model, text)
+            if cached is not None:
+                get_metrics().count("embedding_cache_hit")
+                return cached
+
+        with track("embedding") as span:
+            span.set(payload_bytes=len(text.encode('utf-8')), items=1)
+            data = await self._post(
+                "/embeddings",
+                {"model": self.embedder.model, "input": text},
+                "Error getting embedding",
+                "embedding"
+            )
+            span.set(input=(data.get("usage") or {}).get("total_tokens"))
+        vector = data["data"][0]["embedding"]
+        if cache is not None:
+            await asyncio.to_thread(cache.put, self.embedder.model, text, vector)
+        return vector
+
+    # --- 检索 ---
+    async def get_all_indices(self) -> List[str]:
+        """获取所有 RAG 相关的索引"""
+        indices = await self.es.indices.get_alias()
+        return [idx for idx in indices.keys() if idx.startswith('rag_')]
+
+    async def _msearch(self, indices: List[str], bodies: List[Dict], mode: str) -> List[Dict]:
+        searches = []
+        for index, body in zip(indices, bodies):
+            searches.append({"index": index})
+            searches.append(body)
+        response = await self.es.options(request_timeout=self.search_timeout).msearch(searches=searches)
+        self.backend._record_index_stats(indices, response['responses'], mode)
+        return response['responses']
+
+    def _bm25_body(self, query: str, top_k: int) -> Dict:
+        return {
+            "query": {"match": {"content": query}},
+            "_source": {"excludes": ["vector"]},
+            "size": top_k
+        }
+
+    def _knn_body(self, query_vector: List[float], top_k: int) -> Dict:
+        return {
+            "knn": {
+                "field": "vector",
+                "query_vector": query_vector,
+                "k": top_k,
+                "num_candidates": max(self.backend.num_candidates, top_k)
+            },
+            "_source": {"excludes": ["vector"]},
+            "size": top_k
+        }
+
+    async def _hybrid_search(self, indices: List[str], query: str, top_k: int,
+                             query_vector: List[float] = None, errors: Dict[str, object] = None) -> List[Dict]:
+        """BM25 检索与查询向量化并发进行，向量就绪后再执行 knn 检索，分数按权重合并
+
+        检索失败的索引记录到 errors 中。
+        """
+        bm25_task = asyncio.create_task(
+            asyncio.wait_for(self._msearch(indices, [self._bm25_body(query, top_k)] * len(indices), "bm25"), self.search_timeout)
+        )
+        try:
+            if query_vector is None:
+                query_vector = await asyncio.wait_for(self.get_embedding(query), self.embed_timeout)
+            knn_responses = await asyncio.wait_for(
+                self._msearch(indices, [self._knn_body(query_vector, top_k)] * len(indices), "knn"),
+                self.search_timeout
+            )
+            bm25_responses = await bm25_task
+        finally:
+            bm25_task.cancel()
+
+        merged: Dict[Tuple[str, str], Dict] = {}
+        fallback_indices = []
+        for index, bm25_response, knn_response in zip(indices, bm25_responses, knn_responses):
+            if 'error' in knn_response:
+                # 旧索引的向量字段未建立 HNSW 索引时，退回 script_score 检索
+                fallback_indices.append(index)
+            else:
+                for hit in self.backend._parse_hits(knn_response, index):
+                    hit['score'] *= self.backend.knn_boost
+                    merged[(index, hit['id'])] = hit
+            if 'error' in bm25_response:
+                # 与同步版本一样记为该索引出错，全部索引都出错时由 _check_errors 抛出异常
+                print(f"检索索引 {index} 时出错: {bm25_response['error']}")
+                if errors is not None:
+                    errors[index] = bm25_response['error']
+                continue
+            if index in fallback_indices:
+                continue
+            for hit in self.backend._parse_hits(bm25_response, index):
+                score = hit['score'] * self.backend.bm25_boost
+                key = (index, hit['id'])
+                if key in merged:
+                    merged[key]['score'] += score
+                else:
+                    hit['score'] = score
+                    merged[key] = hit
+
+        results = list(merged.values())
+        if fallback_indices:
+            # 与 knn 混合检索相同的打分方式，分数可以直接合并
+            body = self.backend._build_fallback_body(query, query_vector, top_k)
+            results.extend(await self._script_score_search(fallback_indices, body, errors, "fallback"))
+        return results
+
+    async def _script_score_search(self, indices: List[str], body: Dict, errors: Dict[str, object] = None,
+                                   mode: str = "script_score") -> List[Dict]:
+        responses = await asyncio.wait_for(self._msearch(indices, [body] * len(indices), mode), self.search_timeout)
+        results = []
+        for index, response in zip(indices, responses):
+            if 'error' in response:
+                print(f"检索索引 {index} 时出错: {response['error']}")
+                if errors is not None:
+                    errors[index] = response['error']
+                continue
+            results.extend(self.backend._parse_hits(response, index))
+        return results
+
+    async def retrieve(self, query: str, top_k: int = 10, indices: List[str] = None) -> Tuple[List[Dict], str]:
+        """混合检索：结合 BM25 和向量检索；indices 为指定的检索范围，未指定时由知识库路由选择"""
+        if self.es is None:
+            # to_thread 会复制当前上下文，同步接口中记录的阶段仍归入本次查询
+            return await asyncio.wait_for(
+                asyncio.to_thread(self.retriever.retrieve, query, top_k, indices),
+                self.embed_timeout + self.search_timeout
+            )
+        query_vector = None
+        if not indices:
+            indices = await asyncio.wait_for(self.get_all_indices(), self.search_timeout)
+            if not indices:
+                raise Exception("没有找到可用的文档索引！")
+            if self.retriever.router.needs_routing(indices):
+                # 路由需要查询向量，此时 BM25 检索不再与向量化并发
+                query_vector = await asyncio.wait_for(self.get_embedding(query), self.embed_timeout)
+                indices = await asyncio.to_thread(self.retriever.route, indices, query, query_vector)
+
+        errors: Dict[str, object] = {}
+        with track("search", backend=self.backend.name) as span:
+            if self.backend.retrieval_mode == "knn":
+                all_results = await self._hybrid_search(indices, query, top_k, query_vector, errors)
+            else:
+                if query_vector is None:
+                    query_vector = await asyncio.wait_for(self.get_embedding(query), self.embed_timeout)
+                body = self.backend._build_script_score_body(query, query_vector, top_k)
+                all_results = await self._script_score_search(indices, body, errors)
+            self.backend._check_errors(indices, errors)
+            span.set(items=len(all_results))
+
+        # 用堆选出分数最高的 top_k 个文档
+        top_results = heapq.nlargest(top_k, all_results, key=lambda x: x['score'])
+        most_relevant_index = top_results[0]['index'] if top_results else indices[0]
+        return top_results, most_relevant_index
+
+    # --- 重排序与生成 ---
+    async def rerank(self, query: str, documents: List[Dict], index_name: str, top_k: int = 5) -> List[Dict]:
+        """与同步版本相同：检索分数差距足够大时跳过，已缓存分数的文档不再重复打分"""
+        reranker = self.reranker
+        if not documents:
+            return []
+        if reranker._is_decisive(documents, top_k):
+            return reranker._select_by_retrieval(documents, index_name, top_k)
+
+        scores, missing = await asyncio.to_thread(reranker._cached_scores, query, documents)
+        get_metrics().count("rerank_cache_hit", len(scores))
+        if missing:
+            payload = reranker._build_payload(query, [documents[pos] for pos in missing], len(missing))
+            with track("rerank") as span:
+                span.set(payload_bytes=sum(len(doc.encode('utf-8')) for doc in payload["documents"]), items=len(missing))
+                data = await asyncio.wait_for(self._post("/rerank", payload, "Error in reranking", "rerank"), self.rerank_timeout)
+            await asyncio.to_thread(reranker._apply_results, query, documents, missing, data["results"], scores)
+        return reranker._select(documents, scores, index_name, top_k)
+
+    async def generate(self, query: str, context_docs: List[Dict]) -> str:
+        payload = self.generator._build_payload(query, context_docs)
+        with track("generate") as span:
+            span.set(payload_bytes=len(json.dumps(payload, ensure_ascii=False).encode('utf-8')), items=len(context_docs))
+            data = await asyncio.wait_for(
+                self._post("/chat/completions", payload, "Error in generation", "chat"),
+                self.generate_timeout
+            )
+            answer = data["choices"][0]["message"]["content"]
+            self.generator._record_usage(span, payload, data.get("usage"), answer)
+        return answer
+
+    async def generate_stream(self, query: str, context_docs: List[Dict]) -> AsyncIterator[str]:
+        """以 SSE 流式生成回答；generate_timeout 为整个生成过程的时间上限"""
+        payload = self.generator._build_payload(query, context_docs)
+        payload["stream"] = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.generate_timeout
+        # 首 token 延迟从发出请求开始计算
+        started = time.perf_counter()
+
+        with track("generate", stream="true") as span:
+            span.set(payload_bytes=len(json.dumps(payload, ensure_ascii=False).encode('utf-8')), items=len(context_docs))
+            async with await self._request("/chat/completions", payload, "chat") as response:
+                if response.status != 200:
+                    raise Exception(f"Error in generation: {await response.text()}")
+                tokens = []
+                usage = None
+                async for token, usage in self._iter_sse(response, deadline):
+                    if not token:
+                        continue
+                    if not tokens:
+                        # 首个 token 的等待时间单独记录
+                        record_duration("generate_first_token", time.perf_counter() - started)
+                    tokens.append(token)
+                    yield token
+                self.generator._record_usage(span, payload, usage, "".join(tokens))
+
+    @staticmethod
+    async def _iter_sse(response: aiohttp.ClientResponse, deadline: float) -> AsyncIterator[Tuple[Optional[str], Optional[Dict]]]:
+        """逐个解析 SSE 事件，返回 (文本片段, 截至目前的 usage)；超过 deadline 时抛出超时"""
+        loop = asyncio.get_running_loop()
+        usage = None
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError("生成回答超时")
+            raw_line = await asyncio.wait_for(response.content.readline(), remaining)
+            if not raw_line:
+                return
+            line = raw_line.decode('utf-8').strip()
+            # SSE 格式：每个事件以 "data: " 开头，以 "[DONE]" 结束
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                return
+            event = json.loads(data)
+            usage = event.get("usage") or usage
+            choices = event.get("choices") or []
+            # 只带 usage 的最后一个事件也要返回
+            yield ((choices[0].get("delta") or {}).get("content") if choices else None), usage
+
+    async def _retrieve_context(self, query: str, index_names: List[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        retrieved_docs, index_name = await self.retrieve(query, indices=index_names)
+        if not retrieved_docs:
+            return [], "抱歉，我没有找到与您问题相关的文档。"
+
+        reranked_docs = await self.rerank(query, retrieved_docs, index_name)
+        if not reranked_docs:
+            reranked_docs = retrieved_docs[:5]
+            if not reranked_docs:
+                return [], "抱歉，处理文档时遇到问题，无法生成回答。"
+        return reranked_docs, None
+
+    async def query(self, query: str, index_names: List[str] = None) -> Tuple[str, List[Dict]]:
+        """处理用户查询，返回生成的回答和引用的文档列表；index_names 为指定的检索范围"""
+        trace = QueryTrace(query, stream=False, scope=index_names or "routed", pipeline="async")
+        with trace.activate(finish=True):
+            reranked_docs, message = await self._retrieve_context(query, index_names)
+            trace.fields['docs'] = len(reranked_docs)
+            if message:
+                return message, []
+            return await self.generate(query, reranked_docs), reranked_docs
+
+    async def query_stream(self, query: str, index_names: List[str] = None) -> Tuple[AsyncIterator[str], List[Dict]]:
+        """流式版本：检索和重排序完成后返回逐段生成回答的异步迭代器和引用的文档列表"""
+        trace = QueryTrace(query, stream=True, scope=index_names or "routed", pipeline="async")
+        with trace.activate():
+            reranked_docs, message = await self._retrieve_context(query, index_names)
+            trace.fields['docs'] = len(reranked_docs)
+            if message:
+                trace.finish()
+                async def single():
+                    yield message
+                return single(), []
+        return self._traced_stream(trace, self.generate_stream(query, reranked_docs)), reranked_docs
+
+    @staticmethod
+    async def _traced_stream(trace: QueryTrace, stream: AsyncIterator[str]) -> AsyncIterator[str]:
+        """转发生成的文本；迭代器可能在其他任务中被消费，因此每取一段都重新激活本次查询的记录"""
+        status = "ok"
+        try:
+            while True:
+                with trace.activate():
+                    try:
+                        token = await stream.__anext__()
+                    except StopAsyncIteration:
+                        break
+                yield token
+        except GeneratorExit:
+            status = "cancelled"
+            with trace.activate():
+                await stream.aclose()
+            raise
+        finally:
+            trace.finish(status)
+
+    async def query_many(self, queries: List[str]) -> List[Tuple[str, List[Dict]]]:
+        """并发处理多个查询，单个查询失败时返回异常对象"""
+        return await asyncio.gather(*(self.query(q) for q in queries), return_exceptions=True)
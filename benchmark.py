@@ -0,0 +1,503 @@
+"""离线基准测试：使用本地模拟 API 服务和本地存储后端，不需要 SiliconFlow 密钥和 Elasticsearch
+
+  python benchmark.py --docs 50 --queries 30 --output bench_results.json
+  python benchmark.py --output new.json --compare bench_results.json
+
+每个阶段在独立的子进程中运行，以便分别统计峰值内存：
+  startup  冷启动：导入 app 并创建 RAGSystem 的耗时和内存（只读问答模式 / 完整模式）
+  parse    解析大型 Markdown（模拟 MinerU 输出），对比旧的逐行解析与 DocumentLoader.process_markdown
+  process  DocumentProcessor 加载和分块
+  store    VectorStore.store 向量化并写入
+  ingest   RAGSystem.process_documents 完整入库流水线
+  query    RAGSystem.query 各阶段延迟（p50/p95/p99）
+  async    AsyncRAGSystem 并发查询的吞吐量和延迟
+结果写入 JSON 文件，可以用 --compare 与之前的结果对比。
+"""
+from typing import List, Dict, Callable, Optional, Tuple
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PHASES = ["startup", "parse", "process", "store", "ingest", "query", "async"]
+
+# 合成语料使用的词表
+WORDS_ZH = ["检索", "增强", "生成", "向量", "索引", "知识库", "文档", "模型", "查询", "排序", "缓存", "延迟",
+            "吞吐", "分块", "标题", "段落", "图片", "描述", "系统", "配置", "性能", "内存", "并发", "接口"]
+WORDS_EN = ["retrieval", "vector", "index", "latency", "throughput", "embedding", "rerank", "cache",
+            "pipeline", "chunk", "query", "model", "search", "token", "context", "budget"]
+
+def peak_rss_mb() -> Dict[str, Optional[float]]:
+    """当前进程及其子进程的峰值常驻内存(MB)"""
+    try:
+        import resource
+        # Linux 上 ru_maxrss 的单位为 KB，macOS 上为字节
+        scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+        return {
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+            "peak_children_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+        }
+    except ImportError:
+        try:
+            import psutil
+            return {"peak_rss_mb": round(psutil.Process().memory_info().peak_wset / 1024 / 1024, 1),
+                    "peak_children_rss_mb": None}
+        except (ImportError, AttributeError):
+            return {"peak_rss_mb": None, "peak_children_rss_mb": None}
+
+def latency_summary(values: List[float]) -> Dict[str, float]:
+    """延迟分布（毫秒）"""
+    if not values:
+        return {}
+    array = np.asarray(values) * 1000
+    return {
+        "count": len(values),
+        "mean_ms": round(float(array.mean()), 2),
+        "p50_ms": round(float(np.percentile(array, 50)), 2),
+        "p95_ms": round(float(np.percentile(array, 95)), 2),
+        "p99_ms": round(float(np.percentile(array, 99)), 2),
+        "max_ms": round(float(array.max()), 2),
+    }
+
+# --- 合成数据 ---
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS_ZH) if rng.random() < 0.7 else rng.choice(WORDS_EN) for _ in range(rng.randint(8, 20))]
+    return "".join(w if w in WORDS_ZH else f" {w} " for w in words).strip() + "。"
+
+def generate_corpus(directory: str, docs: int, doc_chars: int, seed: int) -> List[str]:
+    """生成带标题层级的 markdown 和纯文本文档"""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(docs):
+        extension = ".md" if i % 4 else ".txt"
+        lines = [f"# 文档 {i}"] if extension == ".md" else []
+        size = 0
+        section = 0
+        while size < doc_chars:
+            if extension == ".md" and rng.random() < 0.3:
+                section += 1
+                lines.append(f"\n## 第 {section} 节 {rng.choice(WORDS_ZH)}\n")
+            paragraph = "".join(_sentence(rng) for _ in range(rng.randint(3, 8)))
+            lines.append(paragraph + "\n")
+            size += len(paragraph)
+        path = os.path.join(directory, f"doc_{i:04d}{extension}")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines))
+        paths.append(path)
+    return paths
+
+def generate_markdown(path: str, megabytes: float, seed: int) -> None:
+    """生成类似 MinerU 输出的大型 markdown：多级标题、代码块、表格、行内图片"""
+    rng = random.Random(seed + 2)
+    limit = int(megabytes * 1024 * 1024)
+    size = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        while size < limit:
+            roll = rng.random()
+            if roll < 0.08:
+                part = f"\n{'#' * rng.randint(1, 3)} {rng.choice(WORDS_ZH)}{rng.choice(WORDS_ZH)}\n\n"
+            elif roll < 0.11:
+                part = "```python\n# 代码块中的注释不是标题\nresult = search(query, top_k=5)\n```\n"
+            elif roll < 0.14:
+                part = "| 指标 | 数值 |\n|---|---|\n" + "".join(f"| {rng.choice(WORDS_EN)} | {rng.random():.3f} |\n"
+                                                       for _ in range(rng.randint(2, 6)))
+            elif roll < 0.16:
+                part = f"{_sentence(rng)}![图 {size}](https://example.com/{size}.png){_sentence(rng)}\n"
+            else:
+                part = "".join(_sentence(rng) for _ in range(rng.randint(2, 6))) + "\n\n"
+            f.write(part)
+            size += len(part.encode('utf-8'))
+
+def generate_queries(count: int, seed: int) -> List[str]:
+    rng = random.Random(seed + 1)
+    return [f"{rng.choice(WORDS_ZH)}{rng.choice(WORDS_ZH)}与 {rng.choice(WORDS_EN)} 的关系是什么？（{i}）"
+            for i in range(count)]
+
+# 在全新的解释器中测量冷启动，不受 benchmark 自身导入的模块影响
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {root!r})
+from app import RAGSystem
+imported = time.perf_counter()
+rag = RAGSystem(query_only={query_only})
+if not {query_only}:
+    rag.ingest_pipeline
+ready = time.perf_counter()
+try:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+except ImportError:
+    rss = None
+print(json.dumps({{"import_ms": (imported - started) * 1000, "init_ms": (ready - imported) * 1000,
+                  "rss_mb": rss, "modules": len(sys.modules)}}))
+"""
+
+# --- 各阶段（在子进程中运行） ---
+def _timed(stats: Dict[str, List[float]], name: str, func: Callable) -> Callable:
+    """包装方法，记录每次调用的耗时"""
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats.setdefault(name, []).append(time.perf_counter() - started)
+    return wrapper
+
+def phase_startup(args, workdir: str) -> Dict:
+    result = {}
+    for mode, query_only in (("query_only", True), ("full", False)):
+        runs = []
+        for _ in range(args.startup_runs):
+            started = time.perf_counter()
+            completed = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT.format(root=ROOT, query_only=query_only)],
+                                       cwd=ROOT, capture_output=True, text=True, timeout=300)
+            wall = (time.perf_counter() - started) * 1000
+            if completed.returncode != 0:
+                raise Exception(f"冷启动测量失败：{completed.stderr[-2000:]}")
+            run = json.loads(completed.stdout.strip().splitlines()[-1])
+            run["wall_ms"] = wall
+            runs.append(run)
+        # 取各项的中位数
+        result[mode] = {
+            key: round(float(np.median([run[key] for run in runs])), 1)
+            for key in ("wall_ms", "import_ms", "init_ms", "rss_mb", "modules") if runs[0].get(key) is not None
+        }
+    return result
+
+def phase_parse(args, workdir: str) -> Dict:
+    """同一个文件分别用旧的逐行解析（legacy_process_markdown）和当前的单遍解析处理
+
+    耗时不开启 tracemalloc 单独测量；峰值内存为各自运行期间 tracemalloc 记录的 Python 分配峰值。
+    """
+    from document_processor import DocumentLoader
+    from legacy_markdown_parser import legacy_process_markdown
+    path = os.path.join(workdir, "large.md")
+    loader = DocumentLoader(path)
+    def parse_new() -> List[Dict]:
+        with open(path, 'r', encoding='utf-8') as f:
+            return loader.process_markdown(f)
+    def parse_old() -> List[Dict]:
+        with open(path, 'r', encoding='utf-8') as f:
+            return legacy_process_markdown(f.read(), path)
+
+    megabytes = os.path.getsize(path) / 1024 / 1024
+    result = {"megabytes": round(megabytes, 1)}
+    for name, parse in (("old", parse_old), ("new", parse_new)):
+        gc.collect()
+        started = time.perf_counter()
+        chunks = parse()
+        elapsed = time.perf_counter() - started
+        blocks = len(chunks)
+        del chunks
+        gc.collect()
+        tracemalloc.start()
+        parse()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        result[name] = {
+            "blocks": blocks,
+            "seconds": round(elapsed, 3),
+            "mb_per_s": round(megabytes / elapsed, 2),
+            "peak_alloc_mb": round(peak / 1024 / 1024, 1),
+        }
+    return result
+
+def phase_process(args, workdir: str) -> Dict:
+    from document_processor import DocumentProcessor
+    processor = DocumentProcessor()
+    files = processor.list_files(os.path.join(workdir, "corpus"))
+    started = time.perf_counter()
+    chunks = processor.process_files(files)
+    elapsed = time.perf_counter() - started
+    with open(os.path.join(workdir, "chunks.json"), 'w', encoding='utf-8') as f:
+        json.dump(chunks, f, ensure_ascii=False)
+    return {
+        "files": len(files),
+        "chunks": len(chunks),
+        "seconds": round(elapsed, 3),
+        "docs_per_s": round(len(files) / elapsed, 2),
+        "chunks_per_s": round(len(chunks) / elapsed, 2),
+    }
+
+def phase_store(args, workdir: str) -> Dict:
+    from vector_store import VectorStore
+    with open(os.path.join(workdir, "chunks.json"), 'r', encoding='utf-8') as f:
+        chunks = json.load(f)
+    store = VectorStore()
+    started = time.perf_counter()
+    result = store.store(chunks, "rag_bench_store")
+    elapsed = time.perf_counter() - started
+    return {
+        "chunks": len(chunks),
+        "indexed": result["indexed"],
+        "failed": result["failed"],
+        "seconds": round(elapsed, 3),
+        "chunks_per_s": round(len(chunks) / elapsed, 2),
+    }
+
+def phase_ingest(args, workdir: str) -> Dict:
+    from app import RAGSystem
+    rag = RAGSystem()
+    corpus = os.path.join(workdir, "corpus")
+    files = rag.doc_processor.list_files(corpus)
+    runs = []
+    run = rag.ingest_pipeline.run
+    def capture(*run_args, **run_kwargs):
+        result = run(*run_args, **run_kwargs)
+        runs.append(result)
+        return result
+    rag.ingest_pipeline.run = capture
+
+    started = time.perf_counter()
+    rag.process_documents(corpus, "bench")
+    elapsed = time.perf_counter() - started
+    chunks = sum(result["indexed"] for result in runs)
+    return {
+        "files": len(files),
+        "chunks": chunks,
+        "seconds": round(elapsed, 3),
+        "docs_per_s": round(len(files) / elapsed, 2),
+        "chunks_per_s": round(chunks / elapsed, 2),
+    }
+
+def phase_query(args, workdir: str) -> Dict:
+    from app import RAGSystem
+    rag = RAGSystem()
+    stats: Dict[str, List[float]] = {}
+    rag.retriever.get_embedding = _timed(stats, "embed", rag.retriever.get_embedding)
+    rag.retriever.backend.search = _timed(stats, "search", rag.retriever.backend.search)
+    rag.retriever.retrieve = _timed(stats, "retrieve", rag.retriever.retrieve)
+    rag.reranker.rerank = _timed(stats, "rerank", rag.reranker.rerank)
+    rag.generator.generate = _timed(stats, "generate", rag.generator.generate)
+
+    queries = generate_queries(args.queries + args.warmup, args.seed)
+    for query in queries[:args.warmup]:
+        rag.query(query)
+    stats.clear()
+
+    totals = []
+    for query in queries[args.warmup:]:
+        started = time.perf_counter()
+        rag.query(query)
+        totals.append(time.perf_counter() - started)
+
+    result = {"queries": len(totals), "qps": round(len(totals) / sum(totals), 2), "total": latency_summary(totals)}
+    for name, values in stats.items():
+        result[name] = latency_summary(values)
+    return result
+
+def phase_async(args, workdir: str) -> Dict:
+    import asyncio
+    from async_rag import AsyncRAGSystem
+    queries = generate_queries(args.queries + args.warmup, args.seed)
+    totals = []
+
+    async def run_one(rag, semaphore, query: str, record: bool) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await rag.query(query)
+            if record:
+                totals.append(time.perf_counter() - started)
+
+    async def run() -> float:
+        # 同时进行的查询数不超过 --concurrency
+        semaphore = asyncio.Semaphore(args.concurrency)
+        async with AsyncRAGSystem() as rag:
+            await asyncio.gather(*(run_one(rag, semaphore, query, False) for query in queries[:args.warmup]))
+            started = time.perf_counter()
+            await asyncio.gather(*(run_one(rag, semaphore, query, True) for query in queries[args.warmup:]))
+            return time.perf_counter() - started
+
+    elapsed = asyncio.run(run())
+    return {
+        "queries": len(totals),
+        "concurrency": args.concurrency,
+        "seconds": round(elapsed, 3),
+        "qps": round(len(totals) / elapsed, 2),
+        "total": latency_summary(totals),
+    }
+
+PHASE_FUNCS = {"startup": phase_startup, "parse": phase_parse, "process": phase_process, "store": phase_store, "ingest": phase_ingest, "query": phase_query, "async": phase_async}
+
+def run_phase(args) -> None:
+    """子进程入口：运行一个阶段并把结果写入 <workdir>/<phase>.json"""
+    sys.path.insert(0, ROOT)
+    result = PHASE_FUNCS[args.phase](args, args.workdir)
+    result.update(peak_rss_mb())
+    with open(os.path.join(args.workdir, f"{args.phase}.json"), 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+# --- 主进程 ---
+def _free_port() -> int:
+    with contextlib.closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_mock_server(args, workdir: str) -> Tuple[subprocess.Popen, str]:
+    port = _free_port()
+    command = [
+        sys.executable, os.path.join(ROOT, "mock_api_server.py"), "--port", str(port),
+        "--embed-latency", str(args.embed_latency), "--rerank-latency", str(args.rerank_latency),
+        "--chat-latency", str(args.chat_latency), "--token-latency", str(args.token_latency),
+        "--answer-tokens", str(args.answer_tokens),
+    ]
+    log = open(os.path.join(workdir, "mock_server.log"), 'w')
+    process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}/v1"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"{base_url}/health", timeout=1).read()
+            return process, base_url
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise Exception("模拟 API 服务启动失败，详见 mock_server.log")
+
+def phase_env(workdir: str, base_url: str) -> Dict[str, str]:
+    """各阶段共用的环境变量：模拟 API、本地存储后端，关闭缓存，其余数据写入临时目录"""
+    env = dict(os.environ)
+    env.update({
+        "BASE_URL": base_url,
+        "API_KEY": "benchmark",
+        "STORAGE_BACKEND": "local",
+        "LOCAL_INDEX_DIR": os.path.join(workdir, "local_index"),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "cache", "embeddings.sqlite"),
+        "IMAGE_CACHE_PATH": os.path.join(workdir, "cache", "image_descriptions.sqlite"),
+        "RERANK_CACHE_PATH": os.path.join(workdir, "cache", "rerank_scores.sqlite"),
+        "ANSWER_CACHE_PATH": os.path.join(workdir, "cache", "answers.sqlite"),
+        "MANIFEST_DIR": os.path.join(workdir, "cache", "manifests"),
+        "KB_ROUTING_PATH": os.path.join(workdir, "cache", "kb_routing.json"),
+        "PDF_OUTPUT_DIR": os.path.join(workdir, "output"),
+        "QUERY_LOG_PATH": os.path.join(workdir, "logs", "queries.jsonl"),
+        "METRICS_PORT": "0",
+        # 各阶段共用同一个临时缓存目录，store 写入的 embedding 会让 ingest 全部命中缓存；
+        # 测量的是未缓存时的完整链路，关闭所有缓存
+        "EMBEDDING_CACHE": "false",
+        "IMAGE_CACHE": "false",
+        "RERANK_CACHE": "false",
+        "ANSWER_CACHE": "false",
+        "PYTHONIOENCODING": "utf-8",
+    })
+    return env
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+def _flatten(prefix: str, value, out: Dict[str, float]) -> None:
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else key, item, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+
+def compare(current: Dict, previous: Dict) -> None:
+    """打印与之前结果相比的变化"""
+    now, before = {}, {}
+    _flatten("", current["results"], now)
+    _flatten("", previous["results"], before)
+    print(f"\n与 {previous.get('git_commit') or '之前的结果'} 对比：")
+    for key in sorted(now):
+        if key in before and before[key]:
+            change = (now[key] - before[key]) / before[key] * 100
+            print(f"  {key:<40} {before[key]:>12} -> {now[key]:>12}  ({change:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG 系统离线基准测试")
+    parser.add_argument("--docs", type=int, default=50, help="合成文档数")
+    parser.add_argument("--doc-chars", type=int, default=5000, help="每个文档的字符数")
+    parser.add_argument("--startup-runs", type=int, default=3, help="startup 阶段每种模式的冷启动次数")
+    parser.add_argument("--markdown-mb", type=float, default=20, help="parse 阶段的 markdown 文件大小(MB)")
+    parser.add_argument("--queries", type=int, default=30, help="查询次数")
+    parser.add_argument("--warmup", type=int, default=2, help="不计入统计的预热查询次数")
+    parser.add_argument("--concurrency", type=int, default=8, help="async 阶段同时进行的查询数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--phases", default=",".join(PHASES), help="要运行的阶段，逗号分隔")
+    parser.add_argument("--embed-latency", type=float, default=30, help="模拟 embedding 延迟(毫秒)")
+    parser.add_argument("--rerank-latency", type=float, default=50, help="模拟 rerank 延迟(毫秒)")
+    parser.add_argument("--chat-latency", type=float, default=300, help="模拟生成首 token 延迟(毫秒)")
+    parser.add_argument("--token-latency", type=float, default=5, help="模拟每个 token 的延迟(毫秒)")
+    parser.add_argument("--answer-tokens", type=int, default=200, help="模拟回答的 token 数")
+    parser.add_argument("--output", default="bench_results.json", help="结果文件")
+    parser.add_argument("--compare", help="与之前的结果文件对比")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录")
+    parser.add_argument("--phase", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.phase:
+        run_phase(args)
+        return
+
+    phases = [phase.strip() for phase in args.phases.split(",") if phase.strip()]
+    workdir = tempfile.mkdtemp(prefix="rag_bench_")
+    generate_corpus(os.path.join(workdir, "corpus"), args.docs, args.doc_chars, args.seed)
+    if "parse" in phases:
+        generate_markdown(os.path.join(workdir, "large.md"), args.markdown_mb, args.seed)
+    server, base_url = start_mock_server(args, workdir)
+    env = phase_env(workdir, base_url)
+
+    results = {}
+    try:
+        # store 依赖 process 的分块结果，query 和 async 依赖 ingest 建立的索引
+        for phase in PHASES:
+            if phase not in phases and not (phase == "process" and "store" in phases) \
+                    and not (phase == "ingest" and ("query" in phases or "async" in phases)):
+                continue
+            print(f"正在运行阶段 {phase} ...", flush=True)
+            command = [sys.executable, os.path.abspath(__file__), "--phase", phase, "--workdir", workdir,
+                       "--queries", str(args.queries), "--warmup", str(args.warmup), "--seed", str(args.seed),
+                       "--startup-runs", str(args.startup_runs), "--concurrency", str(args.concurrency)]
+            with open(os.path.join(workdir, f"{phase}.log"), 'w', encoding='utf-8') as log:
+                completed = subprocess.run(command, env=env, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+            if completed.returncode != 0:
+                raise Exception(f"阶段 {phase} 失败，详见 {os.path.join(workdir, phase + '.log')}")
+            with open(os.path.join(workdir, f"{phase}.json"), 'r', encoding='utf-8') as f:
+                results[phase] = json.load(f)
+            print(json.dumps(results[phase], ensure_ascii=False, indent=2))
+    finally:
+        server.terminate()
+        server.wait()
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("phase", "workdir")},
+        "results": results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入 {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+    if args.keep:
+        print(f"临时目录：{workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+from typing import List, Dict, Tuple, Iterable, Optional
+import os
+import re
+from dotenv import load_dotenv
+from token_counter import count_tokens, truncate_to_tokens
+
+load_dotenv()
+
+HEADER_SEPARATOR = " > "
+
+# 超长章节依次按段落、行、句子切分，仍然过长时按 token 数硬切
+_SPLIT_PATTERNS = (
+    re.compile(r'\n\s*\n'),
+    re.compile(r'\n'),
+    re.compile(r'[。！？；!?;]+|\.(?=\s)'),
+)
+
+# 单独一行的 Markdown 标题
+_HEADING_PATTERN = re.compile(r'#{1,6}\s+\S[^\n]*')
+
+# (文本, token 数, 之后的切分点是否在段落内部, 超长段落切出的单元所属的标题行)
+Unit = Tuple[str, int, bool, Optional[str]]
+
+class StructuredChunker:
+    """按标题结构和 token 数分块，token 数由 token_counter.count_tokens 计算
+
+    - 图片描述始终作为单独的片段，不切分、不合并
+    - 不超过 max_tokens 的章节保持完整；过小的相邻章节（兄弟章节或父子章节）合并，
+      合并后的标题取它们共同的上级标题
+    - 超长章节优先在段落边界切分，其次是行和句子；只有切分点落在段落内部时，
+      下一片段才带上前一片段结尾约 overlap_tokens 的内容
+    - 标题行不单独成片；超长段落切出的每个片段开头都补上它所属的标题行
+    """
+    def __init__(self, max_tokens: int = None, min_tokens: int = None, overlap_tokens: int = None):
+        # 默认与 RERANK_MAX_TOKENS 一致，片段在重排序时不会被截断
+        self.max_tokens = max_tokens or int(os.getenv("CHUNK_MAX_TOKENS", "512"))
+        self.min_tokens = min_tokens if min_tokens is not None else int(os.getenv("CHUNK_MIN_TOKENS", "128"))
+        self.overlap_tokens = overlap_tokens if overlap_tokens is not None else int(os.getenv("CHUNK_OVERLAP_TOKENS", "64"))
+
+    @staticmethod
+    def _header_path(metadata: Dict) -> Tuple[str, ...]:
+        header = metadata.get('chunk_header') or ''
+        return tuple(header.split(HEADER_SEPARATOR)) if header else ()
+
+    @staticmethod
+    def _common_path(a: Tuple[str, ...], b: Tuple[str, ...]) -> Tuple[str, ...]:
+        length = 0
+        for x, y in zip(a, b):
+            if x != y:
+                break
+            length += 1
+        return a[:length]
+
+    def _can_merge(self, buffer: Dict, metadata: Dict, path: Tuple[str, ...], tokens: int) -> bool:
+        if buffer['metadata'].get('source') != metadata.get('source'):
+            return False
+        if buffer['tokens'] + tokens > self.max_tokens:
+            return False
+        if buffer['tokens'] >= self.min_tokens and tokens >= self.min_tokens:
+            return False
+        # 只合并兄弟章节或父子章节
+        common = len(self._common_path(buffer['path'], path))
+        return common >= max(len(buffer['path']), len(path)) - 1
+
+    def split(self, docs: Iterable) -> List[Tuple[str, Dict]]:
+        """把加载得到的文档（page_content + metadata）切分为 [(片段文本, metadata)]"""
+        results: List[Tuple[str, Dict]] = []
+        buffer: Optional[Dict] = None
+
+        def flush():
+            nonlocal buffer
+            if buffer is not None:
+                content = "\n".join(buffer['parts']).strip()
+                if content:
+                    metadata = dict(buffer['metadata'])
+                    metadata['chunk_header'] = HEADER_SEPARATOR.join(buffer['path'])
+                    results.append((content, metadata))
+                buffer = None
+
+        for doc in docs:
+            text = doc.page_content
+            metadata = doc.metadata
+            if metadata.get('img_url'):
+                flush()
+                if text.strip():
+                    results.append((text.strip(), dict(metadata)))
+                continue
+
+            tokens = count_tokens(text)
+            if tokens > self.max_tokens:
+                flush()
+                results.extend((piece, dict(metadata)) for piece in self.split_text(text))
+                continue
+
+            path = self._header_path(metadata)
+            if buffer is not None and self._can_merge(buffer, metadata, path, tokens):
+                buffer['parts'].append(text)
+                buffer['tokens'] += tokens
+                buffer['path'] = self._common_path(buffer['path'], path)
+            else:
+                flush()
+                buffer = {'parts': [text], 'tokens': tokens, 'path': path, 'metadata': metadata}
+        flush()
+        return results
+
+    # --- 超长文本切分 ---
+    @staticmethod
+    def _split_keep(pattern: re.Pattern, text: str) -> List[str]:
+        """按分隔符切分，分隔符保留在前一段末尾"""
+        parts = []
+        start = 0
+        for match in pattern.finditer(text):
+            if match.end() > start:
+                parts.append(text[start:match.end()])
+                start = match.end()
+        if start < len(text):
+            parts.append(text[start:])
+        return parts
+
+    def _units(self, text: str, limit: int, level: int = 1) -> List[Unit]:
+        """把文本依次按行、句子和 token 数切成不超过 limit 的单元"""
+        if level == len(_SPLIT_PATTERNS):
+            units = []
+            while text.strip():
+                piece = truncate_to_tokens(text, limit) or text[:limit]
+                units.append((piece, count_tokens(piece), True, None))
+                text = text[len(piece):]
+            return units
+
+        units = []
+        for part in self._split_keep(_SPLIT_PATTERNS[level], text):
+            tokens = count_tokens(part)
+            if tokens <= limit:
+                units.append((part, tokens, True, None))
+                continue
+            units.extend(self._units(part, limit, level + 1))
+        return units
+
+    @staticmethod
+    def _is_heading(text: str) -> bool:
+        return bool(_HEADING_PATTERN.fullmatch(text.strip()))
+
+    def _heading_budget(self, heading: Optional[str]) -> int:
+        """标题行之后的正文可用的 token 数；标题过长时不补标题"""
+        if heading is None:
+            return self.max_tokens
+        budget = self.max_tokens - count_tokens(heading) - 1
+        return budget if budget >= self.max_tokens // 2 else self.max_tokens
+
+    def _paragraph_units(self, text: str) -> List[Unit]:
+        """按段落切成单元，超长段落继续切分，切出的单元记录所属的标题行"""
+        units = []
+        heading = None
+        # 紧跟在标题行之后的段落需要和标题放进同一片段
+        after_heading = False
+        for part in self._split_keep(_SPLIT_PATTERNS[0], text):
+            first_line, newline, rest = part.partition('\n')
+            if self._is_heading(first_line):
+                heading = first_line.strip()
+                after_heading = True
+                if not rest.strip():
+                    units.append((part, count_tokens(part), False, None))
+                    continue
+                units.append((first_line + newline, count_tokens(first_line + newline), False, None))
+                part = rest
+            tokens = count_tokens(part)
+            budget = self._heading_budget(heading)
+            if tokens <= (budget if after_heading else self.max_tokens):
+                units.append((part, tokens, False, None))
+            else:
+                sub_units = self._units(part, budget)
+                owner = heading if budget < self.max_tokens else None
+                units.extend((sub_text, sub_tokens, inner, owner) for sub_text, sub_tokens, inner, _ in sub_units)
+                if units and units[-1][2]:
+                    # 最后一个子单元之后是段落边界
+                    last = units[-1]
+                    units[-1] = (last[0], last[1], False, last[3])
+            after_heading = False
+        return units
+
+    def _overlap(self, units: List[Unit], next_tokens: int) -> List[Unit]:
+        """取前一片段结尾不超过 overlap_tokens 的单元作为下一片段的开头"""
+        budget = min(self.overlap_tokens, self.max_tokens - next_tokens)
+        if budget <= 0:
+            return []
+        carry = []
+        used = 0
+        for unit in reversed(units):
+            if used + unit[1] > budget:
+                break
+            carry.insert(0, unit)
+            used += unit[1]
+        if not carry:
+            # 最后一个单元本身就超过重叠长度时取其结尾的字符（每个字符至多一个 token）
+            tail = units[-1][0][-budget:]
+            carry = [(tail, count_tokens(tail), True, units[-1][3])]
+        return carry
+
+    def _join(self, units: List[Unit]) -> str:
+        parts = []
+        for i, unit in enumerate(units):
+            # 补上的标题之后接的是段落中间的内容，去掉开头的空白
+            parts.append(unit[0].lstrip() if i and self._is_heading(units[i - 1][0]) else unit[0])
+        return "".join(parts).strip()
+
+    def split_text(self, text: str) -> List[str]:
+        """把超长文本切分为不超过 max_tokens 的片段"""
+        pieces = []
+        current: List[Unit] = []
+        used = 0
+        for unit in self._paragraph_units(text):
+            if current and used + unit[1] > self.max_tokens:
+                # 结尾的标题行不单独成片，移到下一片段开头
+                split = len(current)
+                while split > 0 and not current[split - 1][2] and self._is_heading(current[split - 1][0]):
+                    split -= 1
+                headings = current[split:]
+                current = current[:split]
+                if not headings and unit[3] is not None:
+                    # 超长段落切出的片段补上所属的标题
+                    heading = unit[3] + "\n"
+                    headings = [(heading, count_tokens(heading), False, None)]
+                # 多个连续标题放不下时只保留最近的
+                while len(headings) > 1 and sum(u[1] for u in headings) + unit[1] > self.max_tokens:
+                    headings.pop(0)
+                carry = []
+                if current:
+                    pieces.append(self._join(current))
+                    # 在段落边界切分时不需要重叠
+                    if current[-1][2] and self.overlap_tokens > 0:
+                        carry = self._overlap(current, unit[1] + sum(u[1] for u in headings))
+                current = headings + carry
+                used = sum(u[1] for u in current)
+            current.append(unit)
+            used += unit[1]
+        if current:
+            pieces.append(self._join(current))
+        return [piece for piece in pieces if piece]
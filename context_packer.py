@@ -0,0 +1,123 @@
+from typing import List, Dict, Optional, Tuple
+import os
+from dotenv import load_dotenv
+from token_counter import count_tokens, truncate_to_tokens
+
+load_dotenv()
+
+class ContextPacker:
+    """按 token 预算把重排序后的文档打包成生成用的参考内容
+
+    同一文件、同一标题下的片段合并为一条参考，分块时重叠的文本只保留一份，
+    被其他片段完整包含的片段和跨文件完全重复的片段直接丢弃；
+    之后按重排序分数从高到低放入预算：放不下的文本截断到剩余预算，图片描述和截断后过短的条目跳过，
+    后面较短的条目仍可放入剩余的预算。
+    """
+    def __init__(self, budget: int = None, min_overlap: int = None):
+        self.budget = budget or int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+        # 判定两个片段首尾重叠所需的最少重合字符数，避免把偶然相同的短句当作重叠
+        self.min_overlap = min_overlap or int(os.getenv("CONTEXT_MIN_OVERLAP", "20"))
+        # 截断后剩余不足该 token 数的片段直接丢弃
+        self.min_fragment_tokens = 50
+
+    @staticmethod
+    def _doc_score(doc: Dict) -> float:
+        return doc.get('rerank_score', doc.get('score', 0.0))
+
+    def _overlap(self, first: str, second: str) -> int:
+        """first 的结尾与 second 的开头重合的字符数"""
+        probe = second[:self.min_overlap]
+        if len(probe) < self.min_overlap:
+            return 0
+        start = first.find(probe)
+        while start != -1:
+            if second.startswith(first[start:]):
+                return len(first) - start
+            start = first.find(probe, start + 1)
+        return 0
+
+    def _merge_text(self, a: str, b: str) -> Optional[str]:
+        """a 与 b 互相包含或首尾重叠时返回合并后的文本，否则返回 None"""
+        if b in a:
+            return a
+        if a in b:
+            return b
+        overlap = self._overlap(a, b)
+        if overlap:
+            return a + b[overlap:]
+        overlap = self._overlap(b, a)
+        if overlap:
+            return b + a[overlap:]
+        return None
+
+    def _add_piece(self, pieces: List[str], text: str) -> None:
+        """加入一个片段，与已有片段重叠时合并（合并后的片段可能继续与其他片段相连）"""
+        position = None
+        merged = True
+        while merged:
+            merged = False
+            for i, piece in enumerate(pieces):
+                combined = self._merge_text(piece, text)
+                if combined is not None:
+                    text = combined
+                    pieces.pop(i)
+                    position = i if position is None else min(position, i)
+                    merged = True
+                    break
+        pieces.insert(len(pieces) if position is None else position, text)
+
+    def _group(self, docs: List[Dict]) -> List[Dict]:
+        """按 (来源, 标题) 合并片段，图片描述按图片单独成组；结果按最高分排序"""
+        groups: Dict[Tuple, Dict] = {}
+        seen = set()
+        for doc in sorted(docs, key=self._doc_score, reverse=True):
+            content = doc['content'].strip()
+            if not content or content in seen:
+                continue
+            seen.add(content)
+            metadata = doc['metadata']
+            img_url = metadata.get('img_url', '')
+            is_image = content.startswith("图片描述：") and bool(img_url)
+            key = ('img', img_url) if is_image else (metadata.get('source', ''), metadata.get('chunk_header', ''))
+            group = groups.get(key)
+            if group is None:
+                groups[key] = {"metadata": metadata, "image": is_image, "pieces": [content]}
+            else:
+                self._add_piece(group["pieces"], content)
+        return list(groups.values())
+
+    def _format(self, number: int, group: Dict, text: str) -> str:
+        metadata = group["metadata"]
+        ref_header = f"[{number}] "
+        chunk_header = metadata.get('chunk_header', '')
+        if chunk_header:
+            ref_header += f"【{chunk_header}】"
+        # 图片描述附带图片地址，普通文本附带文件名和路径（标题已在引用标记中给出）
+        if group["image"]:
+            return f"{ref_header}{text}\nimg_url: {metadata.get('img_url', '')}"
+        return (f"{ref_header}{text}\n"
+                f"file_name: {metadata.get('file_name', '未知文件')}\n"
+                f"source: {metadata.get('source', '')}")
+
+    def pack(self, docs: List[Dict]) -> Tuple[str, int]:
+        """返回 (参考内容文本, 估算的 token 数)；放不下的条目截断或跳过，不会中止打包"""
+        blocks = []
+        used = 0
+        groups = self._group(docs)
+        for group in groups:
+            number = len(blocks) + 1
+            text = "\n……\n".join(group["pieces"])
+            block = self._format(number, group, text)
+            tokens = count_tokens(block)
+            if used + tokens > self.budget:
+                # 图片描述截断后含义不完整，只截断普通文本
+                remaining = self.budget - used - count_tokens(self._format(number, group, "……"))
+                if group["image"] or remaining < self.min_fragment_tokens:
+                    continue
+                block = self._format(number, group, truncate_to_tokens(text, remaining) + "……")
+                tokens = count_tokens(block)
+            blocks.append(block)
+            used += tokens
+
+        print(f"参考内容：{len(docs)} 个片段合并为 {len(groups)} 条，放入 {len(blocks)} 条，约 {used} tokens")
+        return "\n\n".join(blocks), used
@@ -1,42 +1,81 @@
-from typing import List, Dict
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import (
-    DirectoryLoader,
-    UnstructuredMarkdownLoader,
-    PyPDFLoader,
-    TextLoader
-)
+from typing import List, Dict, Iterator, Iterable, Tuple, Optional, Union
 import os
-import requests
 import base64
-from PIL import Image
 import io
-import subprocess
-import json
 import re
 import concurrent.futures
+import multiprocessing
+import collections
+import itertools
 from pathlib import Path
+from ingest_manifest import chunk_id
+from image_description_cache import ImageDescriptionCache, ImageKey
+from pdf_engine import MagicPDFEngine
+from pdf_conversion_cache import PDFConversionCache
+from markdown_parser import parse_markdown
+from chunker import StructuredChunker
+from http_client import get_client
+from metrics import track, get_metrics
 
 # Helper function to normalize paths
 def normalize_path(path_str: str) -> str:
     """Converts a path string to an absolute path with forward slashes."""
     return Path(path_str).resolve().as_posix()
 
+VLM_MODEL = "Qwen/Qwen2.5-VL-72B-Instruct"
+
+IMAGE_MIME_TYPES = {
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'bmp': 'image/bmp',
+    'webp': 'image/webp',
+}
+
+# 主要耗时在等待外部 API 或子进程的文件类型
+API_BOUND_EXTENSIONS = {'.pdf', '.png', '.jpg', '.jpeg', '.gif', '.bmp'}
+
 class DocumentLoader:
     """通用文档加载器"""
     def __init__(self, file_path: str):
         self.file_path = normalize_path(file_path)
         self.extension = os.path.splitext(self.file_path)[1].lower()
-        self.api_key = os.getenv("API_KEY")
-        self.api_base = os.getenv("BASE_URL")
+        self.client = get_client()
+        use_image_cache = os.getenv("IMAGE_CACHE", "true").lower() not in ("0", "false", "no")
+        self.image_cache = ImageDescriptionCache.default() if use_image_cache else None
+        # 上传给 VLM 前的图片预处理配置
+        self.image_max_side = int(os.getenv("IMAGE_MAX_SIDE", "1536"))
+        self.image_low_detail_max_side = int(os.getenv("IMAGE_LOW_DETAIL_MAX_SIDE", "512"))
+        self.image_jpeg_quality = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
         
-    def process_image(self, image_path: str, context: str = None) -> str:
-        """使用 SiliconFlow VLM 模型处理图片，可选择性地提供上下文"""
+    def process_image(self, image_path: str, context: str = None, cache_key: ImageKey = None) -> str:
+        """使用 SiliconFlow VLM 模型处理图片，可选择性地提供上下文
+
+        cache_key 为调用方已经算好的缓存键，提供时不再重新计算，命中缓存时也不读取图片。
+        """
         try:
+            image_data = None
+            if cache_key is None:
+                with open(image_path, 'rb') as image_file:
+                    image_data = image_file.read()
+                cache_key = ImageDescriptionCache.make_key(image_data, context)
+            
+            # 相同图片在相同上下文中的描述（包括"无意义"的判定）直接复用缓存
+            if self.image_cache is not None:
+                cached = self.image_cache.get(VLM_MODEL, cache_key)
+                if cached is not ImageDescriptionCache.MISSING:
+                    get_metrics().count("image_cache_hit")
+                    return cached
+            
             # 读取图片并转换为base64
-            with open(image_path, 'rb') as image_file:
-                image_data = image_file.read()
-                base64_image = base64.b64encode(image_data).decode('utf-8')
+            if image_data is None:
+                with open(image_path, 'rb') as image_file:
+                    image_data = image_file.read()
+            
+            # 缩放并重新编码图片，减小上传体积
+            upload_data, mime_type, detail = self._prepare_image(image_data, image_path)
+            base64_image = base64.b64encode(upload_data).decode('utf-8')
             
             # 准备提示词，如果有上下文则包含在内
             prompt = """请分析这张图片是否包含有意义的信息。
@@ -57,47 +96,51 @@ class DocumentLoader:
 如果图片包含有意义的信息（如图表、数据可视化、流程图、实质性内容的照片等），请描述这张图片的内容"""
             
             # 调用 SiliconFlow API
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            response = requests.post(
-                f"{self.api_base}/chat/completions",
-                headers=headers,
-                json={
-                    "model": "Qwen/Qwen2.5-VL-72B-Instruct",
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/jpeg;base64,{base64_image}",
-                                        "detail": "high"
+            with track("vlm") as span:
+                span.set(payload_bytes=len(base64_image), items=1)
+                response = self.client.post(
+                    "/chat/completions",
+                    category="vlm",
+                    json={
+                        "model": VLM_MODEL,
+                        "messages": [
+                            {
+                                "role": "user",
+                                "content": [
+                                    {
+                                        "type": "image_url",
+                                        "image_url": {
+                                            "url": f"data:{mime_type};base64,{base64_image}",
+                                            "detail": detail
+                                        }
+                                    },
+                                    {
+                                        "type": "text",
+                                        "text": prompt
                                     }
-                                },
-                                {
-                                    "type": "text",
-                                    "text": prompt
-                                }
-                            ]
-                        }
-                    ],
-                    "temperature": 0.7,
-                    "max_tokens": 500
-                }
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"图片处理API调用失败: {response.text}")
+                                ]
+                            }
+                        ],
+                        "temperature": 0.7,
+                        "max_tokens": 500
+                    }
+                )
+                
+                if response.status_code != 200:
+                    raise Exception(f"图片处理API调用失败: {response.text}")
                 
-            description = response.json()["choices"][0]["message"]["content"]
+                result = response.json()
+                usage = result.get("usage") or {}
+                span.set(prompt=usage.get("prompt_tokens"), completion=usage.get("completion_tokens"))
+                
+            description = result["choices"][0]["message"]["content"]
             
             # 检查是否返回None（忽略大小写和空格）
             if description.strip().lower() == "None" or len(description.strip()) < 10:
-                return None
+                description = None
+            
+            if self.image_cache is not None:
+                self.image_cache.put(VLM_MODEL, cache_key, description)
                 
             return description
             
@@ -105,25 +148,66 @@ class DocumentLoader:
             print(f"处理图片时出错: {str(e)}")
             return "图片处理失败"
     
+    def _prepare_image(self, image_data: bytes, image_path: str = "") -> Tuple[bytes, str, str]:
+        """将图片缩放到最大边长以内并重新编码，返回 (图片数据, MIME 类型, detail)"""
+        # Pillow 只在处理图片时才需要，延迟导入以加快启动
+        from PIL import Image
+        try:
+            with Image.open(io.BytesIO(image_data)) as img:
+                img.seek(0)  # 动图只取第一帧
+                original_format = img.format
+                width, height = img.size
+                
+                if max(width, height) > self.image_max_side:
+                    img = img.copy()
+                    img.thumbnail((self.image_max_side, self.image_max_side), Image.LANCZOS)
+                
+                # 透明背景填充为白色，避免转为 JPEG 后变黑
+                if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+                    rgba = img.convert('RGBA')
+                    background = Image.new('RGB', rgba.size, (255, 255, 255))
+                    background.paste(rgba, mask=rgba.split()[-1])
+                    rgb = background
+                else:
+                    rgb = img.convert('RGB')
+                
+                candidates = []
+                jpeg_buffer = io.BytesIO()
+                rgb.save(jpeg_buffer, format='JPEG', quality=self.image_jpeg_quality, optimize=True)
+                candidates.append((jpeg_buffer.getvalue(), 'image/jpeg'))
+                # 线条图、截图等颜色较少的图片用 PNG 往往更小也更清晰
+                if img.mode in ('P', '1', 'L') or original_format in ('PNG', 'GIF', 'BMP'):
+                    png_buffer = io.BytesIO()
+                    rgb.save(png_buffer, format='PNG', optimize=True)
+                    candidates.append((png_buffer.getvalue(), 'image/png'))
+                # 未缩放的 JPEG 原图如果更小则直接使用
+                if original_format == 'JPEG' and max(width, height) <= self.image_max_side:
+                    candidates.append((image_data, 'image/jpeg'))
+                
+                upload_data, mime_type = min(candidates, key=lambda c: len(c[0]))
+                detail = "low" if max(rgb.size) <= self.image_low_detail_max_side else "high"
+                return upload_data, mime_type, detail
+        except Exception as e:
+            print(f"图片预处理失败，使用原图上传 {image_path}: {str(e)}")
+            extension = os.path.splitext(image_path)[1].lower().lstrip('.')
+            mime_type = IMAGE_MIME_TYPES.get(extension, 'image/jpeg')
+            return image_data, mime_type, "high"
+    
     def process_pdf_with_magic(self, pdf_path: str) -> str:
         """使用magic-pdf处理PDF文件"""
         try:
-            # 获取文件名(不含扩展名)作为处理目录
-            file_hash = Path(pdf_path).stem
-            output_dir = normalize_path(f"./output/{file_hash}/auto")
-            pdf_abs_path = pdf_path
-
-            # 创建输出目录
-            os.makedirs(output_dir, exist_ok=True)
+            engine = MagicPDFEngine.default()
+            cache = PDFConversionCache.default()
             
-            # 执行magic-pdf命令
-            command = f"magic-pdf -p \"{pdf_abs_path}\" -o ./output"
-            subprocess.run(command, shell=True, check=True, cwd=Path.cwd())
-            
-            # 读取生成的markdown文件
-            markdown_path = os.path.join(output_dir, f"{file_hash}.md")
-            if not os.path.exists(markdown_path):
-                raise Exception("Markdown文件未生成")
+            # 以 PDF 内容哈希和转换器版本作为缓存键，已转换过的 PDF 直接复用结果
+            cache_key = PDFConversionCache.make_key(pdf_path, engine.version())
+            markdown_path = cache.get(cache_key)
+            if markdown_path is None:
+                # 交给常驻的 magic-pdf 引擎转换，模型只加载一次
+                markdown_path = cache.put(cache_key, lambda output_dir: engine.convert(pdf_path, output_dir))
+            else:
+                print(f"使用已缓存的PDF转换结果: {pdf_path}")
+            output_dir = os.path.dirname(markdown_path)
                 
             with open(markdown_path, 'r', encoding='utf-8') as f:
                 content = f.read()
@@ -138,94 +222,51 @@ class DocumentLoader:
             print(f"PDF处理失败: {str(e)}")
             raise
     
-    def process_markdown(self, content: str) -> List[Dict]:
-        """处理Markdown内容，提取标题层级和图片信息"""
-        chunks = []
-        current_headers = []  # 用于跟踪标题层级
-        current_content = []
-        image_references = []  # 收集所有图片引用
+    def _resolve_image_path(self, img_path_rel: str, base_dir: Path) -> Optional[str]:
+        """把 Markdown 中的图片引用解析为本地绝对路径，无法使用时返回 None（按普通文本保留）"""
+        # 网络图片和内嵌数据不是本地文件
+        if not img_path_rel or re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*://|^data:', img_path_rel):
+            return None
+        try:
+            # Check if path is already absolute (might happen if PDF processor output absolute paths)
+            if Path(img_path_rel).is_absolute():
+                img_path_abs = normalize_path(img_path_rel)
+            else:
+                # Resolve relative to the markdown file's directory
+                img_path_abs = normalize_path(base_dir / img_path_rel)
+        except Exception as path_e:
+            print(f"警告：处理图片路径时出错 '{img_path_rel}': {path_e}")
+            return None
         
-        # 获取markdown文件所在目录，用于解析相对路径
+        # 验证图片文件是否存在
+        if not os.path.exists(img_path_abs):
+            print(f"警告：图片文件不存在: {img_path_abs}")
+            return None
+        return img_path_abs
+    
+    def process_markdown(self, content: Union[str, Iterable[str]]) -> List[Dict]:
+        """处理Markdown内容，提取标题层级和图片信息
+
+        content 可以是字符串，也可以是按行读取的文件对象。
+        """
+        # 获取markdown文件所在目录，用于解析相对路径；同一图片多次引用时只检查一次
         base_dir = Path(self.file_path).parent
+        resolved: Dict[str, Optional[str]] = {}
+        def resolve_image(img_path_rel: str) -> Optional[str]:
+            if img_path_rel not in resolved:
+                resolved[img_path_rel] = self._resolve_image_path(img_path_rel, base_dir)
+            return resolved[img_path_rel]
         
-        for line in content.split('\n'):
-            # 检查是否是标题
-            header_match = re.match(r'^(#{1,6})\s+(.+)$', line)
-            if header_match:
-                # 如果有累积的内容，先处理
-                if current_content:
-                    chunks.append({
-                        'content': '\n'.join(current_content),
-                        'headers': current_headers.copy(),
-                        'img_url': None
-                    })
-                    current_content = []
-                
-                # 更新当前标题层级
-                level = len(header_match.group(1))
-                title = header_match.group(2)
-                current_headers = current_headers[:level-1] + [title]
-                current_content.append(line)
-                
-            # 检查是否是图片
-            elif line.startswith('!['):
-                img_match = re.search(r'!\[.*?\]\((.*?)\)', line)
-                if img_match:
-                    img_path_rel = img_match.group(1)
-                    
-                    # 处理图片路径
-                    try:
-                        # Check if path is already absolute (might happen if PDF processor output absolute paths)
-                        if Path(img_path_rel).is_absolute():
-                            img_path_abs = normalize_path(img_path_rel)
-                        else:
-                            # Resolve relative to the markdown file's directory
-                            img_path_abs = normalize_path(base_dir / img_path_rel)
-                    except Exception as path_e:
-                        print(f"警告：处理图片路径时出错 '{img_path_rel}': {path_e}")
-                        current_content.append(line)
-                        continue
-                    
-                    # 验证图片文件是否存在
-                    if not os.path.exists(img_path_abs):
-                        print(f"警告：图片文件不存在: {img_path_abs}")
-                        current_content.append(line)
-                        continue
-                    
-                    # 如果有累积的内容，先处理
-                    if current_content:
-                        chunks.append({
-                            'content': '\n'.join(current_content),
-                            'headers': current_headers.copy(),
-                            'img_url': None
-                        })
-                        current_content = []
-                    
-                    # 收集图片信息，稍后处理
-                    image_references.append({
-                        'img_path': img_path_abs,
-                        'position': len(chunks),
-                        'headers': current_headers.copy()
-                    })
-                    
-                    # 添加一个占位符块
-                    chunks.append({
-                        'content': f"[图片占位符]",
-                        'headers': current_headers.copy(),
-                        'img_url': img_path_abs
-                    })
-                else:
-                    current_content.append(line)
-            else:
-                current_content.append(line)
-        
-        # 处理最后剩余的内容
-        if current_content:
-            chunks.append({
-                'content': '\n'.join(current_content),
-                'headers': current_headers.copy(),
-                'img_url': None
-            })
+        chunks = []
+        image_references = []  # 收集所有图片引用，稍后并发处理
+        for chunk in parse_markdown(content, resolve_image):
+            if chunk['img_url']:
+                image_references.append({
+                    'img_path': chunk['img_url'],
+                    'position': len(chunks),
+                    'headers': chunk['headers']
+                })
+            chunks.append(chunk)
         
         # 并发处理所有图片
         if image_references:
@@ -235,45 +276,60 @@ class DocumentLoader:
     
     def _process_images_concurrently(self, chunks: List[Dict], image_references: List[Dict]):
         """并发处理所有图片，包含上下文信息，并过滤无意义的图片"""
-        def process_single_image(ref):
+        def process_single_image(ref, context, cache_key):
             try:
-                # 获取图片的上下文
-                context = self._get_image_context(chunks, ref)
-                img_description = self.process_image(ref['img_path'], context)
+                img_description = self.process_image(ref['img_path'], context, cache_key)
                 
                 # 如果VLM返回None，表示图片无意义
                 if img_description is None:
                     return {
-                        'position': ref['position'],
                         'description': None,
-                        'img_path': ref['img_path'],
                         'meaningful': False
                     }
                 
                 return {
-                    'position': ref['position'],
                     'description': img_description,
-                    'img_path': ref['img_path'],
                     'meaningful': True
                 }
             except Exception as e:
                 print(f"处理图片时出错 {ref['img_path']}: {str(e)}")
                 return {
-                    'position': ref['position'],
                     'description': "图片处理失败",
-                    'img_path': ref['img_path'],
                     'meaningful': True  # 出错时默认保留
                 }
         
+        # 内容和上下文都相同的图片只请求一次 VLM，分组用的缓存键直接交给 process_image
+        groups: Dict[ImageKey, List[Dict]] = {}
+        contexts: Dict[ImageKey, str] = {}
+        # 读取失败的图片不分组，各自交给 process_image 处理（记为处理失败）
+        unreadable: List[Tuple[Dict, str]] = []
+        for ref in image_references:
+            # 获取图片的上下文
+            context = self._get_image_context(chunks, ref)
+            try:
+                with open(ref['img_path'], 'rb') as image_file:
+                    key = ImageDescriptionCache.make_key(image_file.read(), context)
+            except OSError:
+                unreadable.append((ref, context))
+                continue
+            groups.setdefault(key, []).append(ref)
+            contexts.setdefault(key, context)
+        
         # 使用线程池并发处理图片
         positions_to_remove = []  # 记录需要删除的位置
         
         with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            future_to_img = {executor.submit(process_single_image, ref): ref for ref in image_references}
-            for future in concurrent.futures.as_completed(future_to_img):
+            future_to_refs = {
+                executor.submit(process_single_image, refs[0], contexts[key], key): refs
+                for key, refs in groups.items()
+            }
+            future_to_refs.update(
+                (executor.submit(process_single_image, ref, context, None), [ref]) for ref, context in unreadable
+            )
+            for future in concurrent.futures.as_completed(future_to_refs):
                 result = future.result()
-                if result:
-                    position = result['position']
+                for ref in future_to_refs[future]:
+                    position = ref['position']
                     
                     # 如果图片无意义，记录需要删除的位置
                     if not result['meaningful']:
@@ -281,7 +337,7 @@ class DocumentLoader:
                     # 否则更新对应位置的块
                     elif 0 <= position < len(chunks):
                         chunks[position]['content'] = f"图片描述：{result['description']}"
-                        chunks[position]['img_url'] = result['img_path']
+                        chunks[position]['img_url'] = ref['img_path']
                         chunks[position]['headers'] = "img"
         
         # 从后向前删除无意义的图片块，避免索引变化
@@ -342,10 +398,9 @@ class DocumentLoader:
                 return docs
                 
             elif self.extension == '.md':
-                # 直接读取markdown文件
+                # 逐行读取markdown文件，不把整个文件读入内存
                 with open(self.file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                chunks = self.process_markdown(content)
+                    chunks = self.process_markdown(f)
                 
                 # 转换为Document格式
                 from langchain.schema import Document
@@ -363,6 +418,7 @@ class DocumentLoader:
                 return docs
                 
             elif self.extension == '.txt':
+                from langchain_community.document_loaders import TextLoader
                 loader = TextLoader(self.file_path, encoding='utf-8')
                 docs = loader.load()
                 for doc in docs:
@@ -388,6 +444,7 @@ class DocumentLoader:
             # 如果 utf-8 失败，尝试 gbk
             if self.extension in ['.md', '.txt']:
                 try:
+                    from langchain_community.document_loaders import TextLoader
                     loader = TextLoader(self.file_path, encoding='gbk')
                     docs = loader.load()
                     for doc in docs:
@@ -398,13 +455,25 @@ class DocumentLoader:
                     raise
             raise
 
+def load_single_file(file_path_abs: str) -> List:
+    """加载单个文件并补充文件名和来源信息（模块级函数，便于在子进程中执行）"""
+    loader = DocumentLoader(file_path_abs)
+    docs = loader.load()
+    # 添加文件名到metadata
+    file_name = Path(file_path_abs).name
+    for doc in docs:
+        doc.metadata['file_name'] = file_name
+        if 'source' not in doc.metadata or not doc.metadata['source']:
+            doc.metadata['source'] = file_path_abs
+    return docs
+
 class DocumentProcessor:
-    def __init__(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-        )
+    def __init__(self, load_workers: int = None, load_mode: str = None):
+        # 按标题结构和 token 数分块，见 StructuredChunker
+        self.chunker = StructuredChunker()
+        # 并行加载配置：工作进程/线程数，load_mode 为 auto（按文件类型选择进程或线程）或 thread
+        self.load_workers = load_workers or int(os.getenv("LOAD_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.load_mode = (load_mode or os.getenv("LOAD_MODE", "auto")).lower()
         
     def get_index_name(self, path: str) -> str:
         """根据文件路径生成索引名称"""
@@ -415,6 +484,102 @@ class DocumentProcessor:
             # 如果是文件，使用文件名（不含扩展名）
             return f"rag_{os.path.splitext(os.path.basename(path))[0].lower()}"
         
+    def list_files(self, path: str) -> List[str]:
+        """列出路径下的所有文件（绝对路径），单个文件时返回其本身"""
+        normalized_input_path = normalize_path(path)
+        if not os.path.isdir(normalized_input_path):
+            return [normalized_input_path]
+        
+        file_paths = []
+        # 排序保证每次遍历顺序一致
+        for root, dirs, files in os.walk(normalized_input_path):
+            dirs.sort()
+            for file in sorted(files):
+                file_paths.append(normalize_path(os.path.join(root, file)))
+        return file_paths
+    
+    def load_file(self, file_path_abs: str) -> List:
+        """加载单个文件并补充文件名和来源信息"""
+        return load_single_file(file_path_abs)
+    
+    @staticmethod
+    def _has_image_refs(file_path: str) -> bool:
+        """Markdown 中是否有图片引用；按字节查找，UTF-8 和 GBK 文件都适用"""
+        tail = b''
+        with open(file_path, 'rb') as f:
+            while True:
+                block = f.read(1 << 20)
+                if not block:
+                    return False
+                if b'![' in tail + block:
+                    return True
+                tail = block[-1:]
+    
+    def _is_api_bound(self, file_path: str) -> bool:
+        """图片和带图片的 Markdown（VLM 调用）、PDF（等待 magic-pdf）主要在等待 IO，用线程即可
+
+        VLM 调用必须留在主进程中，子进程各自的 HttpClient 会使全局限速按进程数成倍放大。
+        """
+        extension = os.path.splitext(file_path)[1].lower()
+        if extension in API_BOUND_EXTENSIONS:
+            return True
+        return extension == '.md' and self._has_image_refs(file_path)
+    
+    def load_files(self, file_paths: List[str]) -> Iterator[Tuple[str, List, Optional[Exception]]]:
+        """并行加载多个文件，按输入顺序逐个返回 (文件路径, 文档列表, 异常)
+
+        不含图片的 Markdown/TXT 解析在进程池中进行以利用多核，其他文件在线程池中进行；
+        同时在途的文件数有上限，单个文件出错不影响其他文件。
+        进程池使用 spawn 方式启动：调用方（入库流水线）的其他线程此时可能持有锁或连接，fork 不安全。
+        """
+        if self.load_workers <= 1 or len(file_paths) <= 1:
+            for file_path in file_paths:
+                try:
+                    yield file_path, self.load_file(file_path), None
+                except Exception as e:
+                    yield file_path, [], e
+            return
+        
+        process_pool = None
+        thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.load_workers)
+        pending = collections.deque()
+        remaining = iter(file_paths)
+        
+        def submit(file_path: str):
+            nonlocal process_pool
+            try:
+                use_thread = self.load_mode == "thread" or self._is_api_bound(file_path)
+            except OSError:
+                # 文件无法读取，交给线程池加载以按原样报告错误
+                use_thread = True
+            if use_thread:
+                pool = thread_pool
+            else:
+                # 只在确实需要时才启动子进程
+                if process_pool is None:
+                    process_pool = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=self.load_workers, mp_context=multiprocessing.get_context("spawn"))
+                pool = process_pool
+            pending.append((file_path, pool.submit(load_single_file, file_path)))
+        
+        try:
+            for file_path in itertools.islice(remaining, self.load_workers * 2):
+                submit(file_path)
+            while pending:
+                file_path, future = pending.popleft()
+                try:
+                    docs, error = future.result(), None
+                except Exception as e:
+                    docs, error = [], e
+                next_path = next(remaining, None)
+                if next_path is not None:
+                    submit(next_path)
+                yield file_path, docs, error
+        finally:
+            if process_pool is not None:
+                process_pool.shutdown(wait=False, cancel_futures=True)
+            thread_pool.shutdown(wait=False, cancel_futures=True)
+    
     def process(self, path: str) -> List[Dict]:
         """
         加载并处理文档，支持目录或单个文件
@@ -422,54 +587,46 @@ class DocumentProcessor:
         """
         normalized_input_path = normalize_path(path)
 
-        all_loaded_docs = []
         if os.path.isdir(normalized_input_path):
-            for root, _, files in os.walk(normalized_input_path):
-                for file in files:
-                    file_path_abs = normalize_path(os.path.join(root, file))
-                    try:
-                        loader = DocumentLoader(file_path_abs)
-                        docs = loader.load()
-                        # 添加文件名到metadata
-                        file_name = Path(file_path_abs).name
-                        for doc in docs:
-                            doc.metadata['file_name'] = file_name
-                            if 'source' not in doc.metadata or not doc.metadata['source']:
-                                doc.metadata['source'] = file_path_abs
-                        all_loaded_docs.extend(docs)
-                    except Exception as e:
-                        print(f"警告：加载文件 {file_path_abs} 时出错: {str(e)}")
-                        continue
-        else:
-            try:
-                loader = DocumentLoader(normalized_input_path)
-                docs = loader.load()
-                # 添加文件名到metadata
-                file_name = Path(normalized_input_path).name
-                for doc in docs:
-                    doc.metadata['file_name'] = file_name
-                    if 'source' not in doc.metadata or not doc.metadata['source']:
-                        doc.metadata['source'] = normalized_input_path
-                all_loaded_docs.extend(docs)
-            except Exception as e:
-                print(f"加载文件时出错: {str(e)}")
-                raise
+            return self.process_files(self.list_files(normalized_input_path))
         
+        try:
+            all_loaded_docs = self.load_file(normalized_input_path)
+        except Exception as e:
+            print(f"加载文件时出错: {str(e)}")
+            raise
+        return self.split_documents(all_loaded_docs)
+    
+    def process_files(self, file_paths: List[str], failed_files: List[str] = None) -> List[Dict]:
+        """加载并处理一组文件，单个文件出错时跳过并记录到 failed_files"""
+        all_loaded_docs = []
+        for file_path_abs, docs, error in self.load_files(file_paths):
+            if error is not None:
+                print(f"警告：加载文件 {file_path_abs} 时出错: {str(error)}")
+                if failed_files is not None:
+                    failed_files.append(file_path_abs)
+                continue
+            all_loaded_docs.extend(docs)
+        return self.split_documents(all_loaded_docs)
+    
+    def split_documents(self, all_loaded_docs: List) -> List[Dict]:
+        """分块并转换为统一格式，文档片段 ID 由内容确定"""
         # 分块
-        chunks = self.text_splitter.split_documents(all_loaded_docs)
+        chunks = self.chunker.split(all_loaded_docs)
         
         # 处理成统一格式
         processed_docs = []
-        for i, chunk in enumerate(chunks):
-            processed_docs.append({
-                'id': f'doc_{i}',
-                'content': chunk.page_content,
+        for content, metadata in chunks:
+            doc = {
+                'content': content,
                 'metadata': {
-                    'file_name': chunk.metadata.get('file_name', Path(chunk.metadata.get('source', '未知文件')).name),
-                    'source': chunk.metadata.get('source', ''),
-                    'chunk_header': chunk.metadata.get('chunk_header', ''),
-                    'img_url': chunk.metadata.get('img_url', '')
+                    'file_name': metadata.get('file_name', Path(metadata.get('source', '未知文件')).name),
+                    'source': metadata.get('source', ''),
+                    'chunk_header': metadata.get('chunk_header', ''),
+                    'img_url': metadata.get('img_url', '')
                 }
-            })
+            }
+            doc['id'] = chunk_id(doc)
+            processed_docs.append(doc)
             
-        return processed_docs
\ No newline at end of file
+        return processed_docs
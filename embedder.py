@@ -0,0 +1,95 @@
+from typing import List, Dict
+import concurrent.futures
+import os
+from dotenv import load_dotenv
+from embedding_cache import EmbeddingCache
+from http_client import get_client
+from metrics import track, get_metrics
+
+load_dotenv()
+
+class Embedder:
+    """SiliconFlow embedding 客户端，支持批量并发请求，并通过 EmbeddingCache 复用已计算的向量"""
+    def __init__(self, model: str = "BAAI/bge-m3", batch_size: int = None, max_workers: int = None,
+                 cache: EmbeddingCache = None, use_cache: bool = None):
+        self.client = get_client()
+        self.model = model
+        # 批量 embedding 配置：每次请求的文本数量和并发请求数
+        self.batch_size = batch_size or int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+        self.max_workers = max_workers or int(os.getenv("EMBEDDING_WORKERS", "4"))
+        if use_cache is None:
+            use_cache = os.getenv("EMBEDDING_CACHE", "true").lower() not in ("0", "false", "no")
+        self.cache = (cache or EmbeddingCache.default()) if use_cache else None
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """一次请求获取一批文本的向量，按输入顺序返回"""
+        with track("embedding") as span:
+            span.set(payload_bytes=sum(len(text.encode('utf-8')) for text in texts), items=len(texts))
+            response = self.client.post(
+                "/embeddings",
+                json={
+                    "model": self.model,
+                    "input": texts
+                },
+                category="embedding"
+            )
+
+            if response.status_code != 200:
+                raise Exception(f"Error getting embedding: {response.text}")
+
+            result = response.json()
+            span.set(input=(result.get("usage") or {}).get("total_tokens"))
+
+        # 接口返回的 data 带有 index 字段，按 index 排序以保证顺序
+        data = sorted(result["data"], key=lambda item: item.get("index", 0))
+        if len(data) != len(texts):
+            raise Exception(f"Error getting embedding: 期望 {len(texts)} 个向量，实际返回 {len(data)} 个")
+        return [item["embedding"] for item in data]
+
+    def _request_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """分批并发请求 API，结果与输入顺序一致"""
+        batch_size = max(1, self.batch_size)
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        if len(batches) == 1:
+            return self._embed_batch(batches[0])
+
+        results: List[List[List[float]]] = [None] * len(batches)
+        # 使用有界线程池并发发送批量请求
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            future_to_pos = {executor.submit(self._embed_batch, batch): pos for pos, batch in enumerate(batches)}
+            for future in concurrent.futures.as_completed(future_to_pos):
+                results[future_to_pos[future]] = future.result()
+
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """获取多段文本的向量：先查缓存，只对未命中且去重后的文本调用 API"""
+        if not texts:
+            return []
+        if self.cache is None:
+            return self._request_embeddings(texts)
+
+        vectors = self.cache.get_many(self.model, texts)
+        missing: Dict[str, List[int]] = {}
+        for pos, (text, vector) in enumerate(zip(texts, vectors)):
+            if vector is None:
+                missing.setdefault(text, []).append(pos)
+        get_metrics().count("embedding_cache_hit", len(texts) - sum(len(p) for p in missing.values()))
+
+        if missing:
+            missing_texts = list(missing.keys())
+            new_vectors = self._request_embeddings(missing_texts)
+            self.cache.put_many(self.model, missing_texts, new_vectors)
+            for text, vector in zip(missing_texts, new_vectors):
+                for pos in missing[text]:
+                    vectors[pos] = vector
+
+        return vectors
+
+    def get_embedding(self, text: str) -> List[float]:
+        """获取单段文本的向量"""
+        return self.get_embeddings([text])[0]
+
+    def cache_stats(self) -> Dict:
+        """返回缓存命中统计，未启用缓存时返回空字典"""
+        return self.cache.stats() if self.cache else {}
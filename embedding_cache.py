@@ -0,0 +1,185 @@
+from typing import List, Dict, Optional, Tuple
+from collections import OrderedDict
+import hashlib
+import sqlite3
+import threading
+import time
+import os
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class EmbeddingCache:
+    """两级 embedding 缓存：内存 LRU + SQLite 磁盘存储，按 (模型名, 文本哈希) 寻址"""
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, db_path: str = None, memory_items: int = None, max_disk_mb: float = None):
+        self.db_path = db_path or os.getenv("EMBEDDING_CACHE_PATH", "./cache/embeddings.sqlite")
+        self.memory_items = memory_items if memory_items is not None else int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "10000"))
+        max_disk_mb = max_disk_mb if max_disk_mb is not None else float(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024"))
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+
+        self._memory: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_access ON embeddings(last_access)")
+        self._conn.commit()
+        self._disk_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    @classmethod
+    def default(cls) -> "EmbeddingCache":
+        """进程内共享的默认缓存实例"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """批量查询缓存，未命中的位置返回 None"""
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        disk_lookup: Dict[str, List[int]] = {}
+
+        with self._lock:
+            for pos, text in enumerate(texts):
+                key = (model, self.hash_text(text))
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    results[pos] = vector
+                    self.memory_hits += 1
+                else:
+                    disk_lookup.setdefault(key[1], []).append(pos)
+
+            if disk_lookup:
+                now = time.time()
+                found = {}
+                hashes = list(disk_lookup.keys())
+                # SQLite 单条语句的参数数量有限，分段查询
+                for start in range(0, len(hashes), 500):
+                    part = hashes[start:start + 500]
+                    placeholders = ",".join("?" * len(part))
+                    rows = self._conn.execute(
+                        f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                        [model, *part]
+                    ).fetchall()
+                    for text_hash, blob in rows:
+                        found[text_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+                if found:
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                        [(now, model, text_hash) for text_hash in found]
+                    )
+                    self._conn.commit()
+                for text_hash, vector in found.items():
+                    self._remember((model, text_hash), vector)
+                    for pos in disk_lookup[text_hash]:
+                        results[pos] = vector
+                        self.disk_hits += 1
+
+            hit_count = sum(1 for vector in results if vector is not None)
+            self.hits += hit_count
+            self.misses += len(texts) - hit_count
+
+        return results
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]) -> None:
+        """写入内存和磁盘两级缓存，超出磁盘上限时按最近访问时间淘汰"""
+        if not texts:
+            return
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                text_hash = self.hash_text(text)
+                blob = np.asarray(vector, dtype=np.float32).tobytes()
+                rows.append((model, text_hash, blob, len(blob), now))
+                self._remember((model, text_hash), list(vector))
+
+            # 先扣除将被覆盖的旧记录大小，保证磁盘占用统计准确
+            for model_name, text_hash, _, _, _ in rows:
+                old = self._conn.execute(
+                    "SELECT size FROM embeddings WHERE model = ? AND text_hash = ?",
+                    (model_name, text_hash)
+                ).fetchone()
+                if old:
+                    self._disk_bytes -= old[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._disk_bytes += sum(row[3] for row in rows)
+            self._evict_disk()
+            self._conn.commit()
+
+    def put(self, model: str, text: str, vector: List[float]) -> None:
+        self.put_many(model, [text], [vector])
+
+    def _remember(self, key: Tuple[str, str], vector: List[float]) -> None:
+        """写入内存 LRU（调用方需持有锁）"""
+        if self.memory_items <= 0:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self) -> None:
+        """磁盘占用超过上限时删除最久未访问的记录（调用方需持有锁）"""
+        if self.max_disk_bytes <= 0 or self._disk_bytes <= self.max_disk_bytes:
+            return
+        # 一次淘汰到上限的 90%，避免每次写入都触发淘汰
+        target = int(self.max_disk_bytes * 0.9)
+        cursor = self._conn.execute("SELECT model, text_hash, size FROM embeddings ORDER BY last_access ASC")
+        to_delete = []
+        for model, text_hash, size in cursor:
+            if self._disk_bytes <= target:
+                break
+            to_delete.append((model, text_hash))
+            self._disk_bytes -= size
+        self._conn.executemany("DELETE FROM embeddings WHERE model = ? AND text_hash = ?", to_delete)
+
+    def stats(self) -> Dict:
+        """返回缓存命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "hit_rate": self.hits / total if total else 0.0,
+                "memory_items": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,353 @@
+from typing import List, Dict, Iterable, Callable, Optional
+import collections
+from elasticsearch import Elasticsearch, helpers
+import urllib3
+import os
+from dotenv import load_dotenv
+from storage_backend import StorageBackend
+from metrics import record_duration
+
+load_dotenv()
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+class ElasticsearchBackend(StorageBackend):
+    """Elasticsearch 8.x 存储后端：HNSW knn + BM25 混合检索"""
+    name = "elasticsearch"
+    # delete_chunks 每次 mget / bulk 请求的片段数
+    DELETE_BATCH_SIZE = 500
+
+    def __init__(self):
+        # ES 8.x 的连接配置
+        self.es = Elasticsearch(
+            "https://localhost:9200",
+            basic_auth=("elastic", os.getenv("PASSWORD")),
+            verify_certs=False,
+            request_timeout=30,
+            # 忽略系统索引警告
+            headers={"accept": "application/vnd.elasticsearch+json; compatible-with=8"},
+        )
+        # HNSW 索引参数：m 为每个节点的邻居数，ef_construction 为建图时的候选数
+        self.hnsw_m = int(os.getenv("ES_HNSW_M", "16"))
+        self.hnsw_ef_construction = int(os.getenv("ES_HNSW_EF_CONSTRUCTION", "100"))
+        # 向量量化方式：none 或 int8（int8 可减少约 75% 的向量内存占用）
+        self.vector_quantization = os.getenv("ES_VECTOR_QUANTIZATION", "none").lower()
+        # 流式 bulk 写入配置：每个请求的文档数上限、字节数上限和被拒绝条目的重试次数
+        self.bulk_chunk_size = int(os.getenv("BULK_CHUNK_SIZE", "200"))
+        self.bulk_max_bytes = int(float(os.getenv("BULK_MAX_MB", "20")) * 1024 * 1024)
+        self.bulk_max_retries = int(os.getenv("BULK_MAX_RETRIES", "3"))
+        # 检索模式：knn 使用 HNSW 近似最近邻 + BM25 混合检索；script_score 为旧的暴力打分方式
+        self.retrieval_mode = os.getenv("RETRIEVAL_MODE", "knn").lower()
+        # knn 每个分片的候选数量，越大召回越高、延迟越高
+        self.num_candidates = int(os.getenv("KNN_NUM_CANDIDATES", "100"))
+        # 混合检索时向量分数与 BM25 分数的权重
+        self.knn_boost = float(os.getenv("KNN_BOOST", "1.0"))
+        self.bm25_boost = float(os.getenv("BM25_BOOST", "0.1"))
+        # 一次多索引检索的整体超时时间（秒）
+        self.search_timeout = float(os.getenv("SEARCH_TIMEOUT", "10"))
+
+    # --- 写入 ---
+    def list_indices(self) -> List[str]:
+        indices = self.es.indices.get_alias().keys()
+        return [idx for idx in indices if idx.startswith('rag_')]
+
+    def index_exists(self, index_name: str) -> bool:
+        return bool(self.es.indices.exists(index=index_name))
+
+    def bulk_index(self, actions: Iterable[Dict], index_name: str,
+                   on_indexed: Optional[Callable[[str, Dict], None]] = None,
+                   on_deleted: Optional[Callable[[str, Dict], None]] = None) -> Dict:
+        """流式执行 bulk 操作，结束后刷新一次索引并汇总结果
+
+        按文档数和字节数分块发送 bulk 请求，被拒绝（429）的条目会退避重试。
+        bulk 结果中没有被覆盖的旧文档，因此不调用 on_deleted，只对新建（created）的文档调用 on_indexed。
+        """
+        # 已发送但还没有结果的操作，按 ID 在结果返回时取出；数量不超过正在发送和重试的分块
+        pending = collections.defaultdict(collections.deque)
+
+        def track_pending(actions):
+            for action in actions:
+                pending[action["_id"]].append(action)
+                yield action
+
+        indexed = 0
+        errors = []
+        for ok, item in helpers.streaming_bulk(
+            self.es,
+            track_pending(actions) if on_indexed else actions,
+            chunk_size=self.bulk_chunk_size,
+            max_chunk_bytes=self.bulk_max_bytes,
+            max_retries=self.bulk_max_retries,
+            raise_on_error=False,
+            raise_on_exception=False,
+        ):
+            if ok:
+                indexed += 1
+            else:
+                errors.append(item)
+            if on_indexed:
+                doc_id = next(iter(item.values())).get("_id")
+                queue = pending.get(doc_id)
+                if queue:
+                    action = queue.popleft()
+                    if not queue:
+                        del pending[doc_id]
+                    # 覆盖已有 ID 的结果为 updated，该片段已经计入过
+                    if ok and next(iter(item.values())).get("result") == "created":
+                        on_indexed(action.get("_index") or index_name, action["_source"])
+
+        # 全部写入后统一刷新一次
+        self.es.indices.refresh(index=index_name)
+
+        if errors:
+            print(f"批量写入时有 {len(errors)} 个文档失败，示例：", errors[:3])
+        return {"indexed": indexed, "failed": len(errors), "errors": errors}
+
+    def delete_chunks(self, index_name: str, chunk_ids: List[str],
+                      on_deleted: Optional[Callable[[str, Dict], None]] = None) -> None:
+        if not chunk_ids or not self.es.indices.exists(index=index_name):
+            return
+        # 分批取回和删除，避免一次请求携带过多 ID
+        for start in range(0, len(chunk_ids), self.DELETE_BATCH_SIZE):
+            batch = chunk_ids[start:start + self.DELETE_BATCH_SIZE]
+            sources = {}
+            if on_deleted:
+                # 删除前取出内容和向量，供回调从路由摘要中扣除
+                found = self.es.mget(index=index_name, ids=batch, source_includes=["content", "vector"])
+                sources = {doc['_id']: doc['_source'] for doc in found['docs'] if doc.get('found')}
+            operations = [{"delete": {"_index": index_name, "_id": cid}} for cid in batch]
+            response = self.es.bulk(operations=operations)
+            if response.get('errors'):
+                # 删除不存在的文档会返回 404，可以忽略
+                failed = [item for item in response['items'] if item['delete'].get('status') not in (200, 404)]
+                if failed:
+                    print("批量删除时出现错误：", failed)
+            for item in response['items']:
+                source = sources.get(item['delete'].get('_id'))
+                if source is not None and item['delete'].get('status') == 200:
+                    on_deleted(index_name, source)
+        self.es.indices.refresh(index=index_name)
+
+    def get_files(self, index_name: str) -> List[str]:
+        response = self.es.search(
+            index=index_name,
+            body={
+                "size": 0,
+                "aggs": {
+                    "unique_files": {
+                        "terms": {
+                            "field": "metadata.file_name",
+                            "size": 1000
+                        }
+                    }
+                }
+            }
+        )
+        files = [bucket['key'] for bucket in response['aggregations']['unique_files']['buckets']]
+        return sorted(files)
+
+    def _vector_mapping(self) -> Dict:
+        """构建向量字段的 mapping，启用 HNSW 近似最近邻索引"""
+        index_type = "int8_hnsw" if self.vector_quantization == "int8" else "hnsw"
+        return {
+            "type": "dense_vector",
+            "dims": 1024,
+            "index": True,
+            "similarity": "cosine",
+            "index_options": {
+                "type": index_type,
+                "m": self.hnsw_m,
+                "ef_construction": self.hnsw_ef_construction
+            }
+        }
+
+    def create_index(self, index_name: str) -> None:
+        settings = {
+            "mappings": {
+                "properties": {
+                    "content": {"type": "text"},
+                    "vector": self._vector_mapping(),
+                    "metadata": {
+                        "properties": {
+                            "file_name": {
+                                "type": "keyword",
+                                "ignore_above": 256
+                            },
+                            "source": {
+                                "type": "keyword"
+                            },
+                            "chunk_header": {  # 新增标题层级字段
+                                "type": "text",
+                                "fields": {
+                                    "keyword": {
+                                        "type": "keyword",
+                                        "ignore_above": 512
+                                    }
+                                }
+                            },
+                            "img_url": {
+                                "type": "keyword",
+                                "ignore_above": 2048
+                            }
+                        }
+                    }
+                }
+            }
+        }
+
+        # 如果索引已存在，先删除
+        if self.es.indices.exists(index=index_name):
+            self.es.indices.delete(index=index_name)
+        self._index_dropped(index_name)
+
+        self.es.indices.create(index=index_name, body=settings)
+
+    # --- 检索 ---
+    def _build_script_score_body(self, query: str, query_vector: List[float], top_k: int) -> Dict:
+        """BM25 召回后对命中文档逐个计算余弦相似度"""
+        return {
+            "query": {
+                "script_score": {
+                    "query": {
+                        "match": {
+                            "content": query  # BM25
+                        }
+                    },
+                    "script": {
+                        "source": "cosineSimilarity(params.query_vector, 'vector') + 1.0",
+                        "params": {"query_vector": query_vector}
+                    }
+                }
+            },
+            "_source": {"excludes": ["vector"]},
+            "size": top_k
+        }
+
+    def _build_fallback_body(self, query: str, query_vector: List[float], top_k: int) -> Dict:
+        """knn 模式下未建立 HNSW 索引的旧索引：BM25 召回后按与 knn 混合检索相同的公式打分
+
+        knn 的 cosine 分数为 (1 + cos) / 2，再与 BM25 分数按相同的权重相加，
+        结果可以与其他索引的混合检索结果直接比较和合并。
+        """
+        return {
+            "query": {
+                "script_score": {
+                    "query": {
+                        "match": {
+                            "content": query  # BM25
+                        }
+                    },
+                    "script": {
+                        "source": "params.knn_boost * (cosineSimilarity(params.query_vector, 'vector') + 1.0) / 2"
+                                  " + params.bm25_boost * _score",
+                        "params": {
+                            "query_vector": query_vector,
+                            "knn_boost": self.knn_boost,
+                            "bm25_boost": self.bm25_boost
+                        }
+                    }
+                }
+            },
+            "_source": {"excludes": ["vector"]},
+            "size": top_k
+        }
+
+    def _build_knn_body(self, query: str, query_vector: List[float], top_k: int) -> Dict:
+        """HNSW knn 召回与 BM25 召回取并集，分数按权重相加"""
+        return {
+            "knn": {
+                "field": "vector",
+                "query_vector": query_vector,
+                "k": top_k,
+                "num_candidates": max(self.num_candidates, top_k),
+                "boost": self.knn_boost
+            },
+            "query": {
+                "match": {
+                    "content": {
+                        "query": query,  # BM25
+                        "boost": self.bm25_boost
+                    }
+                }
+            },
+            "_source": {"excludes": ["vector"]},
+            "size": top_k
+        }
+
+    def _build_search_body(self, query: str, query_vector: List[float], top_k: int) -> Dict:
+        """根据检索模式构建查询体"""
+        if self.retrieval_mode == "knn":
+            return self._build_knn_body(query, query_vector, top_k)
+        return self._build_script_score_body(query, query_vector, top_k)
+
+    def search(self, indices: List[str], query: str, query_vector: List[float], top_k: int) -> List[Dict]:
+        """将所有索引的检索合并为一次 _msearch 请求，共享同一个超时时间"""
+        searches = []
+        for index in indices:
+            searches.append({"index": index})
+            searches.append(self._build_search_body(query, query_vector, top_k))
+
+        es = self.es.options(request_timeout=self.search_timeout)
+        responses = es.msearch(searches=searches)['responses']
+        self._record_index_stats(indices, responses, self.retrieval_mode)
+
+        all_results = []
+        fallback_indices = []
+        errors = {}
+        for index, response in zip(indices, responses):
+            if 'error' in response:
+                if self.retrieval_mode == "knn":
+                    # 旧索引的向量字段未建立 HNSW 索引时，退回 script_score 检索
+                    print(f"索引 {index} 不支持 knn 检索，改用 script_score: {response['error']}")
+                    fallback_indices.append(index)
+                else:
+                    print(f"检索索引 {index} 时出错: {response['error']}")
+                    errors[index] = response['error']
+                continue
+            all_results.extend(self._parse_hits(response, index))
+
+        if fallback_indices:
+            searches = []
+            for index in fallback_indices:
+                searches.append({"index": index})
+                searches.append(self._build_fallback_body(query, query_vector, top_k))
+            responses = es.msearch(searches=searches)['responses']
+            self._record_index_stats(fallback_indices, responses, "fallback")
+            for index, response in zip(fallback_indices, responses):
+                if 'error' in response:
+                    print(f"检索索引 {index} 时出错: {response['error']}")
+                    errors[index] = response['error']
+                    continue
+                all_results.extend(self._parse_hits(response, index))
+
+        self._check_errors(indices, errors)
+        return all_results
+
+    @staticmethod
+    def _record_index_stats(indices: List[str], responses: List[Dict], mode: str) -> None:
+        """_msearch 是一个请求，按各索引响应中的 took 分别记录检索耗时和命中数"""
+        for index, response in zip(indices, responses):
+            if 'error' in response:
+                continue
+            record_duration("search_index", response.get('took', 0) / 1000, items=len(response['hits']['hits']),
+                            backend="elasticsearch", index=index, mode=mode)
+
+    @staticmethod
+    def _check_errors(indices: List[str], errors: Dict[str, object]) -> None:
+        """部分索引出错时只打印并使用其他索引的结果；全部出错时抛出异常，避免被当作没有相关文档"""
+        if indices and len(errors) >= len(indices):
+            index, error = next(iter(errors.items()))
+            raise Exception(f"检索全部 {len(indices)} 个索引时均出错，例如 {index}: {error}")
+
+    def _parse_hits(self, response: Dict, index: str) -> List[Dict]:
+        """将 ES 检索结果转换为统一的文档格式"""
+        results = []
+        for hit in response['hits']['hits']:
+            results.append({
+                'id': hit['_id'],
+                'content': hit['_source']['content'],
+                'score': hit['_score'],
+                'metadata': hit['_source']['metadata'],
+                'index': index
+            })
+        return results
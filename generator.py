@@ -1,51 +1,35 @@
-from typing import List, Dict
-import requests
+from typing import List, Dict, Iterator
+import json
 import os
+import time
 from dotenv import load_dotenv
+from http_client import get_client
+from context_packer import ContextPacker
+from token_counter import count_tokens
+from metrics import track, record_duration
 
 load_dotenv()
 
 class Generator:
     def __init__(self):
-        self.api_key = os.getenv("API_KEY")
-        self.api_base = os.getenv("BASE_URL")
+        self.client = get_client()
+        self.packer = ContextPacker()
+        # 模型上下文窗口和回答长度上限；回答长度随参考内容的长度增减
+        self.model_context_tokens = int(os.getenv("MODEL_CONTEXT_TOKENS", "64000"))
+        self.min_answer_tokens = int(os.getenv("GENERATION_MIN_TOKENS", "1024"))
+        self.max_answer_tokens = int(os.getenv("GENERATION_MAX_TOKENS", "8000"))
+        self.answer_token_ratio = float(os.getenv("ANSWER_TOKEN_RATIO", "0.5"))
+    
+    def _answer_tokens(self, context_tokens: int, prompt_tokens: int) -> int:
+        """根据参考内容长度确定 max_tokens，且不超过上下文窗口的剩余空间"""
+        wanted = self.min_answer_tokens + int(context_tokens * self.answer_token_ratio)
+        available = self.model_context_tokens - prompt_tokens
+        return max(1, min(self.max_answer_tokens, wanted, available))
         
-    def generate(self, query: str, context_docs: List[Dict]) -> str:
-        """使用SiliconFlow的chat API生成回答"""
-        # 构建带有引用标记的上下文
-        context_with_refs = []
-        
-        for i, doc in enumerate(context_docs, 1):
-            metadata = doc['metadata']
-            file_name = metadata.get('file_name', '未知文件')
-            chunk_header = metadata.get('chunk_header', '')
-            img_url = metadata.get('img_url', '')
-            source = metadata.get('source', '')
-            
-            # 构建引用标记
-            ref_header = f"[{i}] "
-            if chunk_header:
-                ref_header += f"【{chunk_header}】"
-            
-            # 构建文档内容
-            content = doc['content']
-            
-            # 如果是图片描述，特殊处理
-            if content.startswith("图片描述：") and img_url:
-                context_with_refs.append(f"{ref_header}{content}\nimg_url: {img_url}")
-            else:
-                # 普通文本内容
-                file = f"file_name: {file_name}"
-                source = f"source: {source}"
-                header = f"header: {chunk_header}"
-                context_with_refs.append(f"{ref_header}{content}\n{file}\n{source}\n{header}")
-        
-        context = "\n\n".join(context_with_refs)
-        
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+    def _build_payload(self, query: str, context_docs: List[Dict]) -> Dict:
+        """构建 chat API 的请求体"""
+        # 按 token 预算合并、去重并截断参考内容，带有引用标记
+        context, context_tokens = self.packer.pack(context_docs)
         
         system_prompt = """你是一个有帮助的助手。请基于提供的参考内容回答问题，使用markdown格式。
 1. 如果回答中引用文本参考内容（非图片），请在相关内容后用方括号标注编号（按照你引用的顺序重新编号），例如：[1]、[2]
@@ -57,28 +41,95 @@ class Generator:
 [1] 一句话概括 [{{file_name}}]({{source}}) {{header}}
 """
 
-        response = requests.post(
-            f"{self.api_base}/chat/completions",
-            headers=headers,
-            json={
-                "model": "deepseek-ai/DeepSeek-V3",
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"""
+        user_prompt = f"""
 参考内容：
 {context}
 
 问题：{query}
 
 请按照要求回答问题。
-"""}
-                ],
-                "temperature": 0.7,
-                "max_tokens": 8000
-            }
-        )
+"""
+        prompt_tokens = count_tokens(system_prompt) + count_tokens(user_prompt)
+
+        return {
+            "model": "deepseek-ai/DeepSeek-V3",
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            "temperature": 0.7,
+            "max_tokens": self._answer_tokens(context_tokens, prompt_tokens)
+        }
+    
+    @staticmethod
+    def _record_usage(span, payload: Dict, usage: Dict, answer: str) -> None:
+        """记录 token 数：优先使用接口返回的 usage，否则按文本估算"""
+        usage = usage or {}
+        prompt_tokens = usage.get("prompt_tokens")
+        if prompt_tokens is None:
+            prompt_tokens = sum(count_tokens(message["content"]) for message in payload["messages"])
+        completion_tokens = usage.get("completion_tokens")
+        if completion_tokens is None:
+            completion_tokens = count_tokens(answer)
+        span.set(prompt=prompt_tokens, completion=completion_tokens)
+    
+    def generate(self, query: str, context_docs: List[Dict]) -> str:
+        """使用SiliconFlow的chat API生成回答"""
+        payload = self._build_payload(query, context_docs)
+        with track("generate") as span:
+            span.set(payload_bytes=len(json.dumps(payload, ensure_ascii=False).encode('utf-8')), items=len(context_docs))
+            response = self.client.post(
+                "/chat/completions",
+                json=payload,
+                category="chat"
+            )
+            
+            if response.status_code != 200:
+                raise Exception(f"Error in generation: {response.text}")
+            
+            result = response.json()
+            answer = result["choices"][0]["message"]["content"]
+            self._record_usage(span, payload, result.get("usage"), answer)
+        return answer
+    
+    def generate_stream(self, query: str, context_docs: List[Dict]) -> Iterator[str]:
+        """以 SSE 流式调用 chat API，逐段返回生成的文本"""
+        payload = self._build_payload(query, context_docs)
+        payload["stream"] = True
         
-        if response.status_code != 200:
-            raise Exception(f"Error in generation: {response.text}")
+        # 首 token 延迟从发出请求开始计算
+        started = time.perf_counter()
+        with track("generate", stream="true") as span, self.client.post(
+            "/chat/completions",
+            json=payload,
+            stream=True,
+            category="chat"
+        ) as response:
+            span.set(payload_bytes=len(json.dumps(payload, ensure_ascii=False).encode('utf-8')), items=len(context_docs))
+            if response.status_code != 200:
+                raise Exception(f"Error in generation: {response.text}")
             
-        return response.json()["choices"][0]["message"]["content"] 
\ No newline at end of file
+            # text/event-stream 通常不带 charset，requests 会误用 ISO-8859-1 解码
+            response.encoding = 'utf-8'
+            tokens = []
+            usage = None
+            for line in response.iter_lines(decode_unicode=True):
+                # SSE 格式：每个事件以 "data: " 开头，以 "[DONE]" 结束
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                usage = event.get("usage") or usage
+                choices = event.get("choices") or []
+                if not choices:
+                    continue
+                token = (choices[0].get("delta") or {}).get("content")
+                if token:
+                    if not tokens:
+                        # 首个 token 的等待时间单独记录
+                        record_duration("generate_first_token", time.perf_counter() - started)
+                    tokens.append(token)
+                    yield token
+            self._record_usage(span, payload, usage, "".join(tokens))
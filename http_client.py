@@ -0,0 +1,137 @@
+from typing import Dict, Optional
+import random
+import threading
+import time
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from metrics import get_metrics
+
+load_dotenv()
+
+# 需要重试的状态码：限流和服务端错误
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """线程安全的令牌桶，按先来先得的顺序发放令牌，避免某个阶段长期抢不到配额
+
+    令牌按预约发放：每次调用立即扣除一个令牌（可以扣成负数），并返回需要等待的时间，
+    因此同步线程和 asyncio 协程可以共用同一个桶，协程等待时不占用线程。
+    """
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """预约一个令牌，返回还需等待的秒数；rate <= 0 表示不限速"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self) -> None:
+        """获取一个令牌，配额不足时阻塞等待"""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+class HttpClient:
+    """所有 SiliconFlow 调用共享的 HTTP 客户端
+
+    复用 keep-alive 连接池，设置连接/读取超时，对 429 和 5xx 做指数退避重试，
+    并通过全局令牌桶限制 embedding、rerank、chat、VLM 的总请求速率。
+    """
+    _default = None
+    _default_pid = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, api_base: str = None, api_key: str = None):
+        self.api_base = api_base or os.getenv("BASE_URL")
+        self.api_key = api_key or os.getenv("API_KEY")
+        self.connect_timeout = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+        self.read_timeout = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+        self.max_retries = int(os.getenv("HTTP_MAX_RETRIES", "5"))
+        self.backoff_base = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+        self.backoff_max = float(os.getenv("HTTP_BACKOFF_MAX", "30"))
+        self.rate_limiter = TokenBucket(
+            rate=float(os.getenv("API_RATE_LIMIT", "0")),
+            burst=int(os.getenv("API_RATE_BURST", "10"))
+        )
+
+        pool_size = int(os.getenv("HTTP_POOL_SIZE", "32"))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        })
+
+    @classmethod
+    def default(cls) -> "HttpClient":
+        """当前进程共享的客户端（子进程中会重新创建，避免复用父进程的连接）"""
+        with cls._default_lock:
+            if cls._default is None or cls._default_pid != os.getpid():
+                cls._default = cls()
+                cls._default_pid = os.getpid()
+            return cls._default
+
+    def _backoff(self, attempt: int, response: Optional[requests.Response]) -> float:
+        """计算重试等待时间，优先使用服务端返回的 Retry-After"""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(self.backoff_max, float(retry_after))
+                except ValueError:
+                    pass
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2)
+
+    def post(self, path: str, json: Dict, stream: bool = False, category: str = "api",
+             timeout: Optional[float] = None) -> requests.Response:
+        """POST 到 {BASE_URL}{path}，返回最后一次的响应；重试耗尽后由调用方检查状态码
+
+        category 仅用于日志，标明是哪类调用（embedding / rerank / chat / vlm）。
+        """
+        url = f"{self.api_base}{path}"
+        response = None
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.post(
+                    url,
+                    json=json,
+                    stream=stream,
+                    timeout=(self.connect_timeout, timeout or self.read_timeout)
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, None)
+                get_metrics().count("http_retry", category=category, reason=type(e).__name__)
+                print(f"{category} 请求失败（{type(e).__name__}），{delay:.1f}s 后重试（{attempt + 1}/{self.max_retries}）")
+                time.sleep(delay)
+                continue
+
+            if response.status_code not in RETRY_STATUS or attempt >= self.max_retries:
+                return response
+
+            delay = self._backoff(attempt, response)
+            get_metrics().count("http_retry", category=category, reason=str(response.status_code))
+            print(f"{category} 请求返回 {response.status_code}，{delay:.1f}s 后重试（{attempt + 1}/{self.max_retries}）")
+            response.close()
+            time.sleep(delay)
+        return response
+
+def get_client() -> HttpClient:
+    return HttpClient.default()
@@ -0,0 +1,96 @@
+from typing import Dict, Optional, Tuple
+import hashlib
+import sqlite3
+import threading
+import time
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_MISSING = object()
+
+# (图片内容哈希, 上下文哈希)
+ImageKey = Tuple[str, str]
+
+class ImageDescriptionCache:
+    """VLM 图片描述的持久化缓存，按 (模型, 图片内容哈希, 上下文哈希) 寻址
+
+    "无意义图片" 的判定结果以 None 的形式同样会被缓存。
+    """
+    _default = None
+    _default_pid = None
+    _default_lock = threading.Lock()
+
+    MISSING = _MISSING
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or os.getenv("IMAGE_CACHE_PATH", "./cache/image_descriptions.sqlite")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        # 加载文件可能在多个进程中进行，设置等待超时避免写锁冲突直接失败
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS image_descriptions (
+                model TEXT NOT NULL,
+                image_hash TEXT NOT NULL,
+                context_hash TEXT NOT NULL,
+                description TEXT,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (model, image_hash, context_hash)
+            )"""
+        )
+        self._conn.commit()
+
+    @classmethod
+    def default(cls) -> "ImageDescriptionCache":
+        """当前进程共享的默认缓存实例（子进程中会重新打开连接）"""
+        with cls._default_lock:
+            if cls._default is None or cls._default_pid != os.getpid():
+                cls._default = cls()
+                cls._default_pid = os.getpid()
+            return cls._default
+
+    @staticmethod
+    def make_key(image_data: bytes, context: str = None) -> ImageKey:
+        """根据图片内容和上下文生成缓存键"""
+        image_hash = hashlib.sha256(image_data).hexdigest()
+        context_hash = hashlib.sha256((context or "").encode('utf-8')).hexdigest()
+        return image_hash, context_hash
+
+    def get(self, model: str, key: ImageKey):
+        """返回缓存的描述（可能为 None 表示无意义图片），未命中时返回 MISSING"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT description FROM image_descriptions WHERE model = ? AND image_hash = ? AND context_hash = ?",
+                (model, *key)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return _MISSING
+            self.hits += 1
+            return row[0]
+
+    def put(self, model: str, key: ImageKey, description: Optional[str]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO image_descriptions (model, image_hash, context_hash, description, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (model, *key, description, time.time())
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,80 @@
+from typing import List, Dict, Optional
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+def file_hash(file_path: str) -> str:
+    """按块读取文件并计算内容哈希"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_id(doc: Dict) -> str:
+    """根据来源文件、标题层级和内容生成稳定的文档片段 ID"""
+    metadata = doc.get('metadata', {})
+    key = "\n".join([
+        metadata.get('source', ''),
+        metadata.get('chunk_header', ''),
+        metadata.get('img_url', ''),
+        doc['content']
+    ])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:40]
+
+class IngestManifest:
+    """知识库的文件清单：文件路径 → 内容哈希 → 文档片段 ID 列表"""
+    def __init__(self, index_name: str, manifest_dir: str = None):
+        manifest_dir = manifest_dir or os.getenv("MANIFEST_DIR", "./cache/manifests")
+        os.makedirs(manifest_dir, exist_ok=True)
+        self.index_name = index_name
+        self.path = os.path.join(manifest_dir, f"{index_name}.json")
+        self._lock = threading.Lock()
+        self.files: Dict[str, Dict] = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.files = json.load(f).get('files', {})
+            except Exception as e:
+                print(f"读取清单 {self.path} 时出错，将重新建立: {str(e)}")
+                self.files = {}
+
+    def get(self, file_path: str) -> Optional[Dict]:
+        return self.files.get(file_path)
+
+    def is_unchanged(self, file_path: str, content_hash: str) -> bool:
+        entry = self.files.get(file_path)
+        return entry is not None and entry.get('hash') == content_hash
+
+    def files_under(self, root: str) -> List[str]:
+        """返回清单中位于 root 目录下（或等于 root）的文件"""
+        root_path = Path(root)
+        result = []
+        for file_path in self.files:
+            path = Path(file_path)
+            if path == root_path or root_path in path.parents:
+                result.append(file_path)
+        return result
+
+    def update(self, file_path: str, content_hash: str, chunk_ids: List[str]) -> None:
+        with self._lock:
+            self.files[file_path] = {'hash': content_hash, 'chunk_ids': chunk_ids}
+
+    def remove(self, file_path: str) -> List[str]:
+        """移除文件记录并返回其文档片段 ID"""
+        with self._lock:
+            entry = self.files.pop(file_path, None)
+        return entry.get('chunk_ids', []) if entry else []
+
+    def save(self) -> None:
+        """原子写入清单文件"""
+        tmp_path = f"{self.path}.tmp"
+        with self._lock:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'index': self.index_name, 'files': self.files}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
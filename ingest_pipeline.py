@@ -0,0 +1,220 @@
+from typing import List, Dict, Iterator
+import queue
+import threading
+import time
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_DONE = object()  # 阶段结束标记
+
+class _Aborted(Exception):
+    """其他阶段出错时用于中止当前阶段"""
+
+class StageStats:
+    """单个流水线阶段的统计：处理数量、实际工作时间和等待时间"""
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.busy = 0.0
+        self.started = None
+        self.finished = None
+
+    def report(self) -> Dict:
+        wall = (self.finished or time.time()) - (self.started or time.time())
+        return {
+            "stage": self.name,
+            "unit": self.unit,
+            "items": self.items,
+            "busy_seconds": round(self.busy, 3),
+            "wall_seconds": round(wall, 3),
+            "throughput": round(self.items / self.busy, 2) if self.busy > 0 else 0.0,
+        }
+
+class _IngestRun:
+    """一次入库的运行状态：中止标志、错误、各文件的片段 ID、失败文件和阶段统计
+
+    每次 run 单独创建，同一个 IngestPipeline 被多个会话同时使用时互不影响。
+    """
+    def __init__(self):
+        self.abort = threading.Event()
+        self.error = None
+        self.lock = threading.Lock()
+        self.chunk_ids: Dict[str, List[str]] = {}
+        self.failed_files: List[str] = []
+        self.stats = {
+            "load": StageStats("load", "files"),
+            "split": StageStats("split", "chunks"),
+            "embed": StageStats("embed", "chunks"),
+            "index": StageStats("index", "chunks"),
+        }
+
+    def fail(self, error: Exception) -> None:
+        with self.lock:
+            if self.error is None:
+                self.error = error
+        self.abort.set()
+
+    def put(self, q: queue.Queue, item, stats: StageStats) -> None:
+        """放入队列，下游积压时阻塞；阻塞时间不计入阶段工作时间"""
+        wait_start = time.time()
+        try:
+            while True:
+                if self.abort.is_set():
+                    raise _Aborted()
+                try:
+                    q.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+        finally:
+            stats.busy -= time.time() - wait_start
+
+    def get(self, q: queue.Queue, stats: StageStats, block: bool = True):
+        """从队列取数据，等待时间不计入阶段工作时间"""
+        wait_start = time.time()
+        try:
+            while True:
+                if self.abort.is_set():
+                    raise _Aborted()
+                try:
+                    return q.get(timeout=0.1) if block else q.get_nowait()
+                except queue.Empty:
+                    if not block:
+                        raise
+        finally:
+            stats.busy -= time.time() - wait_start
+
+    def drain(self, q: queue.Queue, stats: StageStats) -> Iterator[Dict]:
+        while True:
+            try:
+                item = self.get(q, stats)
+            except _Aborted:
+                return
+            if item is _DONE:
+                return
+            stats.items += 1
+            yield item
+
+    def print_stats(self) -> None:
+        for stats in self.stats.values():
+            report = stats.report()
+            print(f"阶段 {report['stage']}: {report['items']} {report['unit']}，"
+                  f"工作 {report['busy_seconds']}s / 总计 {report['wall_seconds']}s，"
+                  f"{report['throughput']} {report['unit']}/s")
+
+class IngestPipeline:
+    """流水线式入库：加载 → 分块 → 向量化 → bulk 写入
+
+    各阶段在独立线程中运行，通过有界队列连接，下游处理不过来时上游会阻塞（背压），
+    因此第 1 个文件的片段可以在第 50 个文件仍在解析时就写入索引。
+    每次运行的状态保存在单独的 _IngestRun 中，实例可以被多个线程同时使用。
+    """
+    def __init__(self, doc_processor, vector_store, queue_size: int = None, embed_batch_size: int = None):
+        self.doc_processor = doc_processor
+        self.vector_store = vector_store
+        self.queue_size = queue_size or int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+        # 每次交给 Embedder 的片段数，默认足够让 Embedder 并发发出多个批量请求
+        embedder = vector_store.embedder
+        self.embed_batch_size = embed_batch_size or embedder.batch_size * embedder.max_workers
+
+    def run(self, file_paths: List[str], index_name: str) -> Dict:
+        """执行流水线，返回写入结果、各文件的片段 ID、失败文件和各阶段吞吐量"""
+        run = _IngestRun()
+        loaded_queue = queue.Queue(maxsize=self.queue_size)
+        chunk_queue = queue.Queue(maxsize=self.queue_size * self.embed_batch_size)
+        action_queue = queue.Queue(maxsize=self.queue_size * self.embed_batch_size)
+
+        self.vector_store.ensure_index(index_name)
+        threads = [
+            threading.Thread(target=self._run_stage, args=(run, "load", self._load_stage, file_paths, loaded_queue), daemon=True),
+            threading.Thread(target=self._run_stage, args=(run, "split", self._split_stage, loaded_queue, chunk_queue), daemon=True),
+            threading.Thread(target=self._run_stage, args=(run, "embed", self._embed_stage, chunk_queue, action_queue, index_name), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        # 写入阶段在当前线程中运行，从队列中流式消费 bulk 操作
+        index_stats = run.stats["index"]
+        index_stats.started = time.time()
+        try:
+            result = self.vector_store.bulk_index(run.drain(action_queue, index_stats), index_name)
+        except Exception as e:
+            run.fail(e)
+            result = None
+        index_stats.finished = time.time()
+        index_stats.busy = max(0.0, index_stats.busy + index_stats.finished - index_stats.started)
+
+        for thread in threads:
+            thread.join()
+        if run.error is not None:
+            raise run.error
+
+        run.print_stats()
+        return {
+            **result,
+            "chunk_ids": run.chunk_ids,
+            "failed_files": run.failed_files,
+            "stats": [stats.report() for stats in run.stats.values()],
+        }
+
+    def _run_stage(self, run: _IngestRun, name: str, stage, source, output: queue.Queue, *args) -> None:
+        stats = run.stats[name]
+        stats.started = time.time()
+        try:
+            stage(run, source, output, stats, *args)
+            run.put(output, _DONE, stats)
+        except _Aborted:
+            pass
+        except Exception as e:
+            run.fail(e)
+        finally:
+            stats.finished = time.time()
+            stats.busy += stats.finished - stats.started
+
+    # --- 各阶段 ---
+    def _load_stage(self, run: _IngestRun, file_paths: List[str], output: queue.Queue, stats: StageStats) -> None:
+        for file_path, docs, error in self.doc_processor.load_files(file_paths):
+            if error is not None:
+                print(f"警告：加载文件 {file_path} 时出错: {str(error)}")
+                run.failed_files.append(file_path)
+                continue
+            stats.items += 1
+            run.put(output, docs, stats)
+
+    def _split_stage(self, run: _IngestRun, source: queue.Queue, output: queue.Queue, stats: StageStats) -> None:
+        while True:
+            docs = run.get(source, stats)
+            if docs is _DONE:
+                return
+            for chunk in self.doc_processor.split_documents(docs):
+                stats.items += 1
+                with run.lock:
+                    run.chunk_ids.setdefault(chunk['metadata']['source'], []).append(chunk['id'])
+                run.put(output, chunk, stats)
+
+    def _embed_stage(self, run: _IngestRun, source: queue.Queue, output: queue.Queue, stats: StageStats,
+                     index_name: str) -> None:
+        batch = []
+        done = False
+        while not done:
+            # 攒够一批再请求；上游暂时没有数据时先把已有的片段发出去，避免下游空等
+            try:
+                chunk = run.get(source, stats, block=not batch)
+            except queue.Empty:
+                chunk = None
+            if chunk is _DONE:
+                done = True
+            elif chunk is not None:
+                batch.append(chunk)
+                if len(batch) < self.embed_batch_size:
+                    continue
+
+            if batch:
+                vectors = self.vector_store.get_embeddings([doc['content'] for doc in batch])
+                for doc, vector in zip(batch, vectors):
+                    stats.items += 1
+                    run.put(output, self.vector_store.build_action(doc, vector, index_name), stats)
+                batch = []
@@ -0,0 +1,233 @@
+from typing import List, Dict
+import collections
+import json
+import math
+import threading
+import os
+import numpy as np
+from dotenv import load_dotenv
+from token_counter import tokenize
+
+load_dotenv()
+
+class KBRouter:
+    """知识库路由：为每个知识库维护一份摘要，查询时只检索最相关的 top_n 个知识库
+
+    摘要包括若干向量聚类中心（在线聚类，最多 max_clusters 个）和出现片段数最多的词，
+    写入片段时增量更新并保存到 JSON 文件，其他进程在文件变化后重新加载。
+    删除的片段从最相近的聚类中心和词频中扣除，索引被重建时摘要清空；
+    没有摘要的知识库（例如本功能之前建立的）总是会被检索。
+    """
+    _default = None
+    _default_pid = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, path: str = None, top_n: int = None, max_clusters: int = None,
+                 max_terms: int = None, term_weight: float = None):
+        self.path = path or os.getenv("KB_ROUTING_PATH", "./cache/kb_routing.json")
+        # 每次查询最多检索的知识库数，0 表示不路由（检索全部知识库）
+        self.top_n = top_n if top_n is not None else int(os.getenv("KB_ROUTING_TOP_N", "3"))
+        self.max_clusters = max_clusters or int(os.getenv("KB_ROUTING_CLUSTERS", "8"))
+        # 与所有聚类中心的相似度都低于该值时新建聚类（未达到上限时）
+        self.cluster_threshold = 0.75
+        self.max_terms = max_terms or int(os.getenv("KB_ROUTING_TERMS", "500"))
+        # 词匹配分数（归一化到 0-1）相对向量相似度的权重
+        self.term_weight = term_weight if term_weight is not None else float(os.getenv("KB_ROUTING_TERM_WEIGHT", "0.3"))
+        self._lock = threading.Lock()
+        self._summaries: Dict[str, Dict] = {}
+        self._mtime = None
+        self._dirty = set()
+        self._load()
+
+    @classmethod
+    def default(cls) -> "KBRouter":
+        """当前进程共享的默认实例"""
+        with cls._default_lock:
+            if cls._default is None or cls._default_pid != os.getpid():
+                cls._default = cls()
+                cls._default_pid = os.getpid()
+            return cls._default
+
+    # --- 持久化 ---
+    def _load(self) -> None:
+        """文件有变化时重新加载（调用方持有锁或在初始化中）；本进程未保存的更新保留"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"读取知识库路由摘要失败: {str(e)}")
+            return
+        self._mtime = mtime
+        for index_name, summary in data.items():
+            if index_name in self._dirty:
+                continue
+            self._summaries[index_name] = {
+                "chunks": summary["chunks"],
+                "sums": np.asarray(summary["sums"], dtype=np.float32).reshape(len(summary["counts"]), -1),
+                "counts": list(summary["counts"]),
+                "terms": collections.Counter(summary["terms"]),
+            }
+
+    def save(self) -> None:
+        """保存有更新的摘要，与文件中其他进程写入的摘要合并"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._load()
+            data = {}
+            for index_name, summary in self._summaries.items():
+                data[index_name] = {
+                    "chunks": summary["chunks"],
+                    "sums": summary["sums"].round(6).tolist(),
+                    "counts": summary["counts"],
+                    "terms": dict(summary["terms"].most_common(self.max_terms)),
+                }
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self._mtime = os.path.getmtime(self.path)
+            self._dirty.clear()
+
+    # --- 写入时更新 ---
+    @staticmethod
+    def _terms(text: str) -> set:
+        # 单个字符区分度太低，只保留英文单词和中文二元组
+        return {token for token in tokenize(text) if len(token) >= 2}
+
+    def add(self, index_name: str, vector: List[float], text: str) -> None:
+        """把一个片段计入知识库摘要"""
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        if vector.ndim != 1 or norm == 0:
+            return
+        vector = vector / norm
+        with self._lock:
+            summary = self._summaries.get(index_name)
+            if summary is None or summary["sums"].shape[1] != vector.shape[0]:
+                summary = {"chunks": 0, "sums": np.zeros((0, vector.shape[0]), dtype=np.float32),
+                           "counts": [], "terms": collections.Counter()}
+                self._summaries[index_name] = summary
+            summary["chunks"] += 1
+            if summary["counts"]:
+                centroids = summary["sums"] / np.linalg.norm(summary["sums"], axis=1, keepdims=True).clip(1e-12)
+                similarities = centroids @ vector
+                best = int(similarities.argmax())
+            if not summary["counts"] or (similarities[best] < self.cluster_threshold
+                                         and len(summary["counts"]) < self.max_clusters):
+                summary["sums"] = np.vstack([summary["sums"], vector])
+                summary["counts"].append(1)
+            else:
+                summary["sums"][best] += vector
+                summary["counts"][best] += 1
+            terms = summary["terms"]
+            terms.update(self._terms(text))
+            # 内存中保留的词数有上限，超出时只留下出现最多的
+            if len(terms) > self.max_terms * 10:
+                summary["terms"] = collections.Counter(dict(terms.most_common(self.max_terms * 5)))
+            self._dirty.add(index_name)
+
+    def remove(self, index_name: str, vector: List[float], text: str) -> None:
+        """从知识库摘要中扣除一个已删除的片段
+
+        片段写入时计入的聚类可能已经漂移，这里从当前最相近的聚类中扣除，是近似值。
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        if vector.ndim != 1 or norm == 0:
+            return
+        vector = vector / norm
+        with self._lock:
+            self._load()
+            summary = self._summaries.get(index_name)
+            if summary is None or not summary["counts"] or summary["sums"].shape[1] != vector.shape[0]:
+                return
+            summary["chunks"] -= 1
+            if summary["chunks"] <= 0:
+                del self._summaries[index_name]
+                self._dirty.add(index_name)
+                return
+            centroids = summary["sums"] / np.linalg.norm(summary["sums"], axis=1, keepdims=True).clip(1e-12)
+            best = int((centroids @ vector).argmax())
+            summary["counts"][best] -= 1
+            if summary["counts"][best] <= 0:
+                summary["sums"] = np.delete(summary["sums"], best, axis=0)
+                del summary["counts"][best]
+            else:
+                summary["sums"][best] -= vector
+            terms = summary["terms"]
+            terms.subtract(self._terms(text))
+            summary["terms"] = +terms
+            self._dirty.add(index_name)
+
+    def reset(self, index_name: str) -> None:
+        """知识库被删除或重建时清空其摘要"""
+        with self._lock:
+            # 摘要可能是其他进程写入的，先加载文件才能把它一并删除
+            self._load()
+            if self._summaries.pop(index_name, None) is not None:
+                self._dirty.add(index_name)
+
+    def add_source(self, index_name: str, source: Dict) -> None:
+        """作为后端 bulk_index 的 on_indexed 回调，只把确认写入成功的片段计入摘要"""
+        vector = source.get("vector")
+        if vector is not None and len(vector):
+            self.add(index_name, vector, source.get("content", ""))
+
+    def remove_source(self, index_name: str, source: Dict) -> None:
+        """作为后端 delete_chunks 的 on_deleted 回调，把确认删除的片段从摘要中扣除"""
+        vector = source.get("vector")
+        if vector is not None and len(vector):
+            self.remove(index_name, vector, source.get("content", ""))
+
+    # --- 查询时路由 ---
+    def needs_routing(self, indices: List[str]) -> bool:
+        return 0 < self.top_n < len(indices)
+
+    def route(self, indices: List[str], query: str, query_vector: List[float]) -> List[str]:
+        """返回需要检索的知识库（保持原有顺序）：摘要得分最高的 top_n 个，以及没有摘要的知识库"""
+        if not self.needs_routing(indices):
+            return indices
+        vector = np.asarray(query_vector, dtype=np.float32)
+        vector = vector / (float(np.linalg.norm(vector)) or 1.0)
+        query_terms = self._terms(query)
+        with self._lock:
+            self._load()
+            known = [index for index in indices
+                     if index in self._summaries and self._summaries[index]["chunks"]
+                     and self._summaries[index]["sums"].shape[1] == vector.shape[0]]
+            if len(known) <= self.top_n:
+                return indices
+
+            # 向量得分：与最相近的聚类中心的余弦相似度
+            vector_scores = {}
+            for index in known:
+                sums = self._summaries[index]["sums"]
+                centroids = sums / np.linalg.norm(sums, axis=1, keepdims=True).clip(1e-12)
+                vector_scores[index] = float((centroids @ vector).max())
+
+            # 词得分：查询词在知识库片段中的出现比例，按在多少个知识库中出现加权（类似 IDF）
+            term_scores = dict.fromkeys(known, 0.0)
+            for term in query_terms:
+                containing = [index for index in known if term in self._summaries[index]["terms"]]
+                if not containing:
+                    continue
+                idf = math.log(1 + len(known) / len(containing))
+                for index in containing:
+                    summary = self._summaries[index]
+                    term_scores[index] += summary["terms"][term] / summary["chunks"] * idf
+        max_term_score = max(term_scores.values()) or 1.0
+        scores = {index: vector_scores[index] + self.term_weight * term_scores[index] / max_term_score
+                  for index in known}
+        selected = set(sorted(known, key=lambda index: scores[index], reverse=True)[:self.top_n])
+        known_set = set(known)
+        return [index for index in indices if index in selected or index not in known_set]
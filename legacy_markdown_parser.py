@@ -0,0 +1,56 @@
+"""改为单遍解析之前的 Markdown 分块逻辑，作为 benchmark.py parse 阶段的对照和 test_markdown_parser.py 的参照结果"""
+from typing import List, Dict
+from pathlib import Path
+import os
+import re
+from document_processor import normalize_path
+
+def legacy_process_markdown(content: str, file_path: str) -> List[Dict]:
+    """改为单遍解析之前 DocumentLoader.process_markdown 的分块逻辑
+
+    整个文件读入后 split('\\n')，每行现场匹配正则，只识别行首的图片；不请求 VLM。
+    """
+    chunks = []
+    current_headers = []
+    current_content = []
+    base_dir = Path(file_path).parent
+    for line in content.split('\n'):
+        header_match = re.match(r'^(#{1,6})\s+(.+)$', line)
+        if header_match:
+            if current_content:
+                chunks.append({'content': '\n'.join(current_content), 'headers': current_headers.copy(),
+                               'img_url': None})
+                current_content = []
+            level = len(header_match.group(1))
+            current_headers = current_headers[:level - 1] + [header_match.group(2)]
+            current_content.append(line)
+        elif line.startswith('!['):
+            img_match = re.search(r'!\[.*?\]\((.*?)\)', line)
+            if img_match:
+                img_path_rel = img_match.group(1)
+                try:
+                    if Path(img_path_rel).is_absolute():
+                        img_path_abs = normalize_path(img_path_rel)
+                    else:
+                        img_path_abs = normalize_path(base_dir / img_path_rel)
+                except Exception as path_e:
+                    print(f"警告：处理图片路径时出错 '{img_path_rel}': {path_e}")
+                    current_content.append(line)
+                    continue
+                if not os.path.exists(img_path_abs):
+                    print(f"警告：图片文件不存在: {img_path_abs}")
+                    current_content.append(line)
+                    continue
+                if current_content:
+                    chunks.append({'content': '\n'.join(current_content), 'headers': current_headers.copy(),
+                                   'img_url': None})
+                    current_content = []
+                chunks.append({'content': "[图片占位符]", 'headers': current_headers.copy(),
+                               'img_url': img_path_abs})
+            else:
+                current_content.append(line)
+        else:
+            current_content.append(line)
+    if current_content:
+        chunks.append({'content': '\n'.join(current_content), 'headers': current_headers.copy(), 'img_url': None})
+    return chunks
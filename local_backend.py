@@ -0,0 +1,549 @@
+from typing import List, Dict, Iterable, Callable, Optional, Tuple
+from collections import Counter
+import hashlib
+import heapq
+import json
+import math
+import re
+import shutil
+import threading
+import uuid
+import os
+import numpy as np
+from dotenv import load_dotenv
+from storage_backend import StorageBackend
+from metrics import track
+from token_counter import tokenize
+
+load_dotenv()
+
+def _id_hash(doc_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(doc_id.encode('utf-8'), digest_size=8).digest(), 'little')
+
+class _Segment:
+    """一个只读的数据段，写入后不再修改
+
+    向量和 BM25 倒排表通过内存映射打开，只有被访问的页才会读入内存；
+    文档内容按偏移量从 docs.jsonl 中按需读取。
+    """
+    def __init__(self, path: str, name: str):
+        self.path = path
+        self.name = name
+        with open(os.path.join(path, "meta.json"), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.count = meta["count"]
+        self.total_length = meta["total_length"]
+        self.file_counts: Dict[str, int] = meta["file_counts"]
+        self.dims = None
+        if self.count:
+            self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode='r')
+            self.dims = self.vectors.shape[1]
+            self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode='r')
+            self.doc_lengths = np.load(os.path.join(path, "doc_lengths.npy"), mmap_mode='r')
+            self.term_offsets = np.load(os.path.join(path, "term_offsets.npy"), mmap_mode='r')
+            self.posting_docs = np.load(os.path.join(path, "posting_docs.npy"), mmap_mode='r')
+            self.posting_tfs = np.load(os.path.join(path, "posting_tfs.npy"), mmap_mode='r')
+            self.id_hashes = np.load(os.path.join(path, "id_hashes.npy"), mmap_mode='r')
+            self.id_rows = np.load(os.path.join(path, "id_rows.npy"), mmap_mode='r')
+            with open(os.path.join(path, "terms.json"), 'r', encoding='utf-8') as f:
+                self.terms: Dict[str, int] = json.load(f)
+
+    def df(self, term: str) -> int:
+        term_id = self.terms.get(term) if self.count else None
+        if term_id is None:
+            return 0
+        return int(self.term_offsets[term_id + 1] - self.term_offsets[term_id])
+
+    def cosine(self, query: np.ndarray, block_size: int) -> np.ndarray:
+        """分块计算所有向量与查询向量的余弦相似度（向量写入时已归一化）"""
+        scores = np.empty(self.count, dtype=np.float32)
+        for start in range(0, self.count, block_size):
+            block = np.asarray(self.vectors[start:start + block_size], dtype=np.float32)
+            scores[start:start + block_size] = block @ query
+        return scores
+
+    def bm25(self, idfs: Dict[str, float], avgdl: float, k1: float, b: float) -> np.ndarray:
+        """idf 和 avgdl 由调用方按整个知识库统计，各段的分数可以直接比较"""
+        scores = np.zeros(self.count, dtype=np.float32)
+        for term, idf in idfs.items():
+            term_id = self.terms.get(term)
+            if term_id is None:
+                continue
+            start, end = int(self.term_offsets[term_id]), int(self.term_offsets[term_id + 1])
+            docs = self.posting_docs[start:end]
+            tfs = self.posting_tfs[start:end]
+            norm = k1 * (1 - b + b * self.doc_lengths[docs] / avgdl)
+            scores[docs] += idf * tfs * (k1 + 1) / (tfs + norm)
+        return scores
+
+    def read_docs(self, rows: Iterable[int]) -> List[Dict]:
+        docs = []
+        with open(os.path.join(self.path, "docs.jsonl"), 'rb') as f:
+            for row in rows:
+                start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+                f.seek(start)
+                docs.append(json.loads(f.read(end - start)))
+        return docs
+
+    def find(self, wanted: set, hashes: np.ndarray) -> List[Tuple[int, Dict]]:
+        """按 ID 查找行，hashes 为这些 ID 的哈希；返回 [(行号, 文档)]"""
+        if not self.count:
+            return []
+        positions = np.searchsorted(self.id_hashes, hashes)
+        inside = positions < self.count
+        positions, hashes = positions[inside], hashes[inside]
+        positions = positions[self.id_hashes[positions] == hashes]
+        rows = sorted({int(row) for row in self.id_rows[positions]})
+        # 哈希只用于定位，按文档中的 ID 确认
+        return [(row, doc) for row, doc in zip(rows, self.read_docs(rows)) if doc['id'] in wanted]
+
+    def iter_rows(self) -> Iterable[Tuple[int, Dict, np.ndarray]]:
+        """按顺序遍历全部文档和向量（合并段时使用）"""
+        if not self.count:
+            return
+        with open(os.path.join(self.path, "docs.jsonl"), 'r', encoding='utf-8') as f:
+            for row, line in enumerate(f):
+                yield row, json.loads(line), np.asarray(self.vectors[row], dtype=np.float32)
+
+def _save_id_index(path: str, hashes: List[int]) -> None:
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    order = np.argsort(hashes, kind='stable')
+    np.save(os.path.join(path, "id_hashes.npy"), hashes[order])
+    np.save(os.path.join(path, "id_rows.npy"), order.astype(np.int64))
+
+class _IndexSnapshot:
+    """某个知识库某一代数据的只读视图：若干数据段，以及各段中已删除的行"""
+    def __init__(self, generation: str, manifest: Dict, segments: List[_Segment]):
+        self.generation = generation
+        self.manifest = manifest
+        self.segments = segments
+        self.deleted: Dict[str, np.ndarray] = {
+            name: np.asarray(rows, dtype=np.int64) for name, rows in manifest["deleted"].items() if rows
+        }
+        # 与 Elasticsearch 相同，已删除但尚未合并掉的文档仍计入 df 和平均长度
+        self.total = sum(segment.count for segment in segments)
+        self.live = self.total - sum(len(rows) for rows in self.deleted.values())
+        total_length = sum(segment.total_length for segment in segments)
+        self.avgdl = (total_length / self.total) if self.total and total_length else 1.0
+        self.dims = next((segment.dims for segment in segments if segment.dims), None)
+
+    def live_count(self, segment: _Segment) -> int:
+        return segment.count - len(self.deleted.get(segment.name, ()))
+
+    def files(self) -> List[str]:
+        return sorted(name for name, count in self.manifest["files"].items() if count > 0)
+
+class LocalBackend(StorageBackend):
+    """本地向量存储后端，不依赖 Elasticsearch
+
+    每个知识库一个目录，数据由若干只读的段组成，每段一个子目录：
+      vectors.npy                    归一化后的向量矩阵（float32 或 float16），内存映射读取
+      docs.jsonl / offsets.npy       文档内容和元数据，按偏移量按需读取
+      terms.json / term_offsets.npy / posting_docs.npy / posting_tfs.npy / doc_lengths.npy
+                                     BM25 倒排索引（CSR 格式）
+      id_hashes.npy / id_rows.npy    按 ID 查找行
+    写入时每积累 segment_size 条生成一个新段，不重写已有的段；删除和覆盖只在清单（gen-*.json）
+    中记录被删除的行。清单写完后再切换 CURRENT 指针，检索时总是读到完整的一代数据。
+    小段数量达到 merge_segments 个、或某段中已删除的行过多时合并，合并只涉及这些段。
+    检索对全部向量做分块矩阵乘法求余弦相似度，与 BM25 结果取并集后按权重相加，
+    打分方式与 Elasticsearch 的 knn + match 混合检索一致。
+    """
+    name = "local"
+
+    def __init__(self, root: str = None, dtype: str = None):
+        self.root = root or os.getenv("LOCAL_INDEX_DIR", "./local_index")
+        self.dtype = np.dtype(dtype or os.getenv("LOCAL_VECTOR_DTYPE", "float32"))
+        if self.dtype not in (np.float32, np.float16):
+            raise Exception(f"LOCAL_VECTOR_DTYPE 只支持 float32 或 float16，当前为 {self.dtype}")
+        self.block_size = int(os.getenv("LOCAL_SEARCH_BLOCK", "65536"))
+        # 每段最多的文档数，写入时的内存占用与之成正比
+        self.segment_size = int(os.getenv("LOCAL_SEGMENT_DOCS", "10000"))
+        self.merge_segments = int(os.getenv("LOCAL_MERGE_SEGMENTS", "10"))
+        # 段中已删除的行超过该比例时重写该段
+        self.max_deleted_ratio = 0.3
+        # 与 Elasticsearch 后端相同的混合检索权重
+        self.knn_boost = float(os.getenv("KNN_BOOST", "1.0"))
+        self.bm25_boost = float(os.getenv("BM25_BOOST", "0.1"))
+        self.bm25_k1 = 1.2
+        self.bm25_b = 0.75
+        # 合并段时持有锁并写入新段，需要可重入
+        self._lock = threading.RLock()
+        self._snapshots: Dict[str, _IndexSnapshot] = {}
+        # 正在写入、尚未提交的段，清理旧数据时跳过
+        self._pending = set()
+        os.makedirs(self.root, exist_ok=True)
+
+    # --- 数据目录 ---
+    def _index_dir(self, index_name: str) -> str:
+        return os.path.join(self.root, index_name)
+
+    def _current_generation(self, index_name: str) -> Optional[str]:
+        try:
+            with open(os.path.join(self._index_dir(index_name), "CURRENT"), 'r', encoding='utf-8') as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _read_manifest(self, index_name: str, generation: str) -> Dict:
+        with open(os.path.join(self._index_dir(index_name), generation), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _snapshot(self, index_name: str) -> Optional[_IndexSnapshot]:
+        """返回最新一代数据的视图；其他进程写入后会自动切换到新的一代（调用方需持有锁）"""
+        generation = self._current_generation(index_name)
+        if generation is None:
+            return None
+        snapshot = self._snapshots.get(index_name)
+        if snapshot is None or snapshot.generation != generation:
+            manifest = self._read_manifest(index_name, generation)
+            # 段写入后不再修改，已打开的段可以直接复用
+            opened = {segment.name: segment for segment in snapshot.segments} if snapshot else {}
+            segments = [opened.get(name) or _Segment(os.path.join(self._index_dir(index_name), name), name)
+                        for name in manifest["segments"]]
+            snapshot = _IndexSnapshot(generation, manifest, segments)
+            self._snapshots[index_name] = snapshot
+        return snapshot
+
+    def _empty_manifest(self) -> Dict:
+        return {"segments": [], "deleted": {}, "files": {}}
+
+    def _write_segment(self, index_name: str, items: Iterable[Tuple[Dict, np.ndarray]]) -> str:
+        """把一批文档写成新的段，返回段名；提交前对检索不可见"""
+        name = f"seg-{uuid.uuid4().hex[:16]}"
+        with self._lock:
+            self._pending.add(name)
+        path = os.path.join(self._index_dir(index_name), name)
+        os.makedirs(path, exist_ok=True)
+
+        offsets = [0]
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_lengths = []
+        vectors = []
+        hashes = []
+        file_counts = Counter()
+        with open(os.path.join(path, "docs.jsonl"), 'wb') as f:
+            for row, (doc, vector) in enumerate(items):
+                line = (json.dumps(doc, ensure_ascii=False) + "\n").encode('utf-8')
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+                counts = Counter(tokenize(doc['content']))
+                doc_lengths.append(sum(counts.values()))
+                for term, tf in counts.items():
+                    postings.setdefault(term, []).append((row, tf))
+                vectors.append(vector)
+                hashes.append(_id_hash(doc['id']))
+                file_counts[doc['metadata'].get('file_name', '未知文件')] += 1
+
+        np.save(os.path.join(path, "vectors.npy"), np.vstack(vectors).astype(self.dtype))
+        np.save(os.path.join(path, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+        np.save(os.path.join(path, "doc_lengths.npy"), np.asarray(doc_lengths, dtype=np.float32))
+        terms = sorted(postings)
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        term_offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+        flat = [item for term in terms for item in postings[term]]
+        np.save(os.path.join(path, "term_offsets.npy"), term_offsets)
+        np.save(os.path.join(path, "posting_docs.npy"), np.asarray([row for row, _ in flat], dtype=np.int32))
+        np.save(os.path.join(path, "posting_tfs.npy"), np.asarray([tf for _, tf in flat], dtype=np.float32))
+        with open(os.path.join(path, "terms.json"), 'w', encoding='utf-8') as f:
+            json.dump({term: i for i, term in enumerate(terms)}, f, ensure_ascii=False)
+        _save_id_index(path, hashes)
+
+        meta = {
+            "count": len(vectors),
+            "dtype": self.dtype.name,
+            "total_length": float(sum(doc_lengths)),
+            "file_counts": dict(file_counts),
+        }
+        with open(os.path.join(path, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        return name
+
+    def _commit(self, index_name: str, manifest: Dict, new_segments: Iterable[str] = ()) -> None:
+        """写入新的清单并切换 CURRENT，随后删除不再引用的数据（调用方需持有锁）"""
+        index_dir = self._index_dir(index_name)
+        os.makedirs(index_dir, exist_ok=True)
+        old_generation = self._current_generation(index_name)
+        number = int(re.sub(r'\D', '', old_generation)) + 1 if old_generation else 1
+        generation = f"gen-{number:08d}.json"
+        manifest = dict(manifest, deleted={name: rows for name, rows in manifest["deleted"].items() if rows},
+                        files={name: count for name, count in manifest["files"].items() if count > 0})
+        with open(os.path.join(index_dir, generation), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+
+        # 原子切换到新的一代
+        tmp_current = os.path.join(index_dir, "CURRENT.tmp")
+        with open(tmp_current, 'w', encoding='utf-8') as f:
+            f.write(generation)
+        os.replace(tmp_current, os.path.join(index_dir, "CURRENT"))
+        self._pending.difference_update(new_segments)
+
+        # 保留上一代引用的数据，供切换前已开始的检索继续读取；其余直接删除
+        keep = {generation, *manifest["segments"]}
+        if old_generation:
+            keep.add(old_generation)
+            try:
+                keep.update(self._read_manifest(index_name, old_generation)["segments"])
+            except (OSError, ValueError):
+                pass
+        for name in os.listdir(index_dir):
+            if name in keep or name in self._pending or not name.startswith(("g", "seg-")):
+                continue
+            path = os.path.join(index_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+    def _delete_rows(self, snapshot: Optional[_IndexSnapshot], manifest: Dict, doc_ids: Iterable[str],
+                     on_deleted: Optional[Callable[[Dict, np.ndarray], None]] = None) -> int:
+        """在清单中把这些 ID 的现有行标记为删除，返回删除的行数；on_deleted 以 (文档, 向量) 调用"""
+        if snapshot is None:
+            return 0
+        wanted = set(doc_ids)
+        hashes = np.fromiter((_id_hash(doc_id) for doc_id in wanted), dtype=np.uint64, count=len(wanted))
+        deleted = 0
+        for segment in snapshot.segments:
+            found = segment.find(wanted, hashes)
+            if not found:
+                continue
+            dead = set(manifest["deleted"].get(segment.name, ()))
+            rows = [(row, doc) for row, doc in found if row not in dead]
+            if not rows:
+                continue
+            manifest["deleted"][segment.name] = sorted(dead.union(row for row, _ in rows))
+            for row, doc in rows:
+                file_name = doc['metadata'].get('file_name', '未知文件')
+                manifest["files"][file_name] = manifest["files"].get(file_name, 0) - 1
+                if on_deleted:
+                    on_deleted(doc, segment.vectors[row])
+            deleted += len(rows)
+        return deleted
+
+    def _copy_manifest(self, snapshot: Optional[_IndexSnapshot]) -> Dict:
+        if snapshot is None:
+            return self._empty_manifest()
+        manifest = snapshot.manifest
+        return {
+            "segments": list(manifest["segments"]),
+            "deleted": {name: list(rows) for name, rows in manifest["deleted"].items()},
+            "files": dict(manifest["files"]),
+        }
+
+    def _append(self, index_name: str, items: Dict[str, Tuple[Dict, np.ndarray]],
+                collect_replaced: bool = False) -> List[Tuple[Dict, np.ndarray]]:
+        """把一批文档写成新段并提交；其中的 ID 在旧段中的行标记为删除（即覆盖）
+
+        collect_replaced 为 True 时返回被覆盖的旧文档和向量。
+        """
+        name = self._write_segment(index_name, items.values())
+        replaced = []
+        collect = (lambda doc, vector: replaced.append((doc, np.array(vector)))) if collect_replaced else None
+        with self._lock:
+            snapshot = self._snapshot(index_name)
+            manifest = self._copy_manifest(snapshot)
+            self._delete_rows(snapshot, manifest, items.keys(), collect)
+            manifest["segments"].append(name)
+            for doc, _ in items.values():
+                file_name = doc['metadata'].get('file_name', '未知文件')
+                manifest["files"][file_name] = manifest["files"].get(file_name, 0) + 1
+            self._commit(index_name, manifest, [name])
+            self._compact(index_name)
+        return replaced
+
+    def _compact(self, index_name: str) -> None:
+        """合并小段和删除过多的段（调用方需持有锁），其余段保持不变"""
+        snapshot = self._snapshot(index_name)
+        if snapshot is None:
+            return
+        small = [segment for segment in snapshot.segments if snapshot.live_count(segment) < self.segment_size]
+        victims = [segment for segment in snapshot.segments
+                   if len(snapshot.deleted.get(segment.name, ())) > segment.count * self.max_deleted_ratio]
+        if len(small) >= self.merge_segments:
+            victims.extend(segment for segment in small if segment not in victims)
+        if not victims:
+            return
+
+        new_segments = []
+        buffer = []
+        for segment in victims:
+            dead = set(snapshot.deleted.get(segment.name, np.empty(0, dtype=np.int64)).tolist())
+            for row, doc, vector in segment.iter_rows():
+                if row in dead:
+                    continue
+                buffer.append((doc, vector))
+                if len(buffer) >= self.segment_size:
+                    new_segments.append(self._write_segment(index_name, buffer))
+                    buffer = []
+        if buffer:
+            new_segments.append(self._write_segment(index_name, buffer))
+
+        manifest = self._copy_manifest(snapshot)
+        removed = {segment.name for segment in victims}
+        manifest["segments"] = [name for name in manifest["segments"] if name not in removed] + new_segments
+        for name in removed:
+            manifest["deleted"].pop(name, None)
+        self._commit(index_name, manifest, new_segments)
+
+    # --- 写入 ---
+    def list_indices(self) -> List[str]:
+        return sorted(
+            name for name in os.listdir(self.root)
+            if name.startswith('rag_') and self._current_generation(name) is not None
+        )
+
+    def index_exists(self, index_name: str) -> bool:
+        return self._current_generation(index_name) is not None
+
+    def create_index(self, index_name: str) -> None:
+        with self._lock:
+            # 如果索引已存在，先删除
+            shutil.rmtree(self._index_dir(index_name), ignore_errors=True)
+            self._snapshots.pop(index_name, None)
+            self._commit(index_name, self._empty_manifest())
+        self._index_dropped(index_name)
+
+    def bulk_index(self, actions: Iterable[Dict], index_name: str,
+                   on_indexed: Optional[Callable[[str, Dict], None]] = None,
+                   on_deleted: Optional[Callable[[str, Dict], None]] = None) -> Dict:
+        """流式写入：每积累 segment_size 条写成一个新段并提交，已有的段不重写"""
+        with self._lock:
+            snapshot = self._snapshot(index_name)
+            existing_dims = snapshot.dims if snapshot is not None else None
+        buffer: Dict[str, Tuple[Dict, np.ndarray]] = {}
+        indexed = 0
+        errors = []
+        dims = None
+
+        def flush(buffer):
+            replaced = self._append(index_name, buffer, collect_replaced=on_deleted is not None)
+            # 提交后再回调，回调中不持有锁
+            for doc, vector in replaced:
+                on_deleted(index_name, {"content": doc["content"], "vector": vector})
+            if on_indexed:
+                for doc, vector in buffer.values():
+                    on_indexed(index_name, {"content": doc["content"], "vector": vector})
+            return len(buffer)
+
+        for action in actions:
+            doc_id = action["_id"]
+            source = action["_source"]
+            vector = np.asarray(source["vector"], dtype=np.float32)
+            norm = float(np.linalg.norm(vector))
+            if dims is None:
+                dims = len(vector)
+                if existing_dims is not None and dims != existing_dims:
+                    raise Exception(f"向量维度 {dims} 与索引 {index_name} 中已有的维度 {existing_dims} 不一致")
+            if vector.ndim != 1 or len(vector) != dims or not np.isfinite(norm) or norm == 0:
+                errors.append({"index": {"_index": index_name, "_id": doc_id, "error": "无效的向量"}})
+                continue
+            doc = {"id": doc_id, "content": source["content"], "metadata": source["metadata"]}
+            # 同一批中重复的 ID 只保留最后一次
+            buffer.pop(doc_id, None)
+            buffer[doc_id] = (doc, vector / norm)
+            if len(buffer) >= self.segment_size:
+                indexed += flush(buffer)
+                buffer = {}
+        if buffer:
+            indexed += flush(buffer)
+
+        if errors:
+            print(f"批量写入时有 {len(errors)} 个文档失败，示例：", errors[:3])
+        return {"indexed": indexed, "failed": len(errors), "errors": errors}
+
+    def delete_chunks(self, index_name: str, chunk_ids: List[str],
+                      on_deleted: Optional[Callable[[str, Dict], None]] = None) -> None:
+        """只在清单中记录被删除的行，不重写数据"""
+        if not chunk_ids or not self.index_exists(index_name):
+            return
+        removed = []
+        with self._lock:
+            snapshot = self._snapshot(index_name)
+            manifest = self._copy_manifest(snapshot)
+            collect = (lambda doc, vector: removed.append((doc, np.array(vector)))) if on_deleted else None
+            if self._delete_rows(snapshot, manifest, chunk_ids, collect):
+                self._commit(index_name, manifest)
+                self._compact(index_name)
+        # 删除提交后再回调，回调中不持有锁
+        for doc, vector in removed:
+            on_deleted(index_name, {"content": doc["content"], "vector": vector})
+
+    def get_files(self, index_name: str) -> List[str]:
+        with self._lock:
+            snapshot = self._snapshot(index_name)
+        return snapshot.files() if snapshot else []
+
+    # --- 检索 ---
+    def _search_index(self, snapshot: _IndexSnapshot, index_name: str, query_terms: List[str],
+                      query: np.ndarray, top_k: int) -> List[Dict]:
+        if not snapshot.live:
+            return []
+        # BM25 的 idf 按整个知识库统计
+        idfs = {}
+        for term in set(query_terms):
+            df = sum(segment.df(term) for segment in snapshot.segments)
+            if df:
+                idfs[term] = math.log(1 + (snapshot.total - df + 0.5) / (df + 0.5))
+
+        # 各段先取向量 top-k，再在全部段中选出整个知识库的向量 top-k
+        per_segment = []
+        knn_candidates = []
+        for position, segment in enumerate(snapshot.segments):
+            if not snapshot.live_count(segment):
+                continue
+            cosine = segment.cosine(query, self.block_size)
+            bm25 = segment.bm25(idfs, snapshot.avgdl, self.bm25_k1, self.bm25_b)
+            dead = snapshot.deleted.get(segment.name)
+            if dead is not None:
+                cosine[dead] = -np.inf
+                bm25[dead] = 0
+            k = min(top_k, segment.count)
+            knn_rows = np.argpartition(-cosine, k - 1)[:k]
+            knn_rows = knn_rows[np.isfinite(cosine[knn_rows])]
+            knn_candidates.extend((float(cosine[row]), position, int(row)) for row in knn_rows)
+            per_segment.append((position, segment, cosine, bm25))
+        knn_selected: Dict[int, List[int]] = {}
+        for _, position, row in heapq.nlargest(top_k, knn_candidates):
+            knn_selected.setdefault(position, []).append(row)
+
+        # 向量 top-k 与 BM25 命中取并集；向量分数与 ES cosine 相似度一致，映射到 [0, 1]
+        top = []
+        for position, segment, cosine, bm25 in per_segment:
+            knn_rows = np.asarray(knn_selected.get(position, []), dtype=np.int64)
+            scores = bm25 * self.bm25_boost
+            scores[knn_rows] += self.knn_boost * (1 + cosine[knn_rows]) / 2
+            candidates = np.union1d(knn_rows, np.flatnonzero(bm25))
+            rows = candidates[np.argsort(-scores[candidates], kind='stable')[:top_k]]
+            top.extend((float(scores[row]), -position, -int(row), segment) for row in rows)
+        top = heapq.nlargest(top_k, top, key=lambda item: item[:3])
+
+        results = []
+        for score, _, neg_row, segment in top:
+            doc = segment.read_docs([-neg_row])[0]
+            results.append({
+                'id': doc['id'],
+                'content': doc['content'],
+                'score': score,
+                'metadata': doc['metadata'],
+                'index': index_name
+            })
+        return results
+
+    def search(self, indices: List[str], query: str, query_vector: List[float], top_k: int) -> List[Dict]:
+        query_array = np.asarray(query_vector, dtype=np.float32)
+        norm = float(np.linalg.norm(query_array))
+        if norm > 0:
+            query_array = query_array / norm
+        query_terms = tokenize(query)
+
+        all_results = []
+        for index in indices:
+            with self._lock:
+                snapshot = self._snapshot(index)
+            if snapshot is None:
+                print(f"检索索引 {index} 时出错: 索引不存在")
+                continue
+            with track("search_index", backend=self.name, index=index) as span:
+                results = self._search_index(snapshot, index, query_terms, query_array, top_k)
+                span.set(items=len(results))
+            all_results.extend(results)
+        return all_results
@@ -0,0 +1,106 @@
+from typing import List, Dict, Iterator, Iterable, Union, Callable, Optional, Tuple
+import re
+
+# 标题行：1-6 个 # 后跟空白和标题文字
+_HEADER_PATTERN = re.compile(r'(#{1,6})\s+(.+)$')
+# 代码块围栏：最多 3 个空格缩进，3 个以上的 ` 或 ~
+_FENCE_PATTERN = re.compile(r' {0,3}(`{3,}|~{3,})(.*)$')
+# 行内任意位置的图片引用，![说明](路径 "可选标题")；路径可以用 <> 括起，不加 <> 时也可以包含空格
+_IMAGE_PATTERN = re.compile(r'!\[[^\]\n]*\]\(\s*(?:<([^>\n]*)>|([^)\n]*?))'
+                            r'(?:\s+(?:"[^"\n]*"|\'[^\'\n]*\'))?\s*\)')
+
+IMAGE_PLACEHOLDER = "[图片占位符]"
+
+Headers = Tuple[str, ...]
+
+def iter_lines(source: Union[str, Iterable[str]]) -> Iterator[str]:
+    """逐行返回文本（不含换行符），结果与 str.split('\\n') 一致
+
+    source 可以是字符串，也可以是按行迭代的文本文件对象，后者不需要把整个文件读入内存。
+    """
+    if isinstance(source, str):
+        start = 0
+        while True:
+            end = source.find('\n', start)
+            if end < 0:
+                yield source[start:]
+                return
+            yield source[start:end]
+            start = end + 1
+    ended_with_newline = True
+    for line in source:
+        ended_with_newline = line.endswith('\n')
+        yield line[:-1] if ended_with_newline else line
+    if ended_with_newline:
+        yield ''
+
+def _is_closing_fence(line: str, fence: str) -> bool:
+    match = _FENCE_PATTERN.match(line)
+    return bool(match) and match.group(1)[0] == fence[0] and len(match.group(1)) >= len(fence) \
+        and not match.group(2).strip()
+
+def parse_markdown(source: Union[str, Iterable[str]],
+                   resolve_image: Callable[[str], Optional[str]] = None) -> Iterator[Dict]:
+    """单遍解析 Markdown，按标题和图片切分，逐个返回 {'content', 'headers', 'img_url'}
+
+    - 代码块（``` 或 ~~~ 围栏）内的 # 行和图片引用都按普通文本处理
+    - 行内任意位置的图片都会被识别，图片前后的文字分别归入前后的文本块
+    - resolve_image 把图片引用解析为本地绝对路径，返回 None 时图片按普通文本保留；
+      不提供时不提取图片
+    - headers 为不可变的元组，同一标题下的所有块共享同一个对象
+    """
+    headers: Headers = ()
+    current: List[str] = []
+    fence: Optional[str] = None
+
+    for line in iter_lines(source):
+        if fence is not None:
+            # 代码块内只检查结束围栏
+            current.append(line)
+            if line.startswith(('`', '~', ' ')) and _is_closing_fence(line, fence):
+                fence = None
+            continue
+
+        if line.startswith(('`', '~', ' ')):
+            fence_match = _FENCE_PATTERN.match(line)
+            # 反引号围栏的信息字符串中不能再出现反引号
+            if fence_match and not (fence_match.group(1)[0] == '`' and '`' in fence_match.group(2)):
+                fence = fence_match.group(1)
+                current.append(line)
+                continue
+
+        if line.startswith('#'):
+            header_match = _HEADER_PATTERN.match(line)
+            if header_match:
+                if current:
+                    yield {'content': '\n'.join(current), 'headers': headers, 'img_url': None}
+                    current = []
+                level = len(header_match.group(1))
+                headers = headers[:level - 1] + (header_match.group(2),)
+                current.append(line)
+                continue
+
+        if resolve_image is not None and '![' in line:
+            position = 0
+            for image_match in _IMAGE_PATTERN.finditer(line):
+                img_path = resolve_image(image_match.group(1) or image_match.group(2))
+                if img_path is None:
+                    continue
+                before = line[position:image_match.start()].rstrip()
+                if before:
+                    current.append(before)
+                if current:
+                    yield {'content': '\n'.join(current), 'headers': headers, 'img_url': None}
+                    current = []
+                yield {'content': IMAGE_PLACEHOLDER, 'headers': headers, 'img_url': img_path}
+                position = image_match.end()
+            if position:
+                after = line[position:].lstrip()
+                if after:
+                    current.append(after)
+                continue
+
+        current.append(line)
+
+    if current:
+        yield {'content': '\n'.join(current), 'headers': headers, 'img_url': None}
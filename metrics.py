@@ -0,0 +1,286 @@
+from typing import List, Dict, Optional, Tuple, Iterator
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import asyncio
+import contextvars
+import bisect
+import json
+import threading
+import time
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 耗时（秒）和请求体大小（字节）的直方图分桶
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+def _label_key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(key: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = key + extra
+    if not items:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in items)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + "}"
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        # 标签 -> [各分桶计数..., +Inf 计数, 总和]
+        self._series: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value: float, labels: Dict[str, str]) -> None:
+        series = self._series.setdefault(_label_key(labels), [0] * (len(self.buckets) + 1) + [0.0])
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', repr(float(bound))),))} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_format_labels(key, (('le', '+Inf'),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._series: Dict[Tuple, float] = {}
+
+    def inc(self, value: float, labels: Dict[str, str]) -> None:
+        key = _label_key(labels)
+        self._series[key] = self._series.get(key, 0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._series.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+class Span:
+    """一次阶段调用的记录，调用方可以补充请求大小、处理条数和 token 数"""
+    def __init__(self, stage: str, labels: Dict[str, str]):
+        self.stage = stage
+        self.labels = labels
+        self.duration = 0.0
+        self.status = "ok"
+        self.payload_bytes: Optional[int] = None
+        self.items: Optional[int] = None
+        self.tokens: Dict[str, int] = {}
+
+    def set(self, payload_bytes: int = None, items: int = None, **tokens: int) -> None:
+        """记录请求大小（字节）、处理条数，以及按类别的 token 数，例如 prompt=...、completion=..."""
+        if payload_bytes is not None:
+            self.payload_bytes = payload_bytes
+        if items is not None:
+            self.items = items
+        self.tokens.update({kind: count for kind, count in tokens.items() if count is not None})
+
+    def to_dict(self) -> Dict:
+        record = {"stage": self.stage, "ms": round(self.duration * 1000, 2), "status": self.status}
+        record.update(self.labels)
+        if self.payload_bytes is not None:
+            record["payload_bytes"] = self.payload_bytes
+        if self.items is not None:
+            record["items"] = self.items
+        if self.tokens:
+            record["tokens"] = dict(self.tokens)
+        return record
+
+_current_trace: "contextvars.ContextVar[Optional[QueryTrace]]" = contextvars.ContextVar("query_trace", default=None)
+
+class QueryTrace:
+    """一次查询的全部阶段记录，结束时写一行 JSON 日志"""
+    def __init__(self, query: str, **fields):
+        self.query = query
+        self.fields = fields
+        self.spans: List[Span] = []
+        self.started = time.time()
+        self._finished = False
+
+    def add(self, span: Span) -> None:
+        self.spans.append(span)
+
+    @contextmanager
+    def activate(self, finish: bool = False) -> Iterator["QueryTrace"]:
+        """在此范围内记录的阶段都归入本次查询；出错或被取消时总是结束记录，finish=True 时正常退出也结束"""
+        token = _current_trace.set(self)
+        try:
+            yield self
+        except asyncio.CancelledError:
+            self.finish("cancelled")
+            raise
+        except Exception as e:
+            self.finish("error", error=f"{type(e).__name__}: {e}")
+            raise
+        else:
+            if finish:
+                self.finish()
+        finally:
+            _current_trace.reset(token)
+
+    def finish(self, status: str = "ok", **fields) -> None:
+        if self._finished:
+            return
+        self._finished = True
+        self.fields.update(fields)
+        total = time.time() - self.started
+        get_metrics().observe("query", total, status)
+        get_metrics().write_query_log({
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "query": self.query[:500],
+            "status": status,
+            "total_ms": round(total * 1000, 2),
+            **self.fields,
+            "stages": [span.to_dict() for span in self.spans],
+        })
+
+class Metrics:
+    """进程内的指标注册表：各阶段耗时、请求大小、处理条数、token 数和错误数"""
+    def __init__(self, query_log_path: str = None):
+        self._lock = threading.Lock()
+        self.duration = Histogram("rag_stage_duration_seconds", "各阶段耗时（秒）", DURATION_BUCKETS)
+        self.payload = Histogram("rag_stage_payload_bytes", "各阶段请求体大小（字节）", SIZE_BUCKETS)
+        self.calls = Counter("rag_stage_calls_total", "各阶段调用次数")
+        self.errors = Counter("rag_stage_errors_total", "各阶段出错次数")
+        self.items = Counter("rag_stage_items_total", "各阶段处理的条目数")
+        self.tokens = Counter("rag_tokens_total", "各阶段的 token 数")
+        self.events = Counter("rag_events_total", "其他事件计数（缓存命中、重试等）")
+        path = query_log_path if query_log_path is not None else os.getenv("QUERY_LOG_PATH", "./logs/queries.jsonl")
+        self.query_log_path = path or None
+        self._log_lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float, status: str = "ok", labels: Dict[str, str] = None) -> None:
+        labels = dict(labels or {}, stage=stage)
+        with self._lock:
+            self.duration.observe(seconds, labels)
+            self.calls.inc(1, dict(labels, status=status))
+            if status == "error":
+                self.errors.inc(1, labels)
+
+    def record(self, span: Span) -> None:
+        self.observe(span.stage, span.duration, span.status, span.labels)
+        labels = dict(span.labels, stage=span.stage)
+        with self._lock:
+            if span.payload_bytes is not None:
+                self.payload.observe(span.payload_bytes, labels)
+            if span.items is not None:
+                self.items.inc(span.items, labels)
+            for kind, count in span.tokens.items():
+                self.tokens.inc(count, dict(labels, kind=kind))
+
+    def count(self, event: str, value: float = 1, **labels: str) -> None:
+        with self._lock:
+            self.events.inc(value, dict(labels, event=event))
+
+    def render(self) -> str:
+        """Prometheus 文本格式"""
+        with self._lock:
+            lines = []
+            for metric in (self.duration, self.payload, self.calls, self.errors, self.items, self.tokens, self.events):
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write_query_log(self, record: Dict) -> None:
+        if not self.query_log_path:
+            return
+        line = json.dumps(record, ensure_ascii=False)
+        with self._log_lock:
+            log_dir = os.path.dirname(self.query_log_path)
+            if log_dir:
+                os.makedirs(log_dir, exist_ok=True)
+            with open(self.query_log_path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+
+_metrics: Optional[Metrics] = None
+_metrics_lock = threading.Lock()
+
+def get_metrics() -> Metrics:
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+        return _metrics
+
+@contextmanager
+def track(stage: str, **labels: str) -> Iterator[Span]:
+    """记录一次阶段调用的耗时和结果，并归入当前查询（如果有）
+
+    with track("rerank") as span:
+        ...
+        span.set(payload_bytes=len(body), items=len(documents))
+    """
+    span = Span(stage, labels)
+    started = time.perf_counter()
+    try:
+        yield span
+    except GeneratorExit:
+        # 流式输出被调用方提前关闭，不算作错误
+        span.status = "cancelled"
+        raise
+    except BaseException:
+        span.status = "error"
+        raise
+    finally:
+        span.duration = time.perf_counter() - started
+        _record(span)
+
+def record_duration(stage: str, seconds: float, items: int = None, **labels: str) -> None:
+    """记录已知耗时的阶段（例如流式生成的首 token 延迟、Elasticsearch 返回的单个索引检索耗时）"""
+    span = Span(stage, labels)
+    span.duration = seconds
+    span.set(items=items)
+    _record(span)
+
+def _record(span: Span) -> None:
+    get_metrics().record(span)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(span)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        data = get_metrics().render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+_server: Optional[ThreadingHTTPServer] = None
+
+def start_metrics_server(port: int = None, host: str = None) -> Optional[ThreadingHTTPServer]:
+    """在后台线程中提供 /metrics（Prometheus 文本格式）；METRICS_PORT 为 0 时不启动"""
+    global _server
+    port = port if port is not None else int(os.getenv("METRICS_PORT", "0"))
+    if port <= 0:
+        return None
+    with _metrics_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host or os.getenv("METRICS_HOST", "127.0.0.1"), port), _MetricsHandler)
+            except OSError as e:
+                print(f"指标服务启动失败（端口 {port}）: {str(e)}")
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+            print(f"指标服务已启动: http://{_server.server_address[0]}:{_server.server_address[1]}/metrics")
+        return _server
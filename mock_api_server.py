@@ -0,0 +1,172 @@
+"""本地模拟的 OpenAI 兼容 API 服务，用于离线基准测试
+
+提供 /embeddings、/rerank、/chat/completions（含 SSE 流式输出），延迟可配置：
+  python mock_api_server.py --port 8765 --embed-latency 30 --chat-latency 300
+然后设置 BASE_URL=http://127.0.0.1:8765/v1 即可让系统使用该服务。
+
+向量由文本的字符二元组哈希得到，相同文本总是得到相同向量，相似文本的向量也相近；
+rerank 分数为查询二元组在文档中出现的比例。
+"""
+from typing import List, Dict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import random
+import time
+import zlib
+import numpy as np
+
+def text_vector(text: str, dims: int) -> List[float]:
+    """确定性的文本向量：字符二元组哈希到 dims 维后归一化"""
+    text = text or " "
+    grams = [text[i:i + 2] for i in range(max(1, len(text) - 1))]
+    indices = [zlib.crc32(gram.encode('utf-8')) % dims for gram in grams]
+    vector = np.bincount(indices, minlength=dims).astype(np.float32)
+    vector /= np.linalg.norm(vector) or 1.0
+    return vector.tolist()
+
+def overlap_score(query: str, document: str) -> float:
+    grams = {query[i:i + 2] for i in range(max(1, len(query) - 1))}
+    if not grams:
+        return 0.0
+    return sum(1 for gram in grams if gram in document) / len(grams)
+
+class MockAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分两次写出，关闭 Nagle 算法避免与客户端的延迟确认叠加出约 40ms 的额外延迟
+    disable_nagle_algorithm = True
+    config: argparse.Namespace = None
+
+    def log_message(self, format, *args):
+        if self.config.verbose:
+            super().log_message(format, *args)
+
+    def _sleep(self, milliseconds: float) -> None:
+        if milliseconds > 0:
+            jitter = self.config.jitter
+            time.sleep(milliseconds * random.uniform(1 - jitter, 1 + jitter) / 1000)
+
+    def _send_json(self, status: int, body: Dict) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/health"):
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", "0"))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+
+        # 模拟限流，用于检验客户端的重试逻辑
+        if self.config.error_rate > 0 and random.random() < self.config.error_rate:
+            self._send_json(429, {"error": "rate limited"})
+            return
+
+        path = self.path.rstrip("/")
+        if path.endswith("/embeddings"):
+            self._embeddings(payload)
+        elif path.endswith("/rerank"):
+            self._rerank(payload)
+        elif path.endswith("/chat/completions"):
+            self._chat(payload)
+        else:
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    def _embeddings(self, payload: Dict) -> None:
+        texts = payload.get("input", "")
+        if isinstance(texts, str):
+            texts = [texts]
+        self._sleep(self.config.embed_latency + self.config.embed_item_latency * len(texts))
+        data = [
+            {"object": "embedding", "index": i, "embedding": text_vector(text, self.config.dims)}
+            for i, text in enumerate(texts)
+        ]
+        self._send_json(200, {"object": "list", "data": data, "model": payload.get("model")})
+
+    def _rerank(self, payload: Dict) -> None:
+        documents = payload.get("documents", [])
+        self._sleep(self.config.rerank_latency + self.config.rerank_item_latency * len(documents))
+        query = payload.get("query", "")
+        results = [
+            {"index": i, "relevance_score": overlap_score(query, doc)}
+            for i, doc in enumerate(documents)
+        ]
+        results.sort(key=lambda item: item["relevance_score"], reverse=True)
+        top_n = payload.get("top_n") or len(results)
+        self._send_json(200, {"results": results[:top_n]})
+
+    def _answer_tokens(self, payload: Dict) -> List[str]:
+        messages = payload.get("messages", [])
+        # VLM 请求（消息内容为列表，包含图片）返回图片描述
+        if messages and isinstance(messages[-1].get("content"), list):
+            return ["图片描述：", "模拟的", "图片", "内容"]
+        count = min(self.config.answer_tokens, payload.get("max_tokens") or self.config.answer_tokens)
+        body = ["模拟", "回答"] * (count // 2)
+        return body + ["[1]", "\n---\n", "[1] 模拟引用"]
+
+    def _chat(self, payload: Dict) -> None:
+        tokens = self._answer_tokens(payload)
+        self._sleep(self.config.chat_latency)
+        if not payload.get("stream"):
+            self._sleep(self.config.token_latency * len(tokens))
+            self._send_json(200, {
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}}],
+                "model": payload.get("model")
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in tokens:
+            self._sleep(self.config.token_latency)
+            event = {"choices": [{"index": 0, "delta": {"content": token}}]}
+            self._write_chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8'))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="本地模拟的 OpenAI 兼容 API 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dims", type=int, default=1024, help="向量维度")
+    parser.add_argument("--embed-latency", type=float, default=30, help="embedding 请求基础延迟(毫秒)")
+    parser.add_argument("--embed-item-latency", type=float, default=1, help="每段文本增加的延迟(毫秒)")
+    parser.add_argument("--rerank-latency", type=float, default=50, help="rerank 请求基础延迟(毫秒)")
+    parser.add_argument("--rerank-item-latency", type=float, default=5, help="每个文档增加的延迟(毫秒)")
+    parser.add_argument("--chat-latency", type=float, default=300, help="生成首个 token 前的延迟(毫秒)")
+    parser.add_argument("--token-latency", type=float, default=5, help="每个生成 token 的延迟(毫秒)")
+    parser.add_argument("--answer-tokens", type=int, default=200, help="每个回答的 token 数")
+    parser.add_argument("--jitter", type=float, default=0.1, help="延迟的随机浮动比例")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回 429 的比例")
+    parser.add_argument("--verbose", action="store_true", help="打印每个请求")
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    MockAPIHandler.config = args
+    server = ThreadingHTTPServer((args.host, args.port), MockAPIHandler)
+    server.daemon_threads = True
+    print(f"模拟 API 服务已启动: http://{args.host}:{server.server_address[1]}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
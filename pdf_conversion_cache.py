@@ -0,0 +1,132 @@
+from typing import Callable, Optional
+import hashlib
+import shutil
+import threading
+import uuid
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_COMPLETE_MARKER = ".complete"
+
+class PDFConversionCache:
+    """PDF → Markdown 转换结果缓存
+
+    以 PDF 内容哈希和转换器版本作为目录名，同一份 PDF 不会重复转换，不同 PDF
+    即使文件名相同也不会互相覆盖。总大小超过上限时按最近使用时间淘汰整个目录。
+    """
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, root: str = None, max_mb: float = None):
+        self.root = os.path.abspath(root or os.getenv("PDF_OUTPUT_DIR", "./output"))
+        max_mb = max_mb if max_mb is not None else float(os.getenv("PDF_CACHE_MAX_MB", "0"))
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    @classmethod
+    def default(cls) -> "PDFConversionCache":
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    @staticmethod
+    def make_key(pdf_path: str, converter_version: str) -> str:
+        digest = hashlib.sha256()
+        with open(pdf_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        digest.update(f"\n{converter_version}".encode('utf-8'))
+        return digest.hexdigest()[:32]
+
+    def entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def get(self, key: str) -> Optional[str]:
+        """命中时返回 markdown 文件路径，并刷新最近使用时间"""
+        marker = os.path.join(self.entry_dir(key), _COMPLETE_MARKER)
+        try:
+            with open(marker, 'r', encoding='utf-8') as f:
+                markdown_name = f.read().strip()
+        except OSError:
+            return None
+        markdown_path = os.path.join(self.entry_dir(key), markdown_name)
+        if not os.path.exists(markdown_path):
+            return None
+        os.utime(marker, None)
+        return markdown_path
+
+    def put(self, key: str, build: Callable[[str], str]) -> str:
+        """在临时目录中执行 build(输出目录) 生成转换结果，完成后原子地放入缓存
+
+        build 返回生成的 markdown 文件路径；本方法返回缓存中的 markdown 路径。
+        """
+        tmp_dir = os.path.join(self.root, f".tmp-{key}-{uuid.uuid4().hex[:8]}")
+        os.makedirs(tmp_dir)
+        try:
+            markdown_path = build(tmp_dir)
+            if not os.path.exists(markdown_path):
+                raise Exception("Markdown文件未生成")
+            markdown_name = os.path.relpath(markdown_path, tmp_dir)
+            with open(os.path.join(tmp_dir, _COMPLETE_MARKER), 'w', encoding='utf-8') as f:
+                f.write(markdown_name)
+
+            final_dir = self.entry_dir(key)
+            with self._lock:
+                if os.path.exists(final_dir):
+                    shutil.rmtree(final_dir, ignore_errors=True)
+                os.replace(tmp_dir, final_dir)
+        finally:
+            if os.path.exists(tmp_dir):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self.evict(keep=key)
+        return os.path.join(self.entry_dir(key), markdown_name)
+
+    @staticmethod
+    def _dir_size(path: str) -> int:
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    def evict(self, keep: str = None) -> None:
+        """总大小超过上限时删除最久未使用的转换结果（max_bytes 为 0 时不限制）"""
+        if self.max_bytes <= 0:
+            return
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.root):
+                entry = os.path.join(self.root, name)
+                marker = os.path.join(entry, _COMPLETE_MARKER)
+                if name.startswith('.') or not os.path.exists(marker):
+                    continue
+                size = self._dir_size(entry)
+                total += size
+                entries.append((os.path.getmtime(marker), name, size))
+
+            for _, name, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if name == keep:
+                    continue
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                total -= size
+                print(f"PDF 转换缓存超出上限，已删除 {name} ({size / 1024 / 1024:.1f} MB)")
+
+    def stats(self) -> dict:
+        entries = [name for name in os.listdir(self.root)
+                   if not name.startswith('.') and os.path.exists(os.path.join(self.root, name, _COMPLETE_MARKER))]
+        return {
+            "entries": len(entries),
+            "bytes": sum(self._dir_size(os.path.join(self.root, name)) for name in entries),
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,151 @@
+from typing import Optional
+import concurrent.futures
+import queue
+import subprocess
+import shutil
+import tempfile
+import threading
+import os
+from pathlib import Path
+from dotenv import load_dotenv
+from metrics import track
+
+load_dotenv()
+
+class MagicPDFEngine:
+    """常驻进程内的 magic-pdf (MinerU) 转换引擎
+
+    布局/OCR 模型只在第一次转换时加载一次，之后常驻内存；PDF 通过队列交给
+    固定数量的工作线程处理。未安装 magic_pdf Python 包时退回调用命令行。
+    """
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, workers: int = None):
+        self.workers = workers or int(os.getenv("PDF_ENGINE_WORKERS", "1"))
+        self._queue: "queue.Queue" = queue.Queue()
+        self._threads = []
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._api = None
+        self._api_checked = False
+        self._version = None
+
+    @classmethod
+    def default(cls) -> "MagicPDFEngine":
+        """进程内共享的默认引擎"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    def _load_api(self) -> Optional[dict]:
+        """导入 magic_pdf 的 Python 接口，失败时返回 None"""
+        if not self._api_checked:
+            try:
+                from magic_pdf.data.data_reader_writer import FileBasedDataWriter
+                from magic_pdf.data.dataset import PymuDocDataset
+                from magic_pdf.model.doc_analyze_by_custom_model import doc_analyze
+                from magic_pdf.config.enums import SupportedPdfParseMethod
+                self._api = {
+                    "FileBasedDataWriter": FileBasedDataWriter,
+                    "PymuDocDataset": PymuDocDataset,
+                    "doc_analyze": doc_analyze,
+                    "SupportedPdfParseMethod": SupportedPdfParseMethod,
+                }
+            except ImportError as e:
+                print(f"未找到 magic_pdf Python 接口，将使用 magic-pdf 命令行: {str(e)}")
+                self._api = None
+            self._api_checked = True
+        return self._api
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._started:
+                return
+            for i in range(max(1, self.workers)):
+                thread = threading.Thread(target=self._worker, name=f"magic-pdf-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._started = True
+
+    def _worker(self) -> None:
+        while True:
+            future, pdf_path, output_dir = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._convert(pdf_path, output_dir))
+            except Exception as e:
+                future.set_exception(e)
+
+    def submit(self, pdf_path: str, output_dir: str) -> concurrent.futures.Future:
+        """提交 PDF 转换任务，返回 Future，结果为生成的 markdown 文件路径"""
+        self._start()
+        future = concurrent.futures.Future()
+        self._queue.put((future, pdf_path, output_dir))
+        return future
+
+    def convert(self, pdf_path: str, output_dir: str) -> str:
+        """转换 PDF 并等待完成，markdown 写入 output_dir，图片写入 output_dir/images"""
+        return self.submit(pdf_path, output_dir).result()
+
+    def _convert(self, pdf_path: str, output_dir: str) -> str:
+        api = self._load_api()
+        with track("pdf_convert", mode="api" if api is not None else "cli") as span:
+            span.set(payload_bytes=os.path.getsize(pdf_path), items=1)
+            if api is None:
+                stem = Path(pdf_path).stem
+                os.makedirs(output_dir, exist_ok=True)
+                return self._convert_cli(pdf_path, output_dir, os.path.join(output_dir, f"{stem}.md"))
+            return self._convert_api(api, pdf_path, output_dir)
+
+    def _convert_api(self, api: dict, pdf_path: str, output_dir: str) -> str:
+        stem = Path(pdf_path).stem
+        os.makedirs(output_dir, exist_ok=True)
+        markdown_path = os.path.join(output_dir, f"{stem}.md")
+
+        image_dir = os.path.join(output_dir, "images")
+        image_writer = api["FileBasedDataWriter"](image_dir)
+        md_writer = api["FileBasedDataWriter"](output_dir)
+
+        with open(pdf_path, 'rb') as f:
+            pdf_bytes = f.read()
+
+        # doc_analyze 内部会缓存已加载的模型，常驻线程复用同一份模型
+        dataset = api["PymuDocDataset"](pdf_bytes)
+        if dataset.classify() == api["SupportedPdfParseMethod"].OCR:
+            pipe_result = dataset.apply(api["doc_analyze"], ocr=True).pipe_ocr_mode(image_writer)
+        else:
+            pipe_result = dataset.apply(api["doc_analyze"], ocr=False).pipe_txt_mode(image_writer)
+        pipe_result.dump_md(md_writer, f"{stem}.md", "images")
+        return markdown_path
+
+    def _convert_cli(self, pdf_path: str, output_dir: str, markdown_path: str) -> str:
+        """调用 magic-pdf 命令行转换（每次都会重新加载模型）"""
+        stem = Path(pdf_path).stem
+        # 命令行会输出到 <输出根目录>/<文件名>/auto，先输出到临时目录再移动到 output_dir
+        with tempfile.TemporaryDirectory() as tmp_root:
+            subprocess.run(["magic-pdf", "-p", pdf_path, "-o", tmp_root], check=True, cwd=Path.cwd())
+            cli_output = os.path.join(tmp_root, stem, "auto")
+            for name in os.listdir(cli_output):
+                shutil.move(os.path.join(cli_output, name), os.path.join(output_dir, name))
+        return markdown_path
+
+    def version(self) -> str:
+        """转换器版本，用于区分不同版本产生的转换结果"""
+        if self._version is None:
+            version = None
+            if self._load_api() is not None:
+                try:
+                    from magic_pdf.libs.version import __version__ as version
+                except ImportError:
+                    version = None
+            if version is None:
+                try:
+                    result = subprocess.run(["magic-pdf", "--version"], capture_output=True, text=True, timeout=60)
+                    version = result.stdout.strip() or result.stderr.strip()
+                except Exception:
+                    version = "unknown"
+            self._version = f"magic-pdf {version}"
+        return self._version
@@ -0,0 +1,103 @@
+from typing import List, Dict
+import sqlite3
+import threading
+import time
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class RerankCache:
+    """rerank 相关性分数的持久化缓存，按 (查询哈希, 文档键) 寻址
+
+    查询哈希和文档键由调用方生成：查询哈希应包含模型名和文档截断长度，文档键应包含所在索引和
+    实际发送的文本，保证缓存的分数与实际请求一致。
+    """
+    _default = None
+    _default_pid = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, db_path: str = None, max_entries: int = None):
+        self.db_path = db_path or os.getenv("RERANK_CACHE_PATH", "./cache/rerank_scores.sqlite")
+        self.max_entries = max_entries or int(os.getenv("RERANK_CACHE_MAX_ENTRIES", "200000"))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS rerank_scores (
+                query_hash TEXT NOT NULL,
+                doc_key TEXT NOT NULL,
+                score REAL NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (query_hash, doc_key)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_rerank_created ON rerank_scores(created_at)")
+        self._conn.commit()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM rerank_scores").fetchone()[0]
+
+    @classmethod
+    def default(cls) -> "RerankCache":
+        """当前进程共享的默认缓存实例（子进程中会重新打开连接）"""
+        with cls._default_lock:
+            if cls._default is None or cls._default_pid != os.getpid():
+                cls._default = cls()
+                cls._default_pid = os.getpid()
+            return cls._default
+
+    def get_many(self, query_hash: str, doc_keys: List[str]) -> Dict[str, float]:
+        """返回已缓存的分数 {文档键: 分数}"""
+        if not doc_keys:
+            return {}
+        placeholders = ",".join("?" * len(doc_keys))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT doc_key, score FROM rerank_scores WHERE query_hash = ? AND doc_key IN ({placeholders})",
+                [query_hash, *doc_keys]
+            ).fetchall()
+            scores = dict(rows)
+            self.hits += len(scores)
+            self.misses += len(set(doc_keys)) - len(scores)
+            return scores
+
+    def put_many(self, query_hash: str, scores: Dict[str, float]) -> None:
+        if not scores:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO rerank_scores (query_hash, doc_key, score, created_at) VALUES (?, ?, ?, ?)",
+                [(query_hash, doc_key, score, now) for doc_key, score in scores.items()]
+            )
+            self._entries += len(scores)
+            if self._entries > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """删除最早写入的条目，降到上限的 90%（调用方需持有锁）"""
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM rerank_scores").fetchone()[0]
+        overflow = self._entries - int(self.max_entries * 0.9)
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM rerank_scores WHERE rowid IN "
+                "(SELECT rowid FROM rerank_scores ORDER BY created_at LIMIT ?)",
+                (overflow,)
+            )
+            self._entries -= overflow
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": self._entries,
+            }
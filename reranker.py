@@ -1,48 +1,137 @@
-from typing import List, Dict
-import requests
+from typing import List, Dict, Tuple
 from dotenv import load_dotenv
+import hashlib
 import os
+from http_client import get_client
+from rerank_cache import RerankCache
+from token_counter import truncate_to_tokens
+from metrics import track, get_metrics
 
 load_dotenv()
 
 class Reranker:
-    def __init__(self):
-        self.api_key = os.getenv("API_KEY")
-        self.api_base = os.getenv("BASE_URL")
-        
-    def rerank(self, query: str, documents: List[Dict], index_name: str, top_k: int = 5) -> List[Dict]:
-        """使用SiliconFlow的rerank API重排序文档"""
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
+    def __init__(self, cache: RerankCache = None, use_cache: bool = None):
+        self.client = get_client()
+        self.model = "BAAI/bge-reranker-v2-m3"
+        # 发送给 rerank 模型的每个文档的 token 上限，0 表示不截断
+        self.max_doc_tokens = int(os.getenv("RERANK_MAX_TOKENS", "512"))
+        # 检索分数在第 top_k 和第 top_k+1 个文档之间的差距（相对最高分）不小于该值时跳过重排序，0 表示总是重排序
+        self.skip_margin = float(os.getenv("RERANK_SKIP_MARGIN", "0"))
+        if use_cache is None:
+            use_cache = os.getenv("RERANK_CACHE", "true").lower() not in ("0", "false", "no")
+        self.cache = (cache or RerankCache.default()) if use_cache else None
+
+    def _query_hash(self, query: str) -> str:
+        """缓存键中的查询部分：模型和截断长度不同时分数不可复用"""
+        key = f"{self.model}\n{self.max_doc_tokens}\n{query}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _doc_key(self, doc: Dict) -> str:
+        """缓存键中的文档部分：所在索引加上实际发送的文本
+
+        不能只用片段 ID：旧索引的 ID（doc_0、doc_1…）在各知识库之间重复，重建后也会复用。
+        """
+        key = f"{doc.get('index', '')}\n{self._doc_text(doc)}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _doc_text(self, doc: Dict) -> str:
+        if self.max_doc_tokens > 0:
+            return truncate_to_tokens(doc['content'], self.max_doc_tokens)
+        return doc['content']
+
+    def _is_decisive(self, documents: List[Dict], top_k: int) -> bool:
+        """检索分数在截断位置的差距足够大时，重排序不会改变入选的文档"""
+        if self.skip_margin <= 0 or len(documents) <= top_k:
+            return False
+        scores = sorted((doc['score'] for doc in documents), reverse=True)
+        if scores[0] <= 0:
+            return False
+        return (scores[top_k - 1] - scores[top_k]) / scores[0] >= self.skip_margin
+
+    def _build_payload(self, query: str, documents: List[Dict], top_k: int) -> Dict:
+        """构建 rerank API 的请求体"""
+        # 准备文档列表（按 token 上限截断）
+        docs = [self._doc_text(doc) for doc in documents]
+
+        return {
+            "model": self.model,
+            "query": query,
+            "documents": docs,
+            "top_n": top_k
         }
-        
-        # 准备文档列表
-        docs = [doc['content'] for doc in documents]
-        
-        response = requests.post(
-            f"{self.api_base}/rerank",
-            headers=headers,
-            json={
-                "model": "BAAI/bge-reranker-v2-m3",
-                "query": query,
-                "documents": docs,
-                "top_n": top_k
-            }
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"Error in reranking: {response.text}")
-            
-        # 处理结果
-        results = response.json()["results"]
-        reranked_docs = []
-        
+
+    def _cached_scores(self, query: str, documents: List[Dict]) -> Tuple[Dict[int, float], List[int]]:
+        """返回 (缓存中已有的分数 {文档位置: 分数}, 需要调用 API 的文档位置)"""
+        if self.cache is None:
+            return {}, list(range(len(documents)))
+        keys = [self._doc_key(doc) for doc in documents]
+        cached = self.cache.get_many(self._query_hash(query), keys)
+        scores = {}
+        missing = []
+        for pos, key in enumerate(keys):
+            if key in cached:
+                scores[pos] = cached[key]
+            else:
+                missing.append(pos)
+        return scores, missing
+
+    def _apply_results(self, query: str, documents: List[Dict], missing: List[int],
+                       results: List[Dict], scores: Dict[int, float]) -> None:
+        """把 API 返回的分数写入 scores 和缓存；results 中的 index 对应 missing 中的位置"""
+        new_scores = {}
         for result in results:
-            doc_index = result["index"]
-            original_doc = documents[doc_index].copy()
-            original_doc['rerank_score'] = result["relevance_score"]
-            original_doc['index_name'] = index_name  
+            pos = missing[result["index"]]
+            scores[pos] = result["relevance_score"]
+            new_scores[self._doc_key(documents[pos])] = result["relevance_score"]
+        if self.cache is not None:
+            self.cache.put_many(self._query_hash(query), new_scores)
+
+    def _select(self, documents: List[Dict], scores: Dict[int, float], index_name: str, top_k: int) -> List[Dict]:
+        """按相关性分数取前 top_k 个文档"""
+        reranked_docs = []
+        for pos in sorted(scores, key=lambda p: scores[p], reverse=True)[:top_k]:
+            original_doc = documents[pos].copy()
+            original_doc['rerank_score'] = scores[pos]
+            original_doc['index_name'] = index_name
             reranked_docs.append(original_doc)
-            
-        return reranked_docs 
\ No newline at end of file
+        return reranked_docs
+
+    def _select_by_retrieval(self, documents: List[Dict], index_name: str, top_k: int) -> List[Dict]:
+        """跳过重排序时直接按检索分数取前 top_k 个文档"""
+        print("检索分数差距足够大，跳过重排序")
+        get_metrics().count("rerank_skipped")
+        selected = []
+        for doc in sorted(documents, key=lambda d: d['score'], reverse=True)[:top_k]:
+            doc = doc.copy()
+            doc['index_name'] = index_name
+            selected.append(doc)
+        return selected
+
+    def rerank(self, query: str, documents: List[Dict], index_name: str, top_k: int = 5) -> List[Dict]:
+        """使用SiliconFlow的rerank API重排序文档，已缓存分数的文档不再重复打分"""
+        if not documents:
+            return []
+        if self._is_decisive(documents, top_k):
+            return self._select_by_retrieval(documents, index_name, top_k)
+
+        scores, missing = self._cached_scores(query, documents)
+        get_metrics().count("rerank_cache_hit", len(scores))
+        if missing:
+            # 请求所有未缓存文档的分数，以便全部写入缓存
+            payload = self._build_payload(query, [documents[pos] for pos in missing], len(missing))
+            with track("rerank") as span:
+                span.set(payload_bytes=sum(len(doc.encode('utf-8')) for doc in payload["documents"]), items=len(missing))
+                response = self.client.post("/rerank", json=payload, category="rerank")
+
+                if response.status_code != 200:
+                    raise Exception(f"Error in reranking: {response.text}")
+
+                results = response.json()["results"]
+            self._apply_results(query, documents, missing, results, scores)
+
+        # 处理结果
+        return self._select(documents, scores, index_name, top_k)
+
+    def cache_stats(self) -> Dict:
+        """返回缓存命中统计，未启用缓存时返回空字典"""
+        return self.cache.stats() if self.cache else {}
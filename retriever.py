@@ -1,99 +1,59 @@
 from typing import List, Dict, Tuple
-import requests
-from elasticsearch import Elasticsearch
-import os
+import heapq
 from dotenv import load_dotenv
+from embedder import Embedder
+from storage_backend import StorageBackend, get_backend
+from kb_router import KBRouter
+from metrics import track
 
 load_dotenv()
 
 class Retriever:
-    def __init__(self):
-        # 使用与 vector_store.py 相同的 ES 配置
-        self.es = Elasticsearch(
-            "https://localhost:9200",  # 注意是 https
-            basic_auth=("elastic", os.getenv("PASSWORD")),  # 使用相同的密码
-            verify_certs=False  # 开发环境可以禁用证书验证
-        )
-        self.api_key = os.getenv("API_KEY")
-        self.api_base = os.getenv("BASE_URL")
+    def __init__(self, backend: StorageBackend = None, router: KBRouter = None):
+        # 与 VectorStore 使用同一个存储后端
+        self.backend = backend or get_backend()
+        self.embedder = Embedder()
+        self.router = router or KBRouter.default()
         
     def get_embedding(self, text: str) -> List[float]:
-        """调用SiliconFlow的embedding API获取向量"""
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(
-            f"{self.api_base}/embeddings",
-            headers=headers,
-            json={
-                "model": "BAAI/bge-m3",
-                "input": text
-            }
-        )
-        
-        if response.status_code == 200:
-            return response.json()["data"][0]["embedding"]
-        else:
-            raise Exception(f"Error getting embedding: {response.text}")
+        """调用SiliconFlow的embedding API获取向量（经由共享缓存）"""
+        return self.embedder.get_embedding(text)
     
     def get_all_indices(self) -> List[str]:
         """获取所有 RAG 相关的索引"""
-        indices = self.es.indices.get_alias().keys()
-        return [idx for idx in indices if idx.startswith('rag_')]
+        return self.backend.list_indices()
         
-    def retrieve(self, query: str, top_k: int = 10) -> Tuple[List[Dict], str]:
-        """混合检索：结合 BM25 和向量检索"""
-        # 获取所有 RAG 索引
-        indices = self.get_all_indices()
-        if not indices:
-            raise Exception("没有找到可用的文档索引！")
+    def route(self, indices: List[str], query: str, query_vector: List[float]) -> List[str]:
+        """按知识库路由摘要选出最相关的知识库"""
+        with track("route") as span:
+            selected = self.router.route(indices, query, query_vector)
+            span.set(items=len(selected))
+        return selected
+    
+    def retrieve(self, query: str, top_k: int = 10, indices: List[str] = None) -> Tuple[List[Dict], str]:
+        """混合检索：结合 BM25 和向量检索
+
+        indices 为用户指定的检索范围，只检索这些索引；未指定时由知识库路由从所有 RAG 索引中选择。
+        """
+        scoped = bool(indices)
+        if not scoped:
+            # 获取所有 RAG 索引
+            indices = self.get_all_indices()
+            if not indices:
+                raise Exception("没有找到可用的文档索引！")
             
         # 计算查询向量
         query_vector = self.get_embedding(query)
+        if not scoped:
+            indices = self.route(indices, query, query_vector)
         
-        # 在所有索引中搜索
-        all_results = []
-        for index in indices:
-            # 构建混合查询
-            script_query = {
-                "script_score": {
-                    "query": {
-                        "match": {
-                            "content": query  # BM25
-                        }
-                    },
-                    "script": {
-                        "source": "cosineSimilarity(params.query_vector, 'vector') + 1.0",
-                        "params": {"query_vector": query_vector}
-                    }
-                }
-            }
-            
-            # 执行检索
-            response = self.es.search(
-                index=index,
-                body={
-                    "query": script_query,
-                    "size": top_k
-                }
-            )
-            
-            # 处理结果
-            for hit in response['hits']['hits']:
-                result = {
-                    'id': hit['_id'],
-                    'content': hit['_source']['content'],
-                    'score': hit['_score'],
-                    'metadata': hit['_source']['metadata'],
-                    'index': index
-                }
-                all_results.append(result)
+        # 在选中的索引中检索（Elasticsearch 后端合并为一次 _msearch 请求）
+        with track("search", backend=self.backend.name) as span:
+            all_results = self.backend.search(indices, query, query_vector, top_k)
+            span.set(items=len(all_results))
         
-        # 按分数排序并选择最相关的文档
-        all_results.sort(key=lambda x: x['score'], reverse=True)
-        top_results = all_results[:top_k]
+        # 用堆选出分数最高的 top_k 个文档
+        top_results = heapq.nlargest(top_k, all_results, key=lambda x: x['score'])
         
         # 如果有结果，返回最相关文档所在的索引
         if top_results:
@@ -101,4 +61,4 @@ class Retriever:
         else:
             most_relevant_index = indices[0]  # 如果没有结果，返回第一个索引
             
-        return top_results, most_relevant_index 
\ No newline at end of file
+        return top_results, most_relevant_index
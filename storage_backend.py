@@ -0,0 +1,92 @@
+from typing import List, Dict, Iterable, Callable, Optional
+from abc import ABC, abstractmethod
+import threading
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class StorageBackend(ABC):
+    """向量存储后端接口
+
+    VectorStore 负责向量化并构建写入操作，Retriever 负责计算查询向量，
+    具体的存储、删除和检索由后端实现。写入操作的格式与 Elasticsearch bulk 相同：
+    {"_op_type": "index", "_index": ..., "_id": ..., "_source": {"content", "vector", "metadata"}}。
+    """
+    name = "base"
+
+    @abstractmethod
+    def list_indices(self) -> List[str]:
+        """返回所有 RAG 相关的索引（以 rag_ 开头）"""
+
+    @abstractmethod
+    def index_exists(self, index_name: str) -> bool:
+        """索引是否存在"""
+
+    @abstractmethod
+    def create_index(self, index_name: str) -> None:
+        """创建空索引，已存在时先删除；实现需要调用 _index_dropped 清空旧的路由摘要"""
+
+    def _index_dropped(self, index_name: str) -> None:
+        """索引被删除或重建后清空其知识库路由摘要"""
+        from kb_router import KBRouter
+        router = KBRouter.default()
+        router.reset(index_name)
+        router.save()
+
+    def ensure_index(self, index_name: str) -> None:
+        """创建索引（如果不存在）"""
+        if not self.index_exists(index_name):
+            self.create_index(index_name)
+
+    @abstractmethod
+    def bulk_index(self, actions: Iterable[Dict], index_name: str,
+                   on_indexed: Optional[Callable[[str, Dict], None]] = None,
+                   on_deleted: Optional[Callable[[str, Dict], None]] = None) -> Dict:
+        """写入一批操作，返回 {"indexed": 成功数, "failed": 失败数, "errors": 失败条目}
+
+        actions 可能是覆盖整次导入的生成器，实现应流式消费，内存占用不随写入量增长。
+        on_indexed 在每个文档确认写入成功后以 (索引名, _source) 调用，失败的文档不会回调。
+        覆盖已有 ID 时，被替换的旧文档以 (索引名, {"content", "vector"}) 调用 on_deleted；
+        取不到旧文档的实现只对新建的文档调用 on_indexed（片段 ID 由内容决定，覆盖前后内容相同）。
+        """
+
+    @abstractmethod
+    def delete_chunks(self, index_name: str, chunk_ids: List[str],
+                      on_deleted: Optional[Callable[[str, Dict], None]] = None) -> None:
+        """按 ID 批量删除文档片段，不存在的 ID 忽略
+
+        on_deleted 在每个文档确认删除后以 (索引名, {"content", "vector"}) 调用。
+        """
+
+    @abstractmethod
+    def get_files(self, index_name: str) -> List[str]:
+        """返回索引中的所有文件名（已排序）"""
+
+    @abstractmethod
+    def search(self, indices: List[str], query: str, query_vector: List[float], top_k: int) -> List[Dict]:
+        """在多个索引中混合检索，每个索引最多返回 top_k 条
+
+        返回的文档格式：{"id", "content", "score", "metadata", "index"}
+        """
+
+_backends: Dict[str, StorageBackend] = {}
+_backends_lock = threading.Lock()
+
+def get_backend(name: str = None) -> StorageBackend:
+    """返回当前进程共享的存储后端，由 STORAGE_BACKEND 选择（elasticsearch 或 local）
+
+    只导入所选后端的依赖，local 模式下不需要安装或连接 Elasticsearch。
+    """
+    name = (name or os.getenv("STORAGE_BACKEND", "elasticsearch")).lower()
+    with _backends_lock:
+        if name not in _backends:
+            if name in ("elasticsearch", "es"):
+                from es_backend import ElasticsearchBackend
+                _backends[name] = ElasticsearchBackend()
+            elif name == "local":
+                from local_backend import LocalBackend
+                _backends[name] = LocalBackend()
+            else:
+                raise Exception(f"未知的存储后端: {name}（可选 elasticsearch 或 local）")
+        return _backends[name]
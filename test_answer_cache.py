@@ -0,0 +1,43 @@
+from answer_cache import AnswerCache
+
+
+def _vector(dims, hot=0):
+    return [1.0 if i == hot else 0.0 for i in range(dims)]
+
+
+def _docs(index_name="rag_a"):
+    return [{'content': "片段", 'index': index_name}]
+
+
+def test_vectors_of_another_dimension_are_dropped(tmp_path):
+    path = str(tmp_path / "answers.sqlite")
+    old = AnswerCache(path)
+    new = AnswerCache(path)
+    old.put("问题", _vector(8), "旧回答", _docs(), 1.0)
+    # 另一个进程换了 embedding 模型后写入的条目
+    new.put("问题", _vector(16), "新回答", _docs(), 1.0)
+
+    assert old.lookup(_vector(16)) is None
+    assert old.stats()["entries"] == 0
+    old.put("问题", _vector(16), "回答", _docs(), 1.0)
+    assert old.lookup(_vector(16))[0] == "回答"
+
+    reopened = AnswerCache(path)
+    assert reopened.lookup(_vector(16))[0] == "新回答"
+    assert reopened.lookup(_vector(8)) is None
+
+
+def test_writes_to_any_kb_in_scope_invalidate(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite"))
+    cache.put("问题", _vector(8), "路由回答", _docs("rag_a"), 1.0)
+    cache.put("问题", _vector(8), "选定回答", _docs("rag_a"), 1.0, ["rag_a", "rag_b"])
+    cache.put("问题", _vector(8), "单库回答", _docs("rag_a"), 1.0, ["rag_a"])
+
+    # rag_b 没有被引用，但在两个回答的检索范围内
+    cache.invalidate_index("rag_b")
+    assert cache.lookup(_vector(8)) is None
+    assert cache.lookup(_vector(8), ["rag_b", "rag_a"]) is None
+    assert cache.lookup(_vector(8), ["rag_a"])[0] == "单库回答"
+
+    cache.invalidate_index("rag_a")
+    assert cache.lookup(_vector(8), ["rag_a"]) is None
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import threading
+from http.server import ThreadingHTTPServer
+import pytest
+import metrics
+from async_rag import AsyncRAGSystem
+from http_client import HttpClient
+from kb_router import KBRouter
+from mock_api_server import MockAPIHandler, build_parser
+from vector_store import VectorStore
+
+QUERIES = ["向量检索的延迟", "知识库索引缓存", "重排序模型", "文档生成查询"]
+
+
+@pytest.fixture(scope="module")
+def mock_api():
+    MockAPIHandler.config = build_parser().parse_args([
+        "--embed-latency", "0", "--embed-item-latency", "0", "--rerank-latency", "0",
+        "--rerank-item-latency", "0", "--chat-latency", "0", "--token-latency", "1",
+        "--answer-tokens", "5", "--jitter", "0",
+    ])
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockAPIHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield MockAPIHandler.config, f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def rag(mock_api, tmp_path, monkeypatch):
+    """使用模拟 API 和本地存储后端、已写入一个知识库的 AsyncRAGSystem"""
+    config, base_url = mock_api
+    for name, value in {
+        "BASE_URL": base_url, "API_KEY": "test", "STORAGE_BACKEND": "local",
+        "LOCAL_INDEX_DIR": str(tmp_path / "index"), "KB_ROUTING_PATH": str(tmp_path / "kb_routing.json"),
+        "EMBEDDING_CACHE": "false", "RERANK_CACHE": "false", "ANSWER_CACHE": "false",
+    }.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(HttpClient, "_default", None)
+    monkeypatch.setattr(KBRouter, "_default", None)
+    monkeypatch.setattr(metrics, "_metrics", metrics.Metrics(query_log_path=str(tmp_path / "queries.jsonl")))
+    for name in ("chat_latency", "rerank_latency"):
+        monkeypatch.setattr(config, name, getattr(config, name))
+
+    chunks = [{"content": f"{query}的说明，第 {i} 段", "metadata": {"file_name": "a.md", "source": "a.md"}}
+              for i, query in enumerate(QUERIES * 3)]
+    VectorStore().store(chunks, "rag_docs")
+    return AsyncRAGSystem()
+
+
+def _query_log(tmp_path):
+    with open(tmp_path / "queries.jsonl", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_concurrent_queries(rag, tmp_path):
+    async def run():
+        async with rag:
+            return await rag.query_many(QUERIES)
+
+    results = asyncio.run(run())
+
+    for answer, docs in results:
+        assert isinstance(answer, str) and answer
+        assert docs and all(doc["index_name"] == "rag_docs" for doc in docs)
+    assert [record["status"] for record in _query_log(tmp_path)] == ["ok"] * len(QUERIES)
+
+
+def test_stage_timeout(rag, mock_api, tmp_path):
+    config, _ = mock_api
+    config.rerank_latency = 500
+    rag.rerank_timeout = 0.05
+
+    async def run():
+        async with rag:
+            await rag.query(QUERIES[0])
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(run())
+    record, = _query_log(tmp_path)
+    assert record["status"] == "error"
+    assert [stage["stage"] for stage in record["stages"]][-1] == "rerank"
+
+
+def test_cancelled_query(rag, mock_api, tmp_path):
+    config, _ = mock_api
+    config.chat_latency = 2000
+
+    async def run():
+        async with rag:
+            task = asyncio.create_task(rag.query(QUERIES[0]))
+            await asyncio.sleep(0.5)
+            task.cancel()
+            await task
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(run())
+    record, = _query_log(tmp_path)
+    assert record["status"] == "cancelled"
+
+
+def test_closed_stream_is_cancelled(rag, tmp_path):
+    async def run():
+        async with rag:
+            stream, docs = await rag.query_stream(QUERIES[0])
+            first = await stream.__anext__()
+            await stream.aclose()
+            return first, docs
+
+    first, docs = asyncio.run(run())
+
+    assert first and docs
+    record, = _query_log(tmp_path)
+    assert record["status"] == "cancelled"
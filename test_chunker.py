@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+import pytest
+import token_counter
+from chunker import StructuredChunker
+from token_counter import count_tokens
+
+
+@pytest.fixture(autouse=True)
+def heuristic_tokens(monkeypatch):
+    """固定使用估算计数，结果不依赖本机安装的分词器"""
+    monkeypatch.setenv("TOKEN_COUNTER", "heuristic")
+    monkeypatch.setattr(token_counter, "_encoding", None)
+    monkeypatch.setattr(token_counter, "_encoding_checked", False)
+
+
+def test_heading_before_oversized_paragraph():
+    chunker = StructuredChunker(max_tokens=50, min_tokens=10, overlap_tokens=10)
+    paragraph = "这是一个很长的段落" * 30
+    pieces = chunker.split_text("## A\n\nintro\n\n## C\n\n" + paragraph)
+
+    assert pieces[0] == "## A\n\nintro"
+    assert len(pieces) > 2
+    for piece in pieces[1:]:
+        # 标题不单独成片，段落切出的每个片段都带上所属的标题
+        assert piece.startswith("## C\n")
+        assert piece.split("\n", 1)[1].strip()
+        assert count_tokens(piece) <= 50
+    assert "".join(piece.split("\n", 1)[1].strip() for piece in pieces[1:]).replace("\n", "").count("段落") >= 30
+
+
+def _doc(text, header="", source="a.md", img_url=None):
+    return SimpleNamespace(page_content=text,
+                           metadata={'source': source, 'chunk_header': header, 'img_url': img_url})
+
+
+def test_image_chunks_are_never_split_or_merged():
+    chunker = StructuredChunker(max_tokens=50, min_tokens=20, overlap_tokens=10)
+    description = "图片描述" * 40
+    docs = [_doc("# A\n短文本", "A"), _doc(description, "A", img_url="/abs/a.png"), _doc("又一段短文本", "A")]
+    results = chunker.split(docs)
+
+    assert [content for content, _ in results] == ["# A\n短文本", description, "又一段短文本"]
+    assert results[1][1]['img_url'] == "/abs/a.png"
+
+
+def test_small_sibling_sections_merge_under_common_header():
+    chunker = StructuredChunker(max_tokens=100, min_tokens=30, overlap_tokens=10)
+    docs = [_doc("## B\n内容一", "A > B"), _doc("## C\n内容二", "A > C"), _doc("### G\n内容三", "E > F > G")]
+    results = chunker.split(docs)
+
+    assert results[0] == ("## B\n内容一\n## C\n内容二", {'source': "a.md", 'chunk_header': "A", 'img_url': None})
+    # 不是兄弟或父子章节，不合并
+    assert results[1] == ("### G\n内容三", {'source': "a.md", 'chunk_header': "E > F > G", 'img_url': None})
+
+
+def test_overlap_only_when_cut_inside_paragraph():
+    chunker = StructuredChunker(max_tokens=40, min_tokens=10, overlap_tokens=8)
+    paragraphs = ["第一段" + "甲" * 30, "第二段" + "乙" * 30]
+    pieces = chunker.split_text("\n\n".join(paragraphs))
+    # 在段落边界切分，没有重叠
+    assert pieces == paragraphs
+
+    pieces = chunker.split_text("。".join(f"第{i}句" + "字" * 12 for i in range(6)))
+    assert len(pieces) > 1
+    for previous, piece in zip(pieces, pieces[1:]):
+        # 切分点在段落内部，下一片段以前一片段结尾 overlap_tokens 个字开头
+        assert piece.startswith(previous[-8:])
+
+
+def test_no_chunk_exceeds_max_tokens(monkeypatch):
+    monkeypatch.setenv("CHUNK_MAX_TOKENS", "60")
+    chunker = StructuredChunker()
+    text = "\n\n".join(
+        f"## 第{i}节\n" + ("这是一个没有标点的很长的句子" * i if i % 2 else "短句。" * i + "\nenglish words here " * i)
+        for i in range(1, 12))
+    docs = [_doc(text, "A")] + [_doc(f"### 小节{i}\n内容", f"A > {i}") for i in range(5)]
+    results = chunker.split(docs)
+
+    assert chunker.max_tokens == 60
+    assert len(results) > 5
+    assert all(count_tokens(content) <= 60 for content, _ in results)
@@ -0,0 +1,41 @@
+import numpy as np
+from kb_router import KBRouter
+from local_backend import LocalBackend
+
+
+def _actions(index_name, count):
+    rng = np.random.default_rng(0)
+    return [{
+        "_op_type": "index", "_index": index_name, "_id": f"chunk-{i}",
+        "_source": {
+            "content": f"hello 检索 片段{i}",
+            "vector": rng.normal(size=8).tolist(),
+            "metadata": {"file_name": "a.md", "source": "a.md", "chunk_header": "", "img_url": ""},
+        },
+    } for i in range(count)]
+
+
+def test_reingesting_same_chunks_keeps_summary(tmp_path, monkeypatch):
+    monkeypatch.setenv("KB_ROUTING_PATH", str(tmp_path / "routing.json"))
+    monkeypatch.setattr(KBRouter, "_default", None)
+    router = KBRouter.default()
+    backend = LocalBackend(root=str(tmp_path / "index"))
+    backend.create_index("rag_a")
+
+    for _ in range(3):
+        backend.bulk_index(_actions("rag_a", 3), "rag_a",
+                           on_indexed=router.add_source, on_deleted=router.remove_source)
+        router.save()
+        summary = router._summaries["rag_a"]
+        assert summary["chunks"] == 3
+        assert sum(summary["counts"]) == 3
+        assert summary["terms"]["hello"] == 3
+
+    backend.delete_chunks("rag_a", ["chunk-0"], on_deleted=router.remove_source)
+    assert router._summaries["rag_a"]["chunks"] == 2
+    assert router._summaries["rag_a"]["terms"]["hello"] == 2
+
+    # 重建索引时清空摘要
+    backend.create_index("rag_a")
+    assert "rag_a" not in router._summaries
+    assert "rag_a" not in KBRouter(str(tmp_path / "routing.json"))._summaries
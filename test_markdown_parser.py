@@ -0,0 +1,56 @@
+import os
+from legacy_markdown_parser import legacy_process_markdown
+from document_processor import DocumentLoader
+from markdown_parser import parse_markdown, IMAGE_PLACEHOLDER
+
+
+def _resolve(path):
+    return f"/abs/{path}"
+
+
+def test_image_path_with_spaces():
+    chunks = list(parse_markdown('# A\n![fig](my image.png)\n![t](other pic.png "标题")', _resolve))
+
+    assert [chunk['img_url'] for chunk in chunks] == [None, "/abs/my image.png", "/abs/other pic.png"]
+    assert chunks[1]['content'] == IMAGE_PLACEHOLDER
+    assert chunks[1]['headers'] == ("A",)
+
+
+def test_headers_and_images_inside_fences_are_text():
+    text = "# A\n```python\n# 注释\n![x](a.png)\n```\n~~~\n## 不是标题\n~~~\n## B\n正文"
+    chunks = list(parse_markdown(text, _resolve))
+
+    assert len(chunks) == 2
+    assert chunks[0]['headers'] == ("A",)
+    assert "# 注释" in chunks[0]['content'] and "## 不是标题" in chunks[0]['content']
+    assert all(chunk['img_url'] is None for chunk in chunks)
+    assert chunks[1]['headers'] == ("A", "B")
+
+
+def test_inline_image_splits_surrounding_text():
+    chunks = list(parse_markdown("前面的文字 ![x](a.png) 后面的文字", _resolve))
+
+    assert [(chunk['content'], chunk['img_url']) for chunk in chunks] == [
+        ("前面的文字", None),
+        (IMAGE_PLACEHOLDER, "/abs/a.png"),
+        ("后面的文字", None),
+    ]
+
+
+def test_matches_legacy_parser_without_fences(tmp_path, monkeypatch):
+    # 不请求 VLM，只比较分块结果
+    monkeypatch.setattr(DocumentLoader, "_process_images_concurrently", lambda self, chunks, refs: None)
+    (tmp_path / "a.png").write_bytes(b"png")
+    (tmp_path / "b c.png").write_bytes(b"png")
+    path = str(tmp_path / "doc.md")
+    text = ("# 一\n介绍\n\n![图](a.png)\n## 二\n段落\n![图](b c.png)\n![缺失](missing.png)\n"
+            "### 三\n内容\n# 四\n![远程](https://example.com/x.png)\n结尾\n")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+    expected = legacy_process_markdown(text, path)
+    loader = DocumentLoader(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        for chunks in (loader.process_markdown(text), loader.process_markdown(f)):
+            assert [{**chunk, 'headers': list(chunk['headers'])} for chunk in chunks] == expected
+    assert [os.path.basename(chunk['img_url']) for chunk in expected if chunk['img_url']] == ["a.png", "b c.png"]
@@ -0,0 +1,128 @@
+from typing import List
+import re
+import threading
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 中日韩字符按每字一个 token 计；英文单词和数字按每 4 个字符一个 token 计；其他符号各计一个
+_TOKEN_PATTERN = re.compile(r"[一-鿿぀-ヿ가-힯]|[A-Za-z0-9]+|[^\sA-Za-z0-9一-鿿぀-ヿ가-힯]")
+
+_encoding = None
+_encoding_checked = False
+_encoding_lock = threading.Lock()
+
+# embedding 模型 BAAI/bge-m3 使用的分词器（XLM-RoBERTa SentencePiece）
+BGE_M3_TOKENIZER = "BAAI/bge-m3"
+
+class _HFTokenizer:
+    """tokenizers 库加载的 bge-m3 分词器，不计入首尾的特殊 token"""
+    def __init__(self, tokenizer):
+        tokenizer.no_truncation()
+        self.tokenizer = tokenizer
+
+    def count(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        offsets = self.tokenizer.encode(text, add_special_tokens=False).offsets
+        return text if len(offsets) <= max_tokens else text[:offsets[max_tokens - 1][1]]
+
+class _Tiktoken:
+    def __init__(self, encoding):
+        self.encoding = encoding
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        tokens = self.encoding.encode(text)
+        return text if len(tokens) <= max_tokens else self.encoding.decode(tokens[:max_tokens])
+
+def _load_bge_m3(download: bool):
+    """加载 bge-m3 分词器：优先使用 TOKENIZER_PATH 指向的 tokenizer.json，其次是本地的 Hugging Face 缓存；
+    download 为 True 时缓存中没有会从 Hugging Face 下载"""
+    from tokenizers import Tokenizer
+    path = os.getenv("TOKENIZER_PATH")
+    if path:
+        if os.path.isdir(path):
+            path = os.path.join(path, "tokenizer.json")
+        return Tokenizer.from_file(path)
+    if download:
+        return Tokenizer.from_pretrained(BGE_M3_TOKENIZER)
+    from huggingface_hub import hf_hub_download
+    return Tokenizer.from_file(hf_hub_download(BGE_M3_TOKENIZER, "tokenizer.json", local_files_only=True))
+
+def _get_encoding():
+    """按 TOKEN_COUNTER 选择分词器，无法加载时返回 None（使用估算方式）
+
+    - auto（默认）：本地有 bge-m3 分词器（TOKENIZER_PATH 或 Hugging Face 缓存）时使用，不联网
+    - bge-m3：使用 bge-m3 分词器，本地没有时从 Hugging Face 下载
+    - tiktoken：使用 tiktoken 的 cl100k_base（需要已安装并缓存编码文件）
+    - heuristic：始终使用估算方式
+    """
+    global _encoding, _encoding_checked
+    with _encoding_lock:
+        if not _encoding_checked:
+            mode = os.getenv("TOKEN_COUNTER", "auto").lower()
+            try:
+                if mode in ("auto", "bge-m3"):
+                    _encoding = _HFTokenizer(_load_bge_m3(download=mode == "bge-m3"))
+                elif mode == "tiktoken":
+                    import tiktoken
+                    _encoding = _Tiktoken(tiktoken.get_encoding("cl100k_base"))
+            except Exception as e:
+                if mode != "auto" or os.getenv("TOKENIZER_PATH"):
+                    print(f"无法加载 {mode} 分词器，改用估算方式计算 token 数: {str(e)}")
+            _encoding_checked = True
+        return _encoding
+
+def _piece_tokens(piece: str) -> int:
+    if piece.isascii() and piece.isalnum():
+        return (len(piece) + 3) // 4
+    return 1
+
+def count_tokens(text: str) -> int:
+    """计算文本的 token 数
+
+    能加载 bge-m3 分词器时按 embedding 模型的实际 token 数计算。否则使用不依赖分词器的估算：
+    中日韩字符每字一个 token，英文单词和数字每 4 个字符一个 token。bge-m3 的 SentencePiece
+    词表会把常见的中文词合并为一个 token，因此估算值对中文通常偏高，用于分块和预算时更保守。
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.count(text)
+    return sum(_piece_tokens(match.group()) for match in _TOKEN_PATTERN.finditer(text))
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """截取文本开头不超过 max_tokens 个 token 的部分"""
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.truncate(text, max_tokens)
+
+    used = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        used += _piece_tokens(match.group())
+        if used > max_tokens:
+            return text[:match.start()].rstrip()
+    return text
+
+# 英文和数字按单词切分；中文没有分词器，按单字 + 相邻二字切分
+_WORD_PATTERN = re.compile(r"[a-z0-9]+|[一-鿿]+")
+
+def tokenize(text: str) -> List[str]:
+    """BM25 检索和知识库路由共用的简单分词"""
+    tokens = []
+    for match in _WORD_PATTERN.finditer(text.lower()):
+        word = match.group()
+        if word.isascii():
+            tokens.append(word)
+        else:
+            tokens.extend(word)
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
@@ -208,7 +208,7 @@ if knowledge_bases:
             if os.path.exists(normalized_path):
                 try:
                     with st.spinner(f"正在添加文档到 '{selected_kb_to_add}'..."):
-                        rag_system.process_documents(add_doc_path, selected_kb_to_add.lower().strip())
+                        rag_system.process_documents(add_doc_path, selected_kb_to_add.lower().strip(), incremental=True)
                     st.sidebar.success(f"文档已添加到 '{selected_kb_to_add}'！")
                     st.cache_data.clear()
                     st.rerun()
@@ -228,10 +228,11 @@ st.divider()
 if not knowledge_bases:
     st.info("请先在左侧侧边栏创建或选择一个知识库。")
 else:
-    # 选择知识库进行对话
-    kb_names_list = list(knowledge_bases.keys())
+    # 选择知识库进行对话：选中某个知识库时只在该知识库中检索，选择全部时自动选出最相关的知识库
+    all_kbs_option = "全部知识库（自动选择）"
+    kb_names_list = [all_kbs_option] + list(knowledge_bases.keys())
     if 'selected_kb_chat' not in st.session_state or st.session_state.selected_kb_chat not in kb_names_list:
-        st.session_state.selected_kb_chat = kb_names_list[0]
+        st.session_state.selected_kb_chat = kb_names_list[1]
 
     st.session_state.selected_kb_chat = st.selectbox(
         "选择对话知识库",
@@ -239,7 +240,12 @@ else:
         index=kb_names_list.index(st.session_state.selected_kb_chat),
         key="chat_kb_selector"
     )
-    st.info(f"当前对话知识库: **{st.session_state.selected_kb_chat}** (检索时将查询所有可用知识库)")
+    if st.session_state.selected_kb_chat == all_kbs_option:
+        chat_index_names = None
+        st.info("当前将根据问题自动选择最相关的知识库进行检索")
+    else:
+        chat_index_names = [knowledge_bases[st.session_state.selected_kb_chat]["index_name"]]
+        st.info(f"当前对话知识库: **{st.session_state.selected_kb_chat}** (仅在该知识库中检索)")
 
     # 初始化聊天记录
     if "messages" not in st.session_state:
@@ -275,18 +281,26 @@ else:
             response_container = st.container()
             try:
                 with st.spinner("思考中..."):
-                    # 获取回答 (原始文本)
-                    response_text, reranked_docs = rag_system.query(prompt)
-                    
-                    # Parse and render the response within the container
-                    with response_container:
-                        parse_and_render_llm_response(response_text)
+                    # 检索和重排序完成后开始流式生成
+                    response_stream, reranked_docs = rag_system.query_stream(prompt, chat_index_names)
+                
+                # 逐段渲染生成中的回答，生成结束后再完整解析图片和引用
+                streaming_placeholder = st.empty()
+                response_text = ""
+                for token in response_stream:
+                    response_text += token
+                    streaming_placeholder.markdown(response_text + "▌")
+                streaming_placeholder.empty()
+                
+                # Parse and render the response within the container
+                with response_container:
+                    parse_and_render_llm_response(response_text)
                     
-                    # 将原始回答添加到聊天记录
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": response_text, # Store only the raw response text
-                    })
+                # 将原始回答添加到聊天记录
+                st.session_state.messages.append({
+                    "role": "assistant",
+                    "content": response_text, # Store only the raw response text
+                })
                     
             except Exception as e:
                 error_message = f"处理您的问题时出错: {str(e)}"
@@ -1,82 +1,59 @@
-from typing import List, Dict
-import requests
-import numpy as np
-from elasticsearch import Elasticsearch
-import urllib3
+from typing import List, Dict, Iterable, Iterator
 from dotenv import load_dotenv
 import os
+from embedder import Embedder
+from ingest_manifest import chunk_id
+from storage_backend import StorageBackend, get_backend
+from kb_router import KBRouter
+from metrics import track, get_metrics
 
 load_dotenv()
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
 class VectorStore:
-    def __init__(self):
-        # ES 8.x 的连接配置
-        self.es = Elasticsearch(
-            "https://localhost:9200",
-            basic_auth=("elastic", os.getenv("PASSWORD")),
-            verify_certs=False,
-            request_timeout=30,
-            # 忽略系统索引警告
-            headers={"accept": "application/vnd.elasticsearch+json; compatible-with=8"},
-        )
-        self.api_key = os.getenv("API_KEY")
-        self.api_base = os.getenv("BASE_URL")
+    def __init__(self, embedding_batch_size: int = None, embedding_workers: int = None,
+                 backend: StorageBackend = None):
+        # 存储后端由 STORAGE_BACKEND 选择：elasticsearch（默认）或 local
+        self.backend = backend or get_backend()
+        self.embedder = Embedder(batch_size=embedding_batch_size, max_workers=embedding_workers)
+        # 写入时同步更新知识库路由摘要
+        self.router = KBRouter.default()
+        # 每个窗口向量化的文档数，与 bulk 请求的文档数上限一致
+        self.bulk_chunk_size = int(os.getenv("BULK_CHUNK_SIZE", "200"))
         
     def get_embedding(self, text: str) -> List[float]:
-        """调用SiliconFlow的embedding API获取向量"""
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(
-            f"{self.api_base}/embeddings",
-            headers=headers,
-            json={
-                "model": "BAAI/bge-m3",
-                "input": text
-            }
-        )
-        
-        if response.status_code == 200:
-            return response.json()["data"][0]["embedding"]
-        else:
-            raise Exception(f"Error getting embedding: {response.text}")
+        """调用SiliconFlow的embedding API获取向量（经由共享缓存）"""
+        return self.embedder.get_embedding(text)
     
-    def store(self, documents: List[Dict], index_name: str) -> None:
-        """将文档存储到 Elasticsearch"""
-        # 创建索引（如果不存在）
-        if not self.es.indices.exists(index=index_name):
-            self.create_index(index_name)
-        
-        # 获取当前索引中的文档数量
-        try:
-            response = self.es.count(index=index_name)
-            last_id = response['count'] - 1  # 文档数量减1作为最后的ID
-            if last_id < 0:
-                last_id = -1
-        except Exception as e:
-            print(f"获取文档数量时出错，假设为-1: {str(e)}")
-            last_id = -1
-        
-        # 批量索引文档
-        bulk_data = []
-        for i, doc in enumerate(documents, start=last_id + 1):
-            # 获取文档向量
-            vector = self.get_embedding(doc['content'])
-            
-            # 准备索引数据
-            bulk_data.append({
-                "index": {
-                    "_index": index_name,
-                    "_id": f"doc_{i}"
-                }
-            })
-            
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """分批并发获取多段文本的向量，结果与输入顺序一致"""
+        return self.embedder.get_embeddings(texts)
+    
+    def _iter_actions(self, documents: Iterable[Dict], index_name: str) -> Iterator[Dict]:
+        """按窗口分批计算向量并逐条生成 bulk 操作，内存中只保留一个窗口的数据"""
+        window = []
+        for doc in documents:
+            window.append(doc)
+            if len(window) >= self.bulk_chunk_size:
+                yield from self._window_actions(window, index_name)
+                window = []
+        if window:
+            yield from self._window_actions(window, index_name)
+    
+    def _window_actions(self, window: List[Dict], index_name: str) -> Iterator[Dict]:
+        # 批量获取文档向量
+        vectors = self.get_embeddings([doc['content'] for doc in window])
+        for doc, vector in zip(window, vectors):
+            yield self.build_action(doc, vector, index_name)
+    
+    def build_action(self, doc: Dict, vector: List[float], index_name: str) -> Dict:
+        """构建单个文档的 bulk 写入操作"""
+        # 使用由内容确定的稳定 ID，重复写入同一片段时会覆盖而不是重复
+        return {
+            "_op_type": "index",
+            "_index": index_name,
+            "_id": doc.get('id') or chunk_id(doc),
             # 构建文档数据，确保包含所有元数据字段
-            doc_data = {
+            "_source": {
                 "content": doc['content'],
                 "vector": vector,
                 "metadata": {
@@ -86,78 +63,43 @@ class VectorStore:
                     "img_url": doc['metadata'].get('img_url', '')
                 }
             }
-            bulk_data.append(doc_data)
-            
-        # 批量写入
-        if bulk_data:
-            response = self.es.bulk(operations=bulk_data, refresh=True)
-            if response.get('errors'):
-                print("批量写入时出现错误：", response)
+        }
+    
+    def store(self, documents: Iterable[Dict], index_name: str) -> Dict:
+        """将文档流式写入存储后端
+
+        documents 可以是列表或生成器；按窗口分批向量化后交给后端批量写入。
+        返回写入成功数、失败数和失败条目。
+        """
+        self.ensure_index(index_name)
+        return self.bulk_index(self._iter_actions(documents, index_name), index_name)
+    
+    def ensure_index(self, index_name: str) -> None:
+        """创建索引（如果不存在）"""
+        self.backend.ensure_index(index_name)
+    
+    def bulk_index(self, actions: Iterable[Dict], index_name: str) -> Dict:
+        """批量写入操作，返回 {"indexed", "failed", "errors"}"""
+        with track("bulk_index", backend=self.backend.name) as span:
+            result = self.backend.bulk_index(actions, index_name, on_indexed=self.router.add_source,
+                                             on_deleted=self.router.remove_source)
+            span.set(items=result["indexed"])
+        self.router.save()
+        if result["failed"]:
+            get_metrics().count("bulk_index_failed", result["failed"], backend=self.backend.name)
+        return result
+    
+    def delete_chunks(self, index_name: str, chunk_ids: List[str]) -> None:
+        """按 ID 批量删除文档片段"""
+        with track("delete_chunks", backend=self.backend.name) as span:
+            span.set(items=len(chunk_ids))
+            self.backend.delete_chunks(index_name, chunk_ids, on_deleted=self.router.remove_source)
+        self.router.save()
     
     def get_files_in_index(self, index_name: str) -> List[str]:
         """获取索引中的所有文件名"""
         try:
-            response = self.es.search(
-                index=index_name,
-                body={
-                    "size": 0,
-                    "aggs": {
-                        "unique_files": {
-                            "terms": {
-                                "field": "metadata.file_name",
-                                "size": 1000
-                            }
-                        }
-                    }
-                }
-            )
-            
-            files = [bucket['key'] for bucket in response['aggregations']['unique_files']['buckets']]
-            return sorted(files)
+            return self.backend.get_files(index_name)
         except Exception as e:
             print(f"获取文件列表时出错: {str(e)}")
             return []
-
-    def create_index(self, index_name: str):
-        """创建 Elasticsearch 索引"""
-        settings = {
-            "mappings": {
-                "properties": {
-                    "content": {"type": "text"},
-                    "vector": {
-                        "type": "dense_vector",
-                        "dims": 1024
-                    },
-                    "metadata": {
-                        "properties": {
-                            "file_name": {
-                                "type": "keyword",
-                                "ignore_above": 256
-                            },
-                            "source": {
-                                "type": "keyword"
-                            },
-                            "chunk_header": {  # 新增标题层级字段
-                                "type": "text",
-                                "fields": {
-                                    "keyword": {
-                                        "type": "keyword",
-                                        "ignore_above": 512
-                                    }
-                                }
-                            },
-                            "img_url": {
-                                "type": "keyword",
-                                "ignore_above": 2048
-                            }
-                        }
-                    }
-                }
-            }
-        }
-        
-        # 如果索引已存在，先删除
-        if self.es.indices.exists(index=index_name):
-            self.es.indices.delete(index=index_name)
-        
-        self.es.indices.create(index=index_name, body=settings) 
\ No newline at end of file